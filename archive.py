@@ -0,0 +1,304 @@
+"""Bulk export and import of every chat.
+
+Archives are gzip-compressed JSON Lines: a header, then each session
+followed by its messages and its LangGraph checkpoint rows. Both directions
+stream row by row through their own SQLite connection, so memory stays flat
+however many chats there are, and both are meant to run off the UI thread.
+
+Importing skips what is already there: sessions are matched by thread id,
+their messages by position and checkpoint rows by primary key, so an
+interrupted import can simply be run again. Chats can also be exported as
+a zip of Markdown files for reading; that format is not importable.
+
+    python archive.py export chats.jsonl.gz
+    python archive.py import chats.jsonl.gz
+"""
+import argparse
+import base64
+import gzip
+import io
+import json
+import os
+import re
+import sys
+import time
+import zipfile
+
+from store import DB_PATH, _connect
+
+FORMAT = "ollama-chat-archive"
+VERSION = 1
+CHECKPOINT_TABLES = ("checkpoints", "writes")
+COMMIT_EVERY = 2000         # imported rows per transaction
+
+
+# ── Helpers ──────────────────────────────────────────
+def _encode(names, row) -> dict:
+    return {k: {"b64": base64.b64encode(v).decode()}
+            if isinstance(v, bytes) else v for k, v in zip(names, row)}
+
+
+def _decode(value):
+    return base64.b64decode(value["b64"]) if isinstance(value, dict) else value
+
+
+def _tables(conn) -> set:
+    return {name for name, in conn.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table'")}
+
+
+def write_markdown(f, title, messages):
+    """Write one chat as Markdown; `messages` yields (role, content, ts)."""
+    f.write(f"# {title}\n\n")
+    for role, text, ts in messages:
+        label = "**Tú**" if role == "user" else "**Ollama**"
+        f.write(f"### {label} · {ts}\n{text}\n\n---\n\n")
+
+
+def _export(store, path, write_session, opener, progress, cancel):
+    """Shared export loop: one read snapshot, sessions in id order."""
+    conn = _connect(store.path)
+    tmp = path + ".part"
+    stats = {"sessions": 0, "messages": 0, "checkpoints": 0,
+             "cancelled": False}
+    try:
+        # A single read transaction keeps the export consistent while the
+        # app goes on writing
+        conn.execute("BEGIN")
+        total = conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+        tables = _tables(conn)
+        with opener(tmp, total) as out:
+            for session in conn.execute(
+                    "SELECT id, title, thread_id, created, updated, titled, "
+                    "summary, summary_upto FROM sessions ORDER BY id"):
+                if cancel is not None and cancel.is_set():
+                    stats["cancelled"] = True
+                    break
+                write_session(out, conn, tables, session, stats)
+                stats["sessions"] += 1
+                if progress is not None:
+                    progress(stats["sessions"], total)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    finally:
+        conn.close()
+    if stats["cancelled"]:
+        os.remove(tmp)
+    else:
+        os.replace(tmp, path)
+    return stats
+
+
+# ── Export ───────────────────────────────────────────
+def export_jsonl(store, path, progress=None, cancel=None) -> dict:
+    """Write every session, message and checkpoint of `store` to `path`.
+
+    `progress(done, total)` is called after each session; setting `cancel`
+    stops early and leaves no file behind.
+    """
+    def write_session(out, conn, tables, session, stats):
+        sid, title, thread_id, created, updated, *extra = session
+        out.write(json.dumps({"type": "session", "title": title,
+                              "thread_id": thread_id, "created": created,
+                              "updated": updated,
+                              **dict(zip(("titled", "summary", "summary_upto"),
+                                         extra))},
+                             ensure_ascii=False) + "\n")
+        for role, content, ts in conn.execute(
+                "SELECT role, content, ts FROM messages "
+                "WHERE session_id = ? ORDER BY id", (sid,)):
+            out.write(json.dumps({"type": "message", "role": role,
+                                  "content": content, "ts": ts},
+                                 ensure_ascii=False) + "\n")
+            stats["messages"] += 1
+        for table in CHECKPOINT_TABLES:
+            if table not in tables:
+                continue
+            cur = conn.execute(f"SELECT * FROM {table} WHERE thread_id = ?",
+                               (thread_id,))
+            names = [d[0] for d in cur.description]
+            for row in cur:
+                out.write(json.dumps({"type": table,
+                                      "row": _encode(names, row)}) + "\n")
+                stats["checkpoints"] += 1
+
+    def opener(tmp, total):
+        out = gzip.open(tmp, "wt", encoding="utf-8")
+        out.write(json.dumps({"type": "header", "format": FORMAT,
+                              "version": VERSION, "created": time.time(),
+                              "sessions": total}) + "\n")
+        return out
+
+    return _export(store, path, write_session, opener, progress, cancel)
+
+
+def export_markdown(store, path, progress=None, cancel=None) -> dict:
+    """Write every session to a zip with one Markdown file per chat."""
+    def write_session(out, conn, tables, session, stats):
+        sid, title = session[:2]
+        name = re.sub(r'[\\/:*?"<>|\s]+', " ", title).strip()[:60] or "chat"
+        with out.open(f"{sid:05d} - {name}.md", "w") as raw:
+            f = io.TextIOWrapper(raw, encoding="utf-8")
+            rows = conn.execute("SELECT role, content, ts FROM messages "
+                                "WHERE session_id = ? ORDER BY id", (sid,))
+            write_markdown(f, title, rows)
+            f.flush()
+            f.detach()
+        stats["messages"] += conn.execute(
+            "SELECT COUNT(*) FROM messages WHERE session_id = ?",
+            (sid,)).fetchone()[0]
+
+    def opener(tmp, total):
+        return zipfile.ZipFile(tmp, "w", zipfile.ZIP_DEFLATED)
+
+    return _export(store, path, write_session, opener, progress, cancel)
+
+
+# ── Import ───────────────────────────────────────────
+def import_jsonl(store, path, new_id, progress=None, cancel=None) -> dict:
+    """Merge the archive at `path` into `store`.
+
+    `new_id()` hands out ids for sessions that don't exist yet. The result
+    lists those as `new` rows shaped like `ChatStore.list_sessions()`
+    and the ids of existing
+    sessions that received messages as `updated`. Raises ValueError for
+    files that aren't archives.
+    """
+    stats = {"sessions": 0, "messages": 0, "checkpoints": 0, "new": [],
+             "updated": set(), "cancelled": False}
+    # Messages still queued would be missed when counting what a session
+    # already has, and then imported twice
+    store.flush()
+    conn = _connect(store.path)
+    columns = {}                # checkpoint table -> its column names
+    session = None              # (id, messages to skip, existing)
+    pending = 0
+    try:
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            try:
+                header = json.loads(f.readline())
+            except (OSError, ValueError):
+                header = {}
+            if header.get("format") != FORMAT:
+                raise ValueError("no es un archivo de chats exportado")
+            if header.get("version", 0) > VERSION:
+                raise ValueError("archivo de una versión más reciente")
+            total = header.get("sessions") or 0
+
+            for line in f:
+                rec = json.loads(line)
+                kind = rec.get("type")
+                if kind == "session":
+                    if cancel is not None and cancel.is_set():
+                        stats["cancelled"] = True
+                        break
+                    session = _import_session(conn, rec, new_id, stats)
+                    stats["sessions"] += 1
+                    if progress is not None:
+                        progress(stats["sessions"], total)
+                elif kind == "message" and session is not None:
+                    sid, skip, existing = session
+                    if skip:
+                        session = (sid, skip - 1, existing)
+                        continue
+                    conn.execute(
+                        "INSERT INTO messages (session_id, role, content, ts) "
+                        "VALUES (?, ?, ?, ?)",
+                        (sid, rec["role"], rec["content"], rec["ts"]))
+                    stats["messages"] += 1
+                    if existing:
+                        stats["updated"].add(sid)
+                elif kind in CHECKPOINT_TABLES:
+                    if kind not in columns:
+                        columns[kind] = _checkpoint_columns(store, conn, kind)
+                    row = {k: _decode(v) for k, v in rec["row"].items()
+                           if k in columns[kind]}
+                    cur = conn.execute(
+                        f"INSERT OR IGNORE INTO {kind} ({', '.join(row)}) "
+                        f"VALUES ({', '.join('?' * len(row))})",
+                        tuple(row.values()))
+                    stats["checkpoints"] += cur.rowcount
+                else:
+                    continue
+                pending += 1
+                if pending >= COMMIT_EVERY:
+                    conn.commit()
+                    pending = 0
+        conn.commit()
+    finally:
+        conn.close()
+    return stats
+
+
+def _import_session(conn, rec, new_id, stats):
+    row = conn.execute(
+        "SELECT id, (SELECT COUNT(*) FROM messages WHERE session_id = s.id) "
+        "FROM sessions s WHERE thread_id = ?", (rec["thread_id"],)).fetchone()
+    if row is not None:
+        # Already here: only messages past the ones it has are new
+        return row[0], row[1], True
+    sid = new_id()
+    conn.execute("INSERT INTO sessions (id, title, thread_id, created, "
+                 "updated, titled, summary, summary_upto) "
+                 "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                 (sid, rec["title"], rec["thread_id"], rec["created"],
+                  rec["updated"], rec.get("titled", 0),
+                  rec.get("summary", ""), rec.get("summary_upto", 0)))
+    stats["new"].append((sid, rec["title"], rec["thread_id"],
+                         rec.get("titled", 0), rec.get("summary", ""),
+                         rec.get("summary_upto", 0)))
+    return sid, 0, False
+
+
+def _checkpoint_columns(store, conn, table) -> set:
+    if table not in _tables(conn):
+        # Creates LangGraph's tables in a database that never had a reply;
+        # release our write lock first so its setup can run
+        conn.commit()
+        store.checkpointer
+    return {name for _, name, *_ in conn.execute(f"PRAGMA table_info({table})")}
+
+
+# ── CLI ──────────────────────────────────────────────
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export or import every "
+                                                 "chat as one archive")
+    parser.add_argument("action", choices=("export", "import"))
+    parser.add_argument("path", help="archive file (.jsonl.gz, or .zip "
+                                     "with --markdown)")
+    parser.add_argument("--db", default=DB_PATH,
+                        help="SQLite file holding the chats")
+    parser.add_argument("--markdown", action="store_true",
+                        help="export a zip of Markdown files instead")
+    args = parser.parse_args(argv)
+
+    from store import ChatStore
+    store = ChatStore(args.db)
+
+    def progress(done, total):
+        print(f"\r{done}/{total or '?'} chats", end="", file=sys.stderr)
+
+    try:
+        if args.action == "export":
+            fn = export_markdown if args.markdown else export_jsonl
+            stats = fn(store, args.path, progress)
+        else:
+            next_id = store.max_session_id()
+
+            def new_id():
+                nonlocal next_id
+                next_id += 1
+                return next_id
+            stats = import_jsonl(store, args.path, new_id, progress)
+            stats = {**stats, "new": len(stats["new"]),
+                     "updated": len(stats["updated"])}
+    finally:
+        store.close()
+    print(file=sys.stderr)
+    print(json.dumps(stats))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+"""Large file attachments, answered by map-reduce.
+
+A file attached to a chat is never put into a prompt whole. It is scanned
+once into token-sized chunks: small files are read in one go, big ones
+memory-mapped, so only the pages being hashed are ever resident. Each chunk
+is then condensed into notes by its own model call (the map step, run in
+parallel by the engine), and the notes of every chunk are combined to
+answer the question (the reduce step).
+
+Notes don't depend on the question, so they are cached by chunk content:
+follow-up questions about the same file only pay for the reduce step, and
+an edited file only for the chunks that changed.
+"""
+import hashlib
+import mmap
+import os
+import threading
+from collections import OrderedDict
+
+from history import MESSAGE_OVERHEAD, count_text_tokens
+
+CHUNK_TOKENS = int(os.environ.get("OLLAMA_ATTACH_CHUNK_TOKENS", "2000"))
+REDUCE_TOKENS = 1500        # notes that go into the final prompt
+MMAP_BYTES = 1_000_000      # files from this size on are memory-mapped
+MAX_ATTACH_BYTES = 200_000_000
+PASTE_CHARS = 20_000        # longer pastes become an attachment
+MAX_SCANS = 32              # scanned files remembered
+NOTES_ENTRIES = 50_000      # chunk notes kept by the app's on-disk cache
+
+_scans: OrderedDict = OrderedDict()
+_scans_lock = threading.Lock()
+
+MAP_PROMPT = (
+    "Toma notas del siguiente fragmento de un archivo. Conserva los datos "
+    "concretos: nombres, cifras, fechas, errores, funciones y valores. Sé "
+    "conciso y no añadas nada que no esté en el fragmento.\n\n"
+    "Fragmento:\n{text}\n\nNotas:")
+COLLAPSE_PROMPT = (
+    "Combina estas notas de partes de un mismo archivo en unas notas más "
+    "breves. Conserva sobre todo lo que sirva para responder la pregunta."
+    "\n\nPregunta: {question}\n\n{notes}\n\nNotas combinadas:")
+
+
+# ── Scanning ─────────────────────────────────────────
+def _cut(buf, start, limit) -> int:
+    """End of the chunk starting at `start`: the last line break (or else
+    space) in its second half, never in the middle of a UTF-8 sequence."""
+    end = start + limit
+    if end >= len(buf):
+        return len(buf)
+    for sep in (b"\n", b" "):
+        pos = buf.rfind(sep, start + limit // 2, end)
+        if pos != -1:
+            return pos + 1
+    while end > start + 1 and buf[end] & 0xC0 == 0x80:
+        end -= 1
+    return end
+
+
+def split(buf, max_tokens=CHUNK_TOKENS):
+    """Yield (start, end) byte ranges of `buf`, each at most `max_tokens`.
+
+    Uses the same estimate as the history budget (count_text_tokens);
+    UTF-8 has at least one byte per character, so a byte budget never
+    underestimates a chunk.
+    """
+    limit = max((max_tokens - MESSAGE_OVERHEAD) * 4, 16)
+    start = 0
+    while start < len(buf):
+        end = _cut(buf, start, limit)
+        yield start, end
+        start = end
+
+
+def scan(path, max_tokens=CHUNK_TOKENS, cancel=None) -> tuple:
+    """(start, end, sha1) of every chunk of the text file at `path`.
+
+    Results are kept per (path, size, mtime), so scanning a file again for
+    a follow-up question is free. Raises ValueError for files that are too
+    big or don't look like text.
+    """
+    st = os.stat(path)
+    if st.st_size > MAX_ATTACH_BYTES:
+        raise ValueError(f"{os.path.basename(path)}: más de "
+                         f"{MAX_ATTACH_BYTES // 1_000_000} MB")
+    key = (os.path.abspath(path), st.st_size, st.st_mtime_ns, max_tokens)
+    with _scans_lock:
+        if key in _scans:
+            _scans.move_to_end(key)
+            return _scans[key]
+    chunks = _scan(path, st.st_size, max_tokens, cancel)
+    if chunks is None:
+        # Cancelled midway; the partial result isn't kept
+        return ()
+    with _scans_lock:
+        _scans[key] = chunks
+        while len(_scans) > MAX_SCANS:
+            _scans.popitem(last=False)
+    return chunks
+
+
+def _scan(path, size, max_tokens, cancel):
+    if size == 0:
+        return ()
+    with open(path, "rb") as f:
+        if b"\0" in f.read(8192):
+            raise ValueError(f"{os.path.basename(path)} no parece un "
+                             "archivo de texto")
+        f.seek(0)
+        buf = (mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+               if size >= MMAP_BYTES else f.read())
+        try:
+            chunks = []
+            for start, end in split(buf, max_tokens):
+                if cancel is not None and cancel.is_set():
+                    return None
+                chunks.append((start, end,
+                               hashlib.sha1(buf[start:end]).hexdigest()))
+            return tuple(chunks)
+        finally:
+            if isinstance(buf, mmap.mmap):
+                buf.close()
+
+
+def read_chunk(path, start, end) -> str:
+    with open(path, "rb") as f:
+        f.seek(start)
+        return f.read(end - start).decode("utf-8", errors="replace")
+
+
+# ── Map and reduce ───────────────────────────────────
+def notes_key(model: str, sha: str) -> str:
+    """Cache key for the notes `model` took on the chunk with hash `sha`."""
+    return hashlib.sha256(f"{model}\0{MAP_PROMPT}\0{sha}".encode()).hexdigest()
+
+
+def map_prompt(text: str) -> str:
+    return MAP_PROMPT.format(text=text)
+
+
+def label(name, first, last, total) -> str:
+    parts = f"parte {first + 1}" if first == last \
+        else f"partes {first + 1}–{last + 1}"
+    return f"[{name} · {parts}/{total}]"
+
+
+def collapse_groups(items, max_tokens=REDUCE_TOKENS) -> list:
+    """Runs of consecutive `items` from the same file, each within
+    `max_tokens`; items are (name, first, last, total, text)."""
+    groups, size = [], 0
+    for item in items:
+        cost = count_text_tokens(item[4])
+        if groups and groups[-1][-1][0] == item[0] \
+                and size + cost <= max_tokens:
+            groups[-1].append(item)
+            size += cost
+        else:
+            groups.append([item])
+            size = cost
+    return groups
+
+
+def collapse_prompt(question: str, group) -> str:
+    return COLLAPSE_PROMPT.format(question=question,
+                                  notes=format_notes(group))
+
+
+def format_notes(items) -> str:
+    return "\n\n".join(f"{label(*item[:4])}\n{item[4]}" for item in items)
+
+
+def notes_tokens(items) -> int:
+    return sum(count_text_tokens(item[4]) for item in items)
@@ -0,0 +1,171 @@
+"""Headless batch runner: send a file of prompts through the chat graph.
+
+    python batch.py prompts.jsonl -m llama3 -o results.jsonl -c 4
+
+Input is JSONL (`{"id": ..., "prompt": ..., "model": ..., "thread_id": ...}`,
+only `prompt` required) or CSV with `id` and `prompt` columns. Each prompt
+runs on its own LangGraph thread unless it names one. Results are appended
+to the output file as they finish; rerunning with the same output skips
+prompts that already completed.
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from ollama_api import MAX_PARALLEL
+
+
+def read_prompts(path):
+    """Yield prompt records from a JSONL or CSV file, one at a time."""
+    with open(path, encoding="utf-8", newline="") as f:
+        if path.lower().endswith(".csv"):
+            rows = csv.DictReader(f)
+        else:
+            rows = (json.loads(line) for line in f if line.strip())
+        for n, row in enumerate(rows, 1):
+            row.setdefault("id", n)
+            row["id"] = str(row["id"])
+            yield row
+
+
+def completed_ids(path):
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                rec = json.loads(line)
+            except json.JSONDecodeError:
+                # Partial line from a crash mid-write
+                continue
+            if "error" not in rec:
+                done.add(str(rec["id"]))
+    return done
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    k = (len(values) - 1) * p / 100
+    lo, hi = int(k), min(int(k) + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (k - lo)
+
+
+def _unanswered(engine, thread_id, prompt) -> bool:
+    """Whether `thread_id` ends with `prompt` and no reply to it."""
+    from langchain_core.messages import HumanMessage
+    config = {"configurable": {"thread_id": thread_id}}
+    messages = engine.graph.get_state(config).values.get("messages", [])
+    return bool(messages) and isinstance(messages[-1], HumanMessage) \
+        and messages[-1].content == prompt
+
+
+def run(args):
+    from langgraph.checkpoint.memory import MemorySaver
+
+    from engine import ChatEngine
+
+    if args.db:
+        from store import ChatStore
+        checkpointer = ChatStore(args.db).checkpointer
+    else:
+        checkpointer = MemorySaver()
+    cache = None
+    if args.cache:
+        from cache import ResponseCache
+        cache = ResponseCache(args.cache)
+    engine = ChatEngine(checkpointer, cache=cache)
+
+    done = completed_ids(args.output)
+    out = open(args.output, "a", encoding="utf-8")
+    out_lock = threading.Lock()
+    latencies, ttfts = [], []
+    counts = {"ok": 0, "error": 0, "skipped": 0}
+
+    def job(rec):
+        model = rec.get("model") or args.model
+        thread_id = rec.get("thread_id") or f"batch_{rec['id']}"
+        row = {"id": rec["id"], "model": model}
+        try:
+            if _unanswered(engine, thread_id, rec["prompt"]):
+                # A failed earlier run already put the prompt on the thread
+                result = engine.regenerate(thread_id, model)
+            else:
+                result = engine.generate(rec["prompt"], thread_id, model)
+            row.update(response=result["text"], latency=result["latency"],
+                       ttft=result["ttft"], tps=result["tps"],
+                       prompt_tokens=result["prompt_tokens"],
+                       prefix_tokens=result["prefix_tokens"],
+                       prompt_eval=result["ollama"].get("prompt_eval_count"))
+        except Exception as e:
+            row["error"] = str(e)
+        with out_lock:
+            out.write(json.dumps(row, ensure_ascii=False) + "\n")
+            out.flush()
+        return row
+
+    def collect(futures):
+        for fut in futures:
+            row = fut.result()
+            if "error" in row:
+                counts["error"] += 1
+                print(f"✗ {row['id']}: {row['error']}", file=sys.stderr)
+                continue
+            counts["ok"] += 1
+            latencies.append(row["latency"])
+            if row["ttft"] is not None:
+                ttfts.append(row["ttft"])
+
+    start = time.perf_counter()
+    in_flight = set()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        for rec in read_prompts(args.input):
+            if rec["id"] in done:
+                counts["skipped"] += 1
+                continue
+            # Bound the number of queued prompts so huge files stream through
+            if len(in_flight) >= args.concurrency * 2:
+                finished, in_flight = wait(in_flight,
+                                           return_when=FIRST_COMPLETED)
+                collect(finished)
+            in_flight.add(pool.submit(job, rec))
+        collect(wait(in_flight).done)
+    elapsed = time.perf_counter() - start
+    out.close()
+
+    print(f"\n{counts['ok']} ok · {counts['error']} errors · "
+          f"{counts['skipped']} skipped (already done) · {elapsed:.1f} s")
+    if latencies:
+        print(f"throughput   {counts['ok'] / elapsed:.2f} prompts/s")
+        print("latency (s)  " + "  ".join(
+            f"p{p}={percentile(latencies, p):.2f}" for p in (50, 90, 99)))
+    if ttfts:
+        print("ttft (s)     " + "  ".join(
+            f"p{p}={percentile(ttfts, p):.2f}" for p in (50, 90, 99)))
+    return 1 if counts["error"] else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("input", help="prompts file (.jsonl or .csv)")
+    parser.add_argument("-m", "--model", required=True,
+                        help="default model for prompts without one")
+    parser.add_argument("-o", "--output", default="results.jsonl",
+                        help="results file (JSONL, appended)")
+    parser.add_argument("-c", "--concurrency", type=int, default=MAX_PARALLEL,
+                        help="prompts in flight at once")
+    parser.add_argument("--db", help="persist threads to this SQLite file")
+    parser.add_argument("--cache", metavar="PATH",
+                        help="reuse replies from this response cache file")
+    return run(parser.parse_args(argv))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
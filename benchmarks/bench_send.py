@@ -0,0 +1,74 @@
+"""Per-send and session-switch UI latency vs. chat length.
+
+Fills a session with N messages, times the switch into it (`_rebuild_chat`),
+then times how long `_send` takes to put the new user bubble on screen.
+No Ollama server is needed: model discovery and generation are replaced
+by stubs.
+
+    python benchmarks/bench_send.py
+"""
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import customtkinter as ctk  # noqa: E402
+
+import main  # noqa: E402
+
+SIZES = (10, 100, 1000)
+SENDS = 5
+SAMPLE = ("Here is **some bold** text and `inline code`.\n\n"
+          "```python\nprint('hello')\n```\nAnd a closing line.")
+
+
+class BenchApp(main.OllamaInterface):
+    def _start_discovery(self):
+        self._on_models(["bench"])
+
+    def _generate(self, *args):
+        pass
+
+
+def bench(app, n):
+    session = app.sessions[app.active_id]
+    session["history"] = [("user" if i % 2 == 0 else "ai", SAMPLE, "00:00")
+                          for i in range(n)]
+    t0 = time.perf_counter()
+    app._rebuild_chat(session)
+    app.root.update_idletasks()
+    switch_ms = (time.perf_counter() - t0) * 1000
+    app.root.update()
+
+    samples = []
+    for _ in range(SENDS):
+        app._clear_ph()
+        app.prompt_box.configure(state="normal")
+        app.prompt_box.insert("0.0", "benchmark prompt")
+        t0 = time.perf_counter()
+        app._send()
+        app.root.update_idletasks()
+        samples.append((time.perf_counter() - t0) * 1000)
+        app._hide_typing()
+        app._set_busy(session, False)
+    return switch_ms, samples
+
+
+def run():
+    root = ctk.CTk()
+    root.withdraw()
+    app = BenchApp(root, db_path=os.path.join(tempfile.mkdtemp(), "bench.db"))
+    print(f"{'messages':>8}  {'switch ms':>10}  {'send median ms':>15}  "
+          f"{'send max ms':>12}")
+    for n in SIZES:
+        switch_ms, samples = bench(app, n)
+        print(f"{n:>8}  {switch_ms:>10.1f}  {statistics.median(samples):>15.1f}  "
+              f"{max(samples):>12.1f}")
+    app.on_close()
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,52 @@
+"""Startup cost: import time of `main` and time to first paint.
+
+Each run happens in a fresh interpreter so module caches don't hide import
+cost. Also reports whether LangChain/LangGraph were loaded before the
+window appeared (they should not be). Ollama does not need to be running.
+
+    python benchmarks/bench_startup.py
+"""
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+RUNS = 5
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+CHILD = r"""
+import json, os, sys, tempfile, time
+t0 = time.perf_counter()
+sys.path.insert(0, {root!r})
+import main
+t_import = time.perf_counter() - t0
+root = main.ctk.CTk()
+app = main.OllamaInterface(root, db_path=os.path.join(tempfile.mkdtemp(), "bench.db"))
+root.update()
+t_paint = time.perf_counter() - t0
+heavy = any(m.startswith(("langchain", "langgraph")) for m in sys.modules)
+print(json.dumps({{"import": t_import, "paint": t_paint, "llm_stack": heavy}}))
+app.on_close()
+"""
+
+
+def run_once():
+    out = subprocess.run([sys.executable, "-c", CHILD.format(root=ROOT)],
+                         capture_output=True, text=True, check=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def run():
+    results = [run_once() for _ in range(RUNS)]
+    imports = [r["import"] * 1000 for r in results]
+    paints = [r["paint"] * 1000 for r in results]
+    print(f"{'':>16}  {'median ms':>10}  {'max ms':>8}")
+    print(f"{'import main':>16}  {statistics.median(imports):>10.1f}  {max(imports):>8.1f}")
+    print(f"{'first paint':>16}  {statistics.median(paints):>10.1f}  {max(paints):>8.1f}")
+    loaded = any(r["llm_stack"] for r in results)
+    print(f"LLM stack loaded before first paint: {'yes' if loaded else 'no'}")
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,542 @@
+"""Reproducible benchmark suite against a local mock Ollama server.
+
+Starts `mock_ollama.MockOllama` on a free port, points the app at it and
+measures:
+
+  models     model discovery (`fetch_models`) latency
+  generate   end-to-end latency, time to first token and tokens/s through
+             the chat engine, sequential turns and concurrent threads
+  prefix     prompt tokens Ollama evaluates per turn in a long chat, and
+             how much of each prompt is reused from its KV cache
+  failures   how injected HTTP 500s surface (error rate, time to fail)
+  memory     heap growth per turn (tracemalloc)
+  search     full-text search latency over SEARCH_MESSAGES stored messages
+  rag        document ingestion rate, re-ingest (unchanged) time, top-k latency
+  render     bubble render cost per message size            (needs a display)
+  renderers  widget-per-span vs single Text bubbles: widgets, build time,
+             memory and resize cost per message size        (needs a display)
+  switch     session-switch time and memory vs. history length (needs a display)
+  sessions   new/switch/delete chat time with SIDEBAR_SESSIONS chats (needs a display)
+  gui        prompt → first token → final bubble in the real window (needs a display)
+
+Results are printed and can be saved as JSON for comparing runs:
+
+    python benchmarks/bench_suite.py --json before.json
+    python benchmarks/bench_suite.py --json after.json --compare before.json
+"""
+import argparse
+import gc
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(__file__))
+
+from mock_ollama import MockConfig, MockOllama  # noqa: E402
+
+MODEL = "mock-small"
+RENDER_SIZES = (100, 1_000, 10_000)       # characters per message
+RENDER_COPIES = 10                        # live bubbles for the memory figures
+SWITCH_SIZES = (10, 100, 1000)            # messages per session
+SIDEBAR_SESSIONS = 5000
+SEARCH_MESSAGES = 20_000
+SEARCH_QUERIES = ("print", "bold text", "list item", "inexistente")
+RAG_FILES = 200
+PROMPT_TPS = 2000.0                       # mock prompt eval rate (prefix)
+SAMPLE = ("Here is **some bold** text and `inline code`.\n\n"
+          "- a list item\n- another one\n\n"
+          "```python\nfor i in range(3):\n    print(i)\n```\n")
+
+
+def percentile(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    k = (len(values) - 1) * p / 100
+    lo, hi = int(k), min(int(k) + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (k - lo)
+
+
+def summarize(values, scale=1000.0):
+    """p50/p90/max of `values` in milliseconds (by default)."""
+    return {"p50": percentile(values, 50) * scale,
+            "p90": percentile(values, 90) * scale,
+            "max": max(values) * scale} if values else {}
+
+
+def sample_text(chars):
+    return (SAMPLE * (chars // len(SAMPLE) + 1))[:chars]
+
+
+# ── Headless sections ────────────────────────────────
+def bench_models(mock, runs):
+    from ollama_api import fetch_models
+    fetch_models()      # open the keep-alive connection
+    times = []
+    for _ in range(runs):
+        t0 = time.perf_counter()
+        fetch_models()
+        times.append(time.perf_counter() - t0)
+    return {"fetch_ms": summarize(times)}
+
+
+def _engine():
+    from langgraph.checkpoint.memory import MemorySaver
+
+    from engine import ChatEngine
+    return ChatEngine(MemorySaver())
+
+
+def bench_generate(mock, turns, concurrency):
+    engine = _engine()
+    engine.generate("warm up", "warmup", MODEL)
+
+    latency, ttft, tps = [], [], []
+    for i in range(turns):
+        r = engine.generate(f"pregunta {i}", "sequential", MODEL)
+        latency.append(r["latency"])
+        ttft.append(r["ttft"])
+        tps.append(r["tps"])
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(
+            lambda i: engine.generate("hola", f"parallel_{i}", MODEL),
+            range(turns)))
+    elapsed = time.perf_counter() - t0
+    return {
+        "latency_ms": summarize(latency),
+        "ttft_ms": summarize(ttft),
+        "tokens_per_s": percentile(tps, 50),
+        "parallel_latency_ms": summarize([r["latency"] for r in results]),
+        "parallel_throughput_rps": turns / elapsed,
+    }
+
+
+def bench_prefix(mock, turns):
+    engine = _engine()
+    old = mock.config.prompt_tps
+    mock.config.prompt_tps = PROMPT_TPS
+    evaluated, reused, ttft = [], [], []
+    try:
+        for i in range(turns):
+            r = engine.generate(f"{i}. {sample_text(1000)}", "prefix", MODEL)
+            evaluated.append(r["ollama"].get("prompt_eval_count", 0))
+            reused.append(r["prefix_tokens"] / max(r["prompt_tokens"], 1))
+            ttft.append(r["ttft"])
+    finally:
+        mock.config.prompt_tps = old
+    return {"eval_tokens_first": evaluated[0],
+            "eval_tokens_p50": percentile(evaluated, 50),
+            "eval_tokens_max": max(evaluated),
+            "reused_share_p50": percentile(reused, 50),
+            "ttft_first_ms": ttft[0] * 1000,
+            "ttft_last_ms": ttft[-1] * 1000}
+
+
+def bench_failures(mock, turns, fail_rate):
+    engine = _engine()
+    old = mock.config.fail_rate
+    mock.config.fail_rate = fail_rate
+    errors, fail_times = 0, []
+    try:
+        for i in range(turns):
+            t0 = time.perf_counter()
+            try:
+                engine.generate("hola", f"fail_{i}", MODEL)
+            except Exception:
+                errors += 1
+                fail_times.append(time.perf_counter() - t0)
+    finally:
+        mock.config.fail_rate = old
+    return {"injected_rate": fail_rate, "error_rate": errors / turns,
+            "time_to_fail_ms": summarize(fail_times)}
+
+
+def bench_memory(mock, turns):
+    engine = _engine()
+    engine.generate("warm up", "memory", MODEL)
+    gc.collect()
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    for i in range(turns):
+        engine.generate(f"pregunta {i}", "memory", MODEL)
+    gc.collect()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"turns": turns,
+            "growth_kib_per_turn": (current - base) / 1024 / turns,
+            "peak_kib": peak / 1024}
+
+
+def bench_search(mock, runs):
+    from store import ChatStore
+
+    store = ChatStore(os.path.join(tempfile.mkdtemp(), "search.db"))
+    for sid in range(1, 21):
+        store.add_session(sid, f"Chat {sid}", f"thread_{sid}")
+    for i in range(SEARCH_MESSAGES):
+        store.add_message(i % 20 + 1, "user" if i % 2 == 0 else "ai",
+                          f"{SAMPLE} mensaje {i}", "00:00")
+    store.flush()
+    results = {}
+    for query in SEARCH_QUERIES:
+        times = []
+        for _ in range(runs):
+            t0 = time.perf_counter()
+            store.search(query)
+            times.append(time.perf_counter() - t0)
+        results[query.replace(" ", "_")] = summarize(times)
+    store.close()
+    return results
+
+
+def bench_rag(mock, runs):
+    from rag import DocumentIndex
+
+    docs = tempfile.mkdtemp()
+    for i in range(RAG_FILES):
+        with open(os.path.join(docs, f"doc{i}.md"), "w", encoding="utf-8") as f:
+            f.write(f"# Documento {i}\n\n" + sample_text(3000))
+    index = DocumentIndex(tempfile.mkdtemp(), model="mock-embed")
+    t0 = time.perf_counter()
+    stats = index.ingest([docs])
+    ingest = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    index.ingest([docs])
+    reingest = time.perf_counter() - t0
+    times = []
+    for _ in range(runs):
+        t0 = time.perf_counter()
+        index.search("print range list item")
+        times.append(time.perf_counter() - t0)
+    index.close()
+    return {"chunks": stats["chunks"],
+            "ingest_files_per_s": RAG_FILES / ingest,
+            "reingest_unchanged_ms": reingest * 1000,
+            "search_ms": summarize(times)}
+
+
+# ── GUI sections ─────────────────────────────────────
+def _make_app(mock):
+    import customtkinter as ctk
+
+    import main
+
+    root = ctk.CTk()
+    root.withdraw()
+    app = main.OllamaInterface(
+        root, db_path=os.path.join(tempfile.mkdtemp(), "bench.db"))
+    # Wait for model discovery against the mock
+    deadline = time.perf_counter() + 10
+    while not app.models and time.perf_counter() < deadline:
+        root.update()
+        time.sleep(0.01)
+    return app
+
+
+def _count_widgets(widget):
+    return 1 + sum(_count_widgets(w) for w in widget.winfo_children())
+
+
+def _rss_kib():
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE") / 1024
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def bench_render(app):
+    import main
+    from markdown_tree import parse
+
+    results = {}
+    for chars in RENDER_SIZES:
+        text = sample_text(chars)
+        cold, warm = [], []
+        for cache in (cold, warm):
+            for _ in range(5):
+                if cache is cold:
+                    parse.cache_clear()
+                t0 = time.perf_counter()
+                bubble = main.Bubble(app.chat_view.canvas, "ai", text,
+                                     "00:00")
+                app.root.update_idletasks()
+                cache.append(time.perf_counter() - t0)
+                bubble.destroy()
+        results[str(chars)] = {"cold_ms": summarize(cold),
+                               "cached_ms": summarize(warm)}
+    return results
+
+
+def bench_renderers(app):
+    """The original bubble (a frame per line, a label per span) against
+    the one drawn into a single Text widget."""
+    import main
+    from highlight import tokenize
+    from markdown_tree import parse
+
+    canvas = app.chat_view.canvas
+
+    def build(cls, text, width=900):
+        bubble = cls(canvas, "ai", text, "00:00")
+        wid = canvas.create_window(0, 0, window=bubble, anchor="nw",
+                                   width=width)
+        app.root.update_idletasks()
+        return bubble, wid
+
+    results = {}
+    for name, cls in (("widgets", main.ChatBubble), ("text", main.TextBubble)):
+        results[name] = {}
+        for chars in RENDER_SIZES:
+            text = sample_text(chars)
+            cold, warm, resize = [], [], []
+            for times in (cold, warm):
+                for _ in range(5):
+                    if times is cold:
+                        parse.cache_clear()
+                        tokenize.cache_clear()
+                        main.text_runs.cache_clear()
+                    t0 = time.perf_counter()
+                    bubble, wid = build(cls, text)
+                    times.append(time.perf_counter() - t0)
+                    canvas.delete(wid)
+                    bubble.destroy()
+
+            bubble, wid = build(cls, text)
+            widgets = _count_widgets(bubble)
+            for width in (600, 900) * 3:
+                t0 = time.perf_counter()
+                canvas.itemconfigure(wid, width=width)
+                app.root.update_idletasks()
+                resize.append(time.perf_counter() - t0)
+            canvas.delete(wid)
+            bubble.destroy()
+
+            gc.collect()
+            app.root.update()
+            rss = _rss_kib()
+            tracemalloc.start()
+            live = [build(cls, text) for _ in range(RENDER_COPIES)]
+            heap = tracemalloc.get_traced_memory()[0]
+            tracemalloc.stop()
+            rss_after = _rss_kib()
+            for bubble, wid in live:
+                canvas.delete(wid)
+                bubble.destroy()
+            results[name][str(chars)] = {
+                "widgets": widgets,
+                "cold_ms": summarize(cold),
+                "cached_ms": summarize(warm),
+                "resize_ms": summarize(resize),
+                "heap_kib": heap / 1024 / RENDER_COPIES,
+                "rss_kib": ((rss_after - rss) / RENDER_COPIES
+                            if rss is not None else None),
+            }
+    return results
+
+
+def bench_switch(app):
+    results = {}
+    session = app.sessions[app.active_id]
+    for n in SWITCH_SIZES:
+        session["history"] = [("user" if i % 2 == 0 else "ai", SAMPLE, "00:00")
+                              for i in range(n)]
+        gc.collect()
+        tracemalloc.start()
+        base = tracemalloc.get_traced_memory()[0]
+        times = []
+        for _ in range(5):
+            t0 = time.perf_counter()
+            app._rebuild_chat(session)
+            app.root.update_idletasks()
+            times.append(time.perf_counter() - t0)
+            app.root.update()
+        gc.collect()
+        current = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        results[str(n)] = {"switch_ms": summarize(times),
+                           "retained_kib": (current - base) / 1024}
+    session["history"] = []
+    app._rebuild_chat(session)
+    return results
+
+
+def bench_sessions(app, runs):
+    first = app.store.max_session_id() + 1
+    for sid in range(first, first + SIDEBAR_SESSIONS):
+        app.sessions[sid] = app._make_session(
+            (sid, f"Chat {sid}", f"bench_{sid}", False, "", 0), history=[])
+    app._session_cnt = first + SIDEBAR_SESSIONS
+    app.session_scroll.reload()
+    app.root.update()
+
+    created, switched, deleted = [], [], []
+    ids = list(app.sessions)
+    for i in range(runs):
+        t0 = time.perf_counter()
+        app._new_session()
+        app.root.update_idletasks()
+        created.append(time.perf_counter() - t0)
+
+        t0 = time.perf_counter()
+        app._switch_session(ids[(i * 997) % len(ids)])
+        app.root.update_idletasks()
+        switched.append(time.perf_counter() - t0)
+
+        t0 = time.perf_counter()
+        app._delete_session(app.active_id)
+        app.root.update_idletasks()
+        deleted.append(time.perf_counter() - t0)
+        app.root.update()
+    return {"sessions": len(app.sessions),
+            "new_ms": summarize(created),
+            "switch_ms": summarize(switched),
+            "delete_ms": summarize(deleted)}
+
+
+def bench_gui(app, turns):
+    app._new_session()
+    session = app.sessions[app.active_id]
+    first, done = [], []
+    for i in range(turns):
+        app._clear_ph()
+        app.prompt_box.insert("0.0", f"pregunta {i}")
+        t0 = time.perf_counter()
+        app._send()
+        t_first = None
+        deadline = t0 + 30
+        while session["_busy"] and time.perf_counter() < deadline:
+            app.root.update()
+            if t_first is None and session["_stream"]:
+                t_first = time.perf_counter()
+        done.append(time.perf_counter() - t0)
+        if t_first is not None:
+            first.append(t_first - t0)
+    return {"first_token_ms": summarize(first), "reply_ms": summarize(done)}
+
+
+# ── Driver ───────────────────────────────────────────
+def _meta(mock):
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"],
+                                cwd=ROOT, capture_output=True, text=True,
+                                check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    cfg = mock.config
+    return {"timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "commit": commit,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "mock": {"tokens_per_sec": cfg.tokens_per_sec,
+                     "latency": cfg.latency,
+                     "reply_tokens": cfg.reply_tokens}}
+
+
+def flatten(tree, prefix=""):
+    """{"a": {"b": 1}} → {"a.b": 1}, keeping numeric leaves only."""
+    flat = {}
+    for key, value in tree.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(flatten(value, name + "."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[name] = value
+    return flat
+
+
+def report(results, baseline=None):
+    flat = flatten(results)
+    old = flatten(baseline["results"]) if baseline else {}
+    width = max(map(len, flat), default=10)
+    for name, value in flat.items():
+        line = f"{name:<{width}}  {value:>10.2f}"
+        if name in old and old[name]:
+            change = (value - old[name]) / abs(old[name]) * 100
+            line += f"  {old[name]:>10.2f}  {change:>+7.1f}%"
+        print(line)
+
+
+def run(args):
+    config = MockConfig(args.tps, args.latency, args.tokens)
+    with MockOllama(config) as mock:
+        # Must be set before ollama_api is imported anywhere
+        os.environ["OLLAMA_URL"] = mock.url
+        results = {}
+        sections = [
+            ("models", lambda: bench_models(mock, args.turns)),
+            ("generate", lambda: bench_generate(mock, args.turns,
+                                                args.concurrency)),
+            ("prefix", lambda: bench_prefix(mock, args.turns)),
+            ("failures", lambda: bench_failures(mock, args.turns,
+                                                args.fail_rate)),
+            ("memory", lambda: bench_memory(mock, args.turns)),
+            ("search", lambda: bench_search(mock, args.turns)),
+            ("rag", lambda: bench_rag(mock, args.turns)),
+        ]
+        for name, fn in sections:
+            print(f"… {name}", file=sys.stderr)
+            results[name] = fn()
+
+        if not args.no_gui:
+            try:
+                app = _make_app(mock)
+            except Exception as e:  # no display available
+                results["gui_skipped"] = str(e)
+            else:
+                for name, fn in (("render", lambda: bench_render(app)),
+                                 ("renderers", lambda: bench_renderers(app)),
+                                 ("switch", lambda: bench_switch(app)),
+                                 ("sessions",
+                                  lambda: bench_sessions(app, args.turns)),
+                                 ("gui", lambda: bench_gui(app, args.turns))):
+                    print(f"… {name}", file=sys.stderr)
+                    results[name] = fn()
+                app.on_close()
+        meta = _meta(mock)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+    report(results, baseline)
+    if "gui_skipped" in results:
+        print(f"GUI sections skipped: {results['gui_skipped']}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"meta": meta, "results": results}, f, indent=2)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--json", help="write results to this file")
+    parser.add_argument("--compare", help="baseline JSON from an earlier run")
+    parser.add_argument("--turns", type=int, default=20,
+                        help="requests per section")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--tps", type=float, default=200.0,
+                        help="mock token rate (0 = unthrottled)")
+    parser.add_argument("--latency", type=float, default=0.05,
+                        help="mock seconds before the first token")
+    parser.add_argument("--tokens", type=int, default=64,
+                        help="mock tokens per reply")
+    parser.add_argument("--fail-rate", type=float, default=0.25,
+                        help="failure rate injected in the failures section")
+    parser.add_argument("--no-gui", action="store_true",
+                        help="skip the sections that need a display")
+    run(parser.parse_args(argv))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,254 @@
+"""Stand-in Ollama server for benchmarks.
+
+Implements the parts of Ollama's HTTP API the app uses — `/api/tags`,
+`/api/ps`, `/api/generate` and `/api/chat`, streaming or not, and
+`/api/embed` — with
+a configurable token rate, first-token latency and failure injection.
+Like Ollama, each loaded model remembers its last prompt and only
+"evaluates" the part after the shared prefix (see `prompt_eval_count`).
+Replies are deterministic filler text and embeddings are hashed
+bag-of-words vectors, so runs are reproducible.
+
+    python benchmarks/mock_ollama.py --port 11435 --tps 50 --latency 0.2
+
+Point the app at it with `OLLAMA_URL=http://127.0.0.1:11435`.
+"""
+import argparse
+import hashlib
+import json
+import math
+import os
+import re
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+MODELS = ("mock-small", "mock-large", "mock-embed")
+EMBED_DIM = 64
+WORDS = ("lorem ipsum dolor sit amet consectetur adipiscing elit sed do "
+         "eiusmod tempor incididunt ut labore et dolore magna aliqua").split()
+
+
+class MockConfig:
+    def __init__(self, tokens_per_sec=200.0, latency=0.05, reply_tokens=64,
+                 fail_rate=0.0, models=MODELS, seed=0, prompt_tps=0.0):
+        self.tokens_per_sec = tokens_per_sec    # 0 = as fast as possible
+        self.latency = latency                  # seconds before the first token
+        self.prompt_tps = prompt_tps            # prompt eval rate, 0 = free
+        self.reply_tokens = reply_tokens
+        self.fail_rate = fail_rate              # share of requests answered 500
+        self.models = models
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def should_fail(self) -> bool:
+        with self._lock:
+            return self._rng.random() < self.fail_rate
+
+
+class MockOllama:
+    """Threaded mock server; use as a context manager or call start/stop."""
+
+    def __init__(self, config: MockConfig | None = None,
+                 host="127.0.0.1", port=0):
+        self.config = config or MockConfig()
+        self.requests = 0
+        self.loaded: list = []          # models in "memory", oldest first
+        self.kv: dict = {}              # model -> text in its prompt cache
+        handler = type("Handler", (_Handler,), {"mock": self})
+        self._server = ThreadingHTTPServer((host, port), handler)
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever,
+                                        daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    mock: MockOllama
+    protocol_version = "HTTP/1.1"
+    # Headers and body go out in separate writes; without this Nagle +
+    # delayed ACK add ~40 ms to every response
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        if self.path == "/api/ps":
+            return self._json(200, {"models": [
+                {"name": m, "model": m, "size": 0}
+                for m in self.mock.loaded]})
+        if self.path != "/api/tags":
+            return self._json(404, {"error": "not found"})
+        self._json(200, {"models": [
+            {"name": m, "model": m, "size": 0, "digest": "0" * 12,
+             "modified_at": "2024-01-01T00:00:00Z"}
+            for m in self.mock.config.models]})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        body = json.loads(self.rfile.read(length) or b"{}")
+        if self.path not in ("/api/generate", "/api/chat", "/api/embed"):
+            return self._json(404, {"error": "not found"})
+        self.mock.requests += 1
+        cfg = self.mock.config
+        if body.get("model") not in cfg.models:
+            return self._json(404, {"error": f"model '{body.get('model')}' "
+                                             "not found"})
+        loaded = self.mock.loaded
+        if body["model"] in loaded:
+            loaded.remove(body["model"])
+        loaded.append(body["model"])
+        if self.path == "/api/embed":
+            texts = body.get("input", [])
+            if isinstance(texts, str):
+                texts = [texts]
+            return self._json(200, {"model": body["model"],
+                                    "embeddings": [_embed(t) for t in texts]})
+        # Empty generate request = preload; answer immediately
+        if self.path == "/api/generate" and not body.get("prompt"):
+            return self._json(200, self._final(body, "", 0, 0))
+        if cfg.should_fail():
+            return self._json(500, {"error": "injected failure"})
+
+        chat = self.path == "/api/chat"
+        prompt = (" ".join(str(m.get("content", ""))
+                           for m in body.get("messages", []))
+                  if chat else body.get("prompt", ""))
+        tokens = [WORDS[i % len(WORDS)] + " " for i in range(cfg.reply_tokens)]
+        cached = os.path.commonprefix([self.mock.kv.get(body["model"], ""),
+                                       prompt])
+        self.mock.kv[body["model"]] = prompt + "".join(tokens)
+        prompt_tokens = max(1, (len(prompt) - len(cached)) // 4)
+        start = time.perf_counter()
+        time.sleep(cfg.latency + (prompt_tokens / cfg.prompt_tps
+                                  if cfg.prompt_tps > 0 else 0))
+        prompt_done = time.perf_counter()
+
+        if not body.get("stream", True):
+            self._pace(len(tokens), prompt_done)
+            final = self._final(body, "".join(tokens), prompt_tokens,
+                                len(tokens), start, prompt_done)
+            return self._json(200, final)
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        try:
+            for i, tok in enumerate(tokens):
+                self._pace(i, prompt_done)
+                self._chunk(self._part(body, tok, chat))
+            self._chunk(self._final(body, "", prompt_tokens, len(tokens),
+                                    start, prompt_done))
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            # Client stopped reading (cancelled generation)
+            pass
+
+    # ── Helpers ─────────────────────────────────────
+    def _pace(self, n, since):
+        tps = self.mock.config.tokens_per_sec
+        if tps > 0:
+            delay = since + n / tps - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+
+    def _part(self, body, text, chat):
+        part = {"model": body["model"], "created_at": _now(), "done": False}
+        if chat:
+            part["message"] = {"role": "assistant", "content": text}
+        else:
+            part["response"] = text
+        return part
+
+    def _final(self, body, text, prompt_tokens, eval_tokens,
+               start=None, prompt_done=None):
+        end = time.perf_counter()
+        start = start or end
+        prompt_done = prompt_done or end
+        final = self._part(body, text, self.path == "/api/chat")
+        final.update(done=True, done_reason="stop",
+                     total_duration=int((end - start) * 1e9),
+                     load_duration=0,
+                     prompt_eval_count=prompt_tokens,
+                     prompt_eval_duration=int((prompt_done - start) * 1e9),
+                     eval_count=eval_tokens,
+                     eval_duration=int((end - prompt_done) * 1e9))
+        return final
+
+    def _chunk(self, obj):
+        data = json.dumps(obj).encode() + b"\n"
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+    def _json(self, status, obj):
+        data = json.dumps(obj).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def _embed(text):
+    """Hashed bag of words: texts sharing words get similar vectors."""
+    vec = [0.0] * EMBED_DIM
+    for word in re.findall(r"\w+", text.lower()):
+        h = int.from_bytes(hashlib.md5(word.encode()).digest()[:4], "little")
+        vec[h % EMBED_DIM] += 1.0
+    norm = math.sqrt(sum(v * v for v in vec)) or 1.0
+    return [v / norm for v in vec]
+
+
+def _now():
+    return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11435)
+    parser.add_argument("--tps", type=float, default=200.0,
+                        help="tokens per second (0 = unthrottled)")
+    parser.add_argument("--latency", type=float, default=0.05,
+                        help="seconds before the first token")
+    parser.add_argument("--tokens", type=int, default=64,
+                        help="tokens per reply")
+    parser.add_argument("--prompt-tps", type=float, default=0.0,
+                        help="prompt evaluation rate (0 = free)")
+    parser.add_argument("--fail-rate", type=float, default=0.0,
+                        help="fraction of requests answered with HTTP 500")
+    args = parser.parse_args(argv)
+    config = MockConfig(args.tps, args.latency, args.tokens, args.fail_rate,
+                        prompt_tps=args.prompt_tps)
+    server = MockOllama(config, args.host, args.port)
+    print(f"mock Ollama on {server.url} (Ctrl+C to stop)")
+    try:
+        server._server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
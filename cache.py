@@ -0,0 +1,132 @@
+"""On-disk response cache for the chatbot node.
+
+Replies are keyed on (model, options, the exact prompt sent), with each
+message's text normalized so insignificant whitespace differences still
+hit. Entries expire after a TTL and the least recently used ones are
+evicted once the cache exceeds its entry or size limit.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+CACHE_PATH = os.path.join(os.path.expanduser("~"), ".ollama_chat",
+                          "response_cache.db")
+MAX_ENTRIES = 5000
+MAX_BYTES = 50_000_000
+TTL = 7 * 24 * 3600         # seconds
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key         TEXT PRIMARY KEY,
+    model       TEXT NOT NULL,
+    response    TEXT NOT NULL,
+    size        INTEGER NOT NULL,
+    created     REAL NOT NULL,
+    last_used   REAL NOT NULL,
+    hits        INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_responses_lru ON responses(last_used);
+"""
+
+
+def _normalize(text) -> str:
+    if not isinstance(text, str):
+        text = json.dumps(text, sort_keys=True, ensure_ascii=False)
+    lines = text.replace("\r\n", "\n").split("\n")
+    return "\n".join(line.rstrip() for line in lines).strip()
+
+
+def cache_key(model: str, options: dict, messages: list) -> str:
+    payload = json.dumps(
+        [model, sorted(options.items()),
+         [(m.type, _normalize(m.content)) for m in messages]],
+        ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class ResponseCache:
+    def __init__(self, path: str = CACHE_PATH, max_entries: int = MAX_ENTRIES,
+                 max_bytes: int = MAX_BYTES, ttl: float = TTL):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(SCHEMA)
+
+    def get(self, key: str):
+        """Cached reply for `key`, or None."""
+        now = time.time()
+        with self._lock, self._db:
+            row = self._db.execute(
+                "SELECT response, created FROM responses WHERE key = ?",
+                (key,)).fetchone()
+            if row is None or now - row[1] > self.ttl:
+                if row is not None:
+                    self._db.execute("DELETE FROM responses WHERE key = ?",
+                                     (key,))
+                self.misses += 1
+                return None
+            self._db.execute("UPDATE responses SET last_used = ?, "
+                             "hits = hits + 1 WHERE key = ?", (now, key))
+            self.hits += 1
+            return row[0]
+
+    def put(self, key: str, model: str, response: str):
+        now = time.time()
+        size = len(response.encode())
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses "
+                "(key, model, response, size, created, last_used) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (key, model, response, size, now, now))
+            self._evict(now)
+
+    def _evict(self, now):
+        """Drop expired entries, then LRU ones until within limits."""
+        self._db.execute("DELETE FROM responses WHERE created < ?",
+                         (now - self.ttl,))
+        count, total = self._db.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+        if count <= self.max_entries and total <= self.max_bytes:
+            return
+        excess_rows = max(count - self.max_entries, 0)
+        excess_bytes = total - self.max_bytes
+        drop = []
+        for key, size in self._db.execute(
+                "SELECT key, size FROM responses ORDER BY last_used"):
+            if excess_rows <= 0 and excess_bytes <= 0:
+                break
+            drop.append((key,))
+            excess_rows -= 1
+            excess_bytes -= size
+        self._db.executemany("DELETE FROM responses WHERE key = ?", drop)
+
+    def clear(self):
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM responses")
+        self.hits = self.misses = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries, total = self._db.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) "
+                "FROM responses").fetchone()
+        lookups = self.hits + self.misses
+        return {"entries": entries, "bytes": total, "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0}
+
+    def close(self):
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,65 @@
+"""Compare mode: one prompt fanned out to several models at once.
+
+Every model answers on its own LangGraph thread. Generations are
+scheduled around Ollama's model residency: models that are already
+loaded go first, and no more than MAX_LOADED_MODELS run at a time, so a
+comparison never asks Ollama to hold more models than it keeps in memory
+(which would make them evict each other mid-reply).
+"""
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from ollama_api import loaded_models
+
+# Match the server's OLLAMA_MAX_LOADED_MODELS
+MAX_LOADED_MODELS = int(os.environ.get("OLLAMA_MAX_LOADED_MODELS", "3"))
+
+
+def schedule(models, loaded) -> list:
+    """Already-loaded models first, otherwise in the order given."""
+    loaded = set(loaded)
+    return sorted(models, key=lambda m: m not in loaded)
+
+
+class CompareRunner:
+    def __init__(self, engine, max_loaded: int = MAX_LOADED_MODELS):
+        self.engine = engine
+        # FIFO pool: jobs start in schedule order, max_loaded at a time
+        self.pool = ThreadPoolExecutor(max_workers=max_loaded,
+                                       thread_name_prefix="compare")
+
+    def run(self, prompt, models, thread_prefix, on_event,
+            cancel: threading.Event | None = None) -> list:
+        """Queue one generation per model; returns their futures.
+
+        `on_event(kind, model, payload)` is called from worker threads with
+        "start", "chunk" (text), "done" (engine result) or "error" (message).
+        Blocks briefly to ask Ollama which models are loaded.
+        """
+        try:
+            loaded = loaded_models()
+        except requests.RequestException:
+            loaded = []
+        return [self.pool.submit(self._generate, prompt, model,
+                                 f"{thread_prefix}:{model}", on_event, cancel)
+                for model in schedule(models, loaded)]
+
+    def _generate(self, prompt, model, thread_id, on_event, cancel):
+        if cancel is not None and cancel.is_set():
+            on_event("error", model, "cancelado")
+            return
+        on_event("start", model, None)
+        try:
+            result = self.engine.generate(
+                prompt, thread_id, model, cancel=cancel,
+                on_chunk=lambda chunk: on_event("chunk", model, chunk))
+        except Exception as e:
+            on_event("error", model, str(e))
+        else:
+            on_event("done", model, result)
+
+    def shutdown(self):
+        self.pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,699 @@
+"""Conversation engine: the LangGraph pipeline that talks to Ollama.
+
+This module pulls in LangChain and LangGraph, which are slow to import, so
+the GUI only imports it when the first prompt is about to be sent.
+"""
+import os
+import socket
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Annotated, TypedDict
+
+import httpcore
+import httpx
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.messages import AIMessage, HumanMessage
+from langchain_core.runnables import RunnableConfig
+from langchain_ollama import OllamaLLM
+from langgraph.graph import END, START, StateGraph
+from langgraph.types import Send, StreamWriter
+
+from history import (HISTORY_BUDGET, STOPPED_REPLY, SUMMARIZE_HISTORY,
+                     SUMMARY_BATCH, build_prompt, context_message, count_tokens,
+                     select_window, summary_message, summary_prompt)
+from ollama_api import KEEP_ALIVE, MAX_PARALLEL, OLLAMA_URL
+from profiling import tracer
+
+MAX_CACHED_MODELS = 4       # LLM clients kept alive in the registry
+MAX_TRACKED_THREADS = 256   # threads whose last prompt is remembered
+
+
+# ── State definition ─────────────────────────────────
+def _add_attachments(old, new):
+    return (old or []) + [p for p in new if p not in (old or [])]
+
+
+def _add_notes(old, new):
+    # Every turn starts from None; map steps then add their notes
+    return [] if new is None else (old or []) + new
+
+
+class ChatState(TypedDict):
+    messages: Annotated[list, lambda x, y: x + y]
+    window: tuple           # (pinned, start) slice of `messages` sent to the model
+    prompt_tokens: int
+    summary: str            # running summary of trimmed turns
+    summarized: int         # messages[:summarized] are covered by `summary`
+    context: str            # retrieved document excerpts for this turn
+    sources: list           # (score, path) of those excerpts
+    attachments: Annotated[list, _add_attachments]  # files attached to the chat
+    notes: Annotated[list, _add_notes]  # (name, seq, total, key) this turn
+    map_jobs: list          # chunks whose notes still have to be taken
+
+
+# ── Model client registry ────────────────────────────
+class ModelRegistry:
+    """LRU cache of OllamaLLM clients keyed by model name and options.
+
+    Each OllamaLLM owns an HTTP client with its own keep-alive connection
+    pool, so reusing the instance keeps connections to Ollama open between
+    prompts instead of reconnecting on every send.
+    """
+
+    def __init__(self, base_url=OLLAMA_URL, max_size=MAX_CACHED_MODELS):
+        self.base_url = base_url
+        self.max_size = max_size
+        self._clients: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, model: str, **options) -> OllamaLLM:
+        key = (model, tuple(sorted(options.items())))
+        with self._lock:
+            llm = self._clients.get(key)
+            if llm is None:
+                # The transport lets `stream` cut a cancelled reply
+                llm = OllamaLLM(model=model, base_url=self.base_url,
+                                keep_alive=KEEP_ALIVE, client_kwargs={
+                                    "transport": _AbortableTransport()},
+                                **options)
+                self._clients[key] = llm
+                while len(self._clients) > self.max_size:
+                    self._clients.popitem(last=False)
+            else:
+                self._clients.move_to_end(key)
+            return llm
+
+
+# ── Cancellable streaming ────────────────────────────
+CANCEL_POLL = 0.05          # seconds between checks of a stream's cancel flag
+_HTTPCORE_ERRORS = (httpcore.NetworkError, httpcore.ProtocolError,
+                    httpcore.TimeoutException, httpcore.UnsupportedProtocol,
+                    httpcore.ProxyError)
+
+
+def _as_httpx(error):
+    """The httpx exception matching an httpcore one (they share names)."""
+    return getattr(httpx, type(error).__name__, httpx.TransportError)(
+        str(error))
+
+
+class _TrackedStream(httpcore.NetworkStream):
+    """Socket stream that records itself as in use by the calling thread."""
+
+    def __init__(self, stream, active):
+        self._stream = stream
+        self._active = active
+
+    def _claim(self):
+        ident = threading.get_ident()
+        if ident in self._active:
+            self._active[ident] = self
+
+    def read(self, max_bytes, timeout=None):
+        self._claim()
+        return self._stream.read(max_bytes, timeout)
+
+    def write(self, buffer, timeout=None):
+        self._claim()
+        self._stream.write(buffer, timeout)
+
+    def close(self):
+        self._stream.close()
+
+    def start_tls(self, ssl_context, server_hostname=None, timeout=None):
+        return _TrackedStream(self._stream.start_tls(
+            ssl_context, server_hostname, timeout), self._active)
+
+    def get_extra_info(self, info):
+        return self._stream.get_extra_info(info)
+
+
+class _TrackingBackend(httpcore.NetworkBackend):
+    def __init__(self, active):
+        self._backend = httpcore.SyncBackend()
+        self._active = active
+
+    def connect_tcp(self, host, port, timeout=None, local_address=None,
+                    socket_options=None):
+        return _TrackedStream(self._backend.connect_tcp(
+            host, port, timeout, local_address, socket_options), self._active)
+
+    def connect_unix_socket(self, path, timeout=None, socket_options=None):
+        return _TrackedStream(self._backend.connect_unix_socket(
+            path, timeout, socket_options), self._active)
+
+    def sleep(self, seconds):
+        self._backend.sleep(seconds)
+
+
+class _Body(httpx.SyncByteStream):
+    def __init__(self, response, active, ident):
+        self._response = response
+        self._active = active
+        self._ident = ident
+
+    def __iter__(self):
+        try:
+            yield from self._response.stream
+        except _HTTPCORE_ERRORS as e:
+            raise _as_httpx(e) from e
+
+    def close(self):
+        self._active.pop(self._ident, None)
+        self._response.close()
+
+
+class _AbortableTransport(httpx.BaseTransport):
+    """Pooled HTTP transport that can cut one thread's request midway.
+
+    Closing a response doesn't wake a thread blocked reading it; shutting
+    its socket down does. Every request notes the connection it is using,
+    so `abort` only breaks that one and the rest of the pool stays open.
+    """
+
+    def __init__(self):
+        self._active: dict = {}     # thread ident -> stream, while requesting
+        self._pool = httpcore.ConnectionPool(
+            ssl_context=httpx.create_ssl_context(),
+            network_backend=_TrackingBackend(self._active))
+
+    def handle_request(self, request):
+        ident = threading.get_ident()
+        self._active[ident] = None
+        url = request.url
+        core = httpcore.Request(
+            method=request.method,
+            url=httpcore.URL(scheme=url.raw_scheme, host=url.raw_host,
+                             port=url.port, target=url.raw_path),
+            headers=request.headers.raw, content=request.stream,
+            extensions=request.extensions)
+        try:
+            response = self._pool.handle_request(core)
+        except _HTTPCORE_ERRORS as e:
+            self._active.pop(ident, None)
+            raise _as_httpx(e) from e
+        return httpx.Response(response.status, headers=response.headers,
+                              stream=_Body(response, self._active, ident),
+                              extensions=response.extensions)
+
+    def abort(self, ident):
+        """Break the connection thread `ident` is requesting on, if any."""
+        stream = self._active.get(ident)
+        if stream is not None:
+            try:
+                stream.get_extra_info("socket").shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def close(self):
+        self._pool.close()
+
+
+def stream(llm: OllamaLLM, prompt, cancel=None, **kwargs):
+    """Yield the chunks of `llm.stream(prompt)` until `cancel` is set.
+
+    For clients from ModelRegistry a watcher cuts the request as soon as
+    `cancel` is set, so Ollama stops even while no token is arriving
+    (loading the model, evaluating a long prompt).
+    """
+    transport = (llm.client_kwargs or {}).get("transport")
+    done = threading.Event()
+    if cancel is not None and isinstance(transport, _AbortableTransport):
+        ident = threading.get_ident()
+
+        def watch():
+            while not done.wait(CANCEL_POLL):
+                if cancel.is_set():
+                    # Repeated until the stream ends: the request may
+                    # still be connecting on the first try
+                    transport.abort(ident)
+
+        threading.Thread(target=watch, daemon=True, name="cancel").start()
+    try:
+        for chunk in llm.stream(prompt, **kwargs):
+            if cancel is not None and cancel.is_set():
+                return
+            yield chunk
+    except httpx.TransportError:
+        if cancel is None or not cancel.is_set():
+            raise
+    finally:
+        done.set()
+
+
+# ── Ollama generation stats ──────────────────────────
+OLLAMA_STATS = ("total_duration", "load_duration", "prompt_eval_count",
+                "prompt_eval_duration", "eval_count", "eval_duration")
+
+
+class _StatsCollector(BaseCallbackHandler):
+    """Grabs the counters Ollama sends with its final chunk."""
+
+    def __init__(self):
+        self.stats = {}
+
+    def on_llm_end(self, response, **kwargs):
+        info = response.generations[0][0].generation_info or {}
+        self.stats = {k: info[k] for k in OLLAMA_STATS if info.get(k) is not None}
+
+
+def _trace_ollama(stats, end):
+    """Lay Ollama's own phase timings (ns) out as spans ending at `end`."""
+    eval_s = stats.get("eval_duration", 0) / 1e9
+    prompt_s = stats.get("prompt_eval_duration", 0) / 1e9
+    load_s = stats.get("load_duration", 0) / 1e9
+    tracer.add("ollama.eval", end - eval_s, eval_s, "ollama",
+               {"tokens": stats.get("eval_count")})
+    tracer.add("ollama.prompt_eval", end - eval_s - prompt_s, prompt_s,
+               "ollama", {"tokens": stats.get("prompt_eval_count")})
+    if load_s:
+        tracer.add("ollama.load", end - eval_s - prompt_s - load_s, load_s,
+                   "ollama")
+
+
+# ── Prompt prefix tracking ───────────────────────────
+class PrefixTracker:
+    """Remembers the last prompt sent for each thread.
+
+    Ollama keeps the evaluated prompt of a loaded model in its KV cache and
+    only evaluates what comes after the longest matching prefix. Comparing a
+    prompt with the thread's previous one tells how much of it can be
+    reused; Ollama's `prompt_eval_count` tells how much actually was.
+    """
+
+    def __init__(self, max_threads=MAX_TRACKED_THREADS):
+        self.max_threads = max_threads
+        self._prompts: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _fingerprint(prompt):
+        return [(hash((m.type, str(m.content))), count_tokens(m))
+                for m in prompt]
+
+    def shared(self, thread_id, model, prompt) -> int:
+        """Estimated tokens `prompt` shares with the thread's last prompt."""
+        with self._lock:
+            last = self._prompts.get(thread_id)
+        if last is None or last[0] != model:
+            return 0
+        tokens = 0
+        for old, new in zip(last[1], self._fingerprint(prompt)):
+            if old != new:
+                break
+            tokens += new[1]
+        return tokens
+
+    def update(self, thread_id, model, prompt):
+        entry = (model, self._fingerprint(prompt))
+        with self._lock:
+            self._prompts[thread_id] = entry
+            self._prompts.move_to_end(thread_id)
+            while len(self._prompts) > self.max_threads:
+                self._prompts.popitem(last=False)
+
+    def forget(self, thread_id):
+        with self._lock:
+            self._prompts.pop(thread_id, None)
+
+
+# ── Engine ───────────────────────────────────────────
+class ChatEngine:
+    def __init__(self, checkpointer, registry: ModelRegistry | None = None,
+                 cache=None, notes=None):
+        from cache import ResponseCache
+        self.checkpointer = checkpointer
+        self.registry = registry or ModelRegistry()
+        self.cache = cache              # optional cache.ResponseCache
+        # Notes taken on attachment chunks; always on, in memory by default
+        self.notes = notes if notes is not None else ResponseCache(":memory:")
+        self.prefixes = PrefixTracker()
+        self.graph = self._build_graph()
+
+    def _build_graph(self):
+        builder = StateGraph(ChatState)
+        builder.add_node("retrieve", self._retrieve)
+        builder.add_node("attach", self._attach)
+        builder.add_node("map", self._map_chunk)
+        builder.add_node("reduce", self._reduce)
+        builder.add_node("history", self._manage_history)
+        builder.add_node("chatbot", self._invoke_model)
+        builder.add_edge(START, "retrieve")
+        builder.add_edge("retrieve", "attach")
+        builder.add_conditional_edges("attach", self._fan_out,
+                                      ["map", "reduce", "history"])
+        builder.add_edge("map", "reduce")
+        builder.add_edge("reduce", "history")
+        builder.add_edge("history", "chatbot")
+        builder.add_edge("chatbot", END)
+        return builder.compile(checkpointer=self.checkpointer)
+
+    @tracer.traced("graph.retrieve", "engine")
+    def _retrieve(self, state: ChatState, config: RunnableConfig):
+        """Look up document excerpts for the newest message, if the thread
+        has an index attached (`retriever` in the config)."""
+        index = config["configurable"].get("retriever")
+        question = state["messages"][-1].content
+        if index is None or not len(index) or not isinstance(question, str):
+            return {"context": "", "sources": []}
+        from rag import format_context
+        hits = index.search(question)
+        return {"context": format_context(hits),
+                "sources": [(score, path) for score, path, _ in hits]}
+
+    @tracer.traced("graph.attach", "engine")
+    def _attach(self, state: ChatState, config: RunnableConfig,
+                writer: StreamWriter):
+        """Scan the chat's attachments and pick up notes already cached;
+        the remaining chunks are left to the map step."""
+        import attachments
+        cfg = config["configurable"]
+        if not state.get("attachments"):
+            return {"map_jobs": []}
+        jobs, notes, queued = [], [], set()
+        for path in state["attachments"]:
+            try:
+                chunks = attachments.scan(path, cancel=cfg.get("cancel"))
+            except (OSError, ValueError):
+                # Moved or deleted since it was attached
+                continue
+            name = os.path.basename(path)
+            for seq, (start, end, sha) in enumerate(chunks):
+                key = attachments.notes_key(cfg["model"], sha)
+                item = (name, seq, len(chunks), key)
+                if key in queued or self.notes.get(key) is not None:
+                    # Repeated chunks share the notes of the first one
+                    notes.append(item)
+                else:
+                    queued.add(key)
+                    jobs.append({"item": item, "path": path,
+                                 "span": (start, end)})
+        writer({"map_total": len(notes) + len(jobs),
+                "map_cached": len(notes)})
+        return {"notes": notes, "map_jobs": jobs}
+
+    def _fan_out(self, state: ChatState):
+        """One parallel map step per chunk without cached notes."""
+        jobs = state.get("map_jobs")
+        if jobs:
+            return [Send("map", job) for job in jobs]
+        return "reduce" if state.get("notes") else "history"
+
+    @tracer.traced("graph.map", "engine")
+    def _map_chunk(self, job: dict, config: RunnableConfig,
+                   writer: StreamWriter):
+        """Take notes on one chunk and cache them."""
+        import attachments
+        cfg = config["configurable"]
+        cancel = cfg.get("cancel")
+        if cancel is not None and cancel.is_set():
+            return {"notes": []}
+        text = attachments.read_chunk(job["path"], *job["span"])
+        llm = self.registry.get(cfg["model"])
+        notes = llm.invoke(attachments.map_prompt(text)).strip()
+        self.notes.put(job["item"][3], cfg["model"], notes)
+        writer({"map_done": 1})
+        return {"notes": [job["item"]]}
+
+    @tracer.traced("graph.reduce", "engine")
+    def _reduce(self, state: ChatState, config: RunnableConfig):
+        """Combine the notes of every chunk into context for the answer,
+        collapsing them (with the question in view) until they fit."""
+        import attachments
+        cfg = config["configurable"]
+        cancel = cfg.get("cancel")
+        items = []
+        for name, seq, total, key in sorted(state.get("notes") or []):
+            text = self.notes.get(key)
+            if text:
+                items.append((name, seq, seq, total, text))
+        question = state["messages"][-1].content
+        llm = self.registry.get(cfg["model"])
+        called = bool(state.get("map_jobs"))
+        while attachments.notes_tokens(items) > attachments.REDUCE_TOKENS:
+            groups = attachments.collapse_groups(items)
+            if len(groups) == len(items) or (cancel is not None
+                                             and cancel.is_set()):
+                break
+            called = True
+            with ThreadPoolExecutor(max_workers=MAX_PARALLEL) as pool:
+                merged = list(pool.map(
+                    llm.invoke,
+                    [attachments.collapse_prompt(question, g) for g in groups]))
+            items = [(g[0][0], g[0][1], g[-1][2], g[0][3], text.strip())
+                     for g, text in zip(groups, merged)]
+        if called:
+            # Those calls replaced the thread's prompt in Ollama's cache
+            self.prefixes.forget(cfg["thread_id"])
+        context = "\n\n".join(filter(None, [state.get("context", ""),
+                                             attachments.format_notes(items)]))
+        return {"context": context, "map_jobs": []}
+
+    @tracer.traced("graph.history", "engine")
+    def _manage_history(self, state: ChatState, config: RunnableConfig):
+        """Pick the slice of the thread that fits the context budget."""
+        cfg = config["configurable"]
+        messages = state["messages"]
+        budget = cfg.get("context_budget", HISTORY_BUDGET)
+        summary = state.get("summary", "")
+        summarized = state.get("summarized", 0)
+        context = state.get("context", "")
+
+        def reserved():
+            msgs = (summary_message(summary), context_message(context))
+            return sum(count_tokens(m) for m in msgs if m is not None)
+
+        # Reusing the last window keeps the prompt prefix stable
+        previous = state.get("window")
+        pinned, start = select_window(messages, budget, reserved(), previous)
+        update = {}
+        first_new = max(summarized, pinned)
+        if (cfg.get("summarize", SUMMARIZE_HISTORY)
+                and start - first_new >= SUMMARY_BATCH):
+            llm = self.registry.get(cfg["model"])
+            # A longer summary leaves less room, which can slide the window
+            # past the messages it covers; fold those in too
+            while start > first_new:
+                summary = llm.invoke(summary_prompt(summary,
+                                                    messages[first_new:start]))
+                update = {"summary": summary, "summarized": start}
+                first_new = start
+                pinned, start = select_window(messages, budget, reserved(),
+                                              previous)
+            # The summary call replaced the thread's prompt in Ollama's cache
+            self.prefixes.forget(cfg["thread_id"])
+
+        prompt = build_prompt(messages, (pinned, start), summary, context)
+        update["window"] = (pinned, start)
+        update["prompt_tokens"] = sum(count_tokens(m) for m in prompt)
+        return update
+
+    @tracer.traced("graph.invoke_model", "engine")
+    def _invoke_model(self, state: ChatState, config: RunnableConfig,
+                      writer: StreamWriter):
+        cfg = config["configurable"]
+        cancel = cfg.get("cancel")
+        options = cfg.get("options") or {}
+        llm = self.registry.get(cfg["model"], **options)
+        prompt = build_prompt(state["messages"], state.get("window"),
+                              state.get("summary", ""),
+                              state.get("context", ""))
+
+        key = None
+        if self.cache is not None:
+            from cache import cache_key
+            key = cache_key(cfg["model"], options, prompt)
+            cached = None if cfg.get("bypass_cache") else self.cache.get(key)
+            if cached is not None:
+                writer(cached)
+                writer({"cached": True})
+                return {"messages": [AIMessage(content=cached)]}
+
+        # Each token is forwarded through the graph's "custom" stream;
+        # metadata (Ollama's stats, cache hits) is sent as dicts
+        thread_id = cfg["thread_id"]
+        writer({"prefix_tokens": self.prefixes.shared(thread_id, cfg["model"],
+                                                      prompt)})
+        parts = []
+        collector = _StatsCollector()
+        if cancel is None or not cancel.is_set():
+            self.prefixes.update(thread_id, cfg["model"], prompt)
+            # Cancelling cuts the HTTP stream, which makes Ollama stop
+            for chunk in stream(llm, prompt, cancel,
+                                config={"callbacks": [collector]}):
+                if chunk:
+                    parts.append(chunk)
+                    writer(chunk)
+        if collector.stats:
+            _trace_ollama(collector.stats, time.perf_counter())
+            writer({"ollama": collector.stats})
+            # Only complete replies are cached, never stopped ones
+            if key is not None and parts:
+                self.cache.put(key, cfg["model"], "".join(parts))
+        # A stopped reply is still committed so the thread stays consistent,
+        # with the same text the chat shows for it
+        text = "".join(parts)
+        if not text and cancel is not None and cancel.is_set():
+            text = STOPPED_REPLY
+        return {"messages": [AIMessage(content=text)]}
+
+    def prepare_summary(self, thread_id: str, model: str,
+                        cancel: threading.Event) -> bool:
+        """Fold the messages the window has dropped into the thread's
+        summary ahead of the next turn, which then doesn't have to.
+
+        Meant for idle time; returns False if there was nothing to do or
+        `cancel` was set before the summary was done.
+        """
+        config = {"configurable": {"thread_id": thread_id}}
+        state = self.graph.get_state(config).values
+        if not state.get("window"):
+            return False
+        pinned, start = state["window"]
+        first_new = max(state.get("summarized", 0), pinned)
+        if start - first_new < SUMMARY_BATCH:
+            return False
+        prompt = summary_prompt(state.get("summary", ""),
+                                state["messages"][first_new:start])
+        parts = list(stream(self.registry.get(model), prompt, cancel))
+        if cancel.is_set():
+            return False
+        # Applied as the last node, so the thread has nothing left to run
+        self.graph.update_state(config, {"summary": "".join(parts),
+                                         "summarized": start},
+                                as_node="chatbot")
+        return True
+
+    def has_thread(self, thread_id: str) -> bool:
+        config = {"configurable": {"thread_id": thread_id}}
+        return bool(self.graph.get_state(config).values)
+
+    def generate(self, prompt: str | list, thread_id: str, model: str,
+                 on_chunk=None, cancel: threading.Event | None = None,
+                 retriever=None, use_cache: bool = True,
+                 attachments=(), on_progress=None, options=None) -> dict:
+        """Run one turn on `thread_id` and return the reply with timings.
+
+        `prompt` is the user's text, or a list of messages to append to the
+        thread before answering. `on_chunk` is called with every streamed
+        token. Setting `cancel` stops the reply early; the partial text is
+        still committed. `ollama` in the result holds the counters and
+        durations (ns) Ollama reported, when the reply ran to completion;
+        `prefix_tokens` estimates how much of the prompt matched the
+        thread's previous one and could come from Ollama's KV cache.
+        With a `retriever` (a rag.DocumentIndex), matching excerpts are
+        added to the prompt and listed under `sources`. `cached` tells
+        whether the reply came from the response cache; `use_cache=False`
+        skips the lookup but still stores the fresh reply. `options`
+        (temperature, num_ctx, ...) go to Ollama and are part of the cache
+        key.
+
+        `attachments` are file paths added to the thread; every later turn
+        answers from notes on all of the thread's files. `on_progress(done,
+        total)` follows the chunks being read, `chunks` in the result
+        counts them and how many had cached notes.
+        """
+        if isinstance(prompt, str):
+            new_messages = [HumanMessage(content=prompt)]
+        else:
+            new_messages = list(prompt)
+        config = {"configurable": {"thread_id": thread_id}}
+        return self._run(new_messages, config, model, on_chunk, cancel,
+                         retriever, bypass_cache=not use_cache,
+                         attachments=list(attachments),
+                         on_progress=on_progress, options=options)
+
+    def regenerate(self, thread_id: str, model: str, on_chunk=None,
+                   cancel: threading.Event | None = None,
+                   retriever=None, on_progress=None, options=None) -> dict:
+        """Answer the last turn of `thread_id` again, bypassing the cache.
+
+        The run forks from the checkpoint taken before that turn, so the
+        previous reply drops out of the thread's history.
+        """
+        config = {"configurable": {"thread_id": thread_id}}
+        values = self.graph.get_state(config).values
+        current = values.get("messages", [])
+        for snapshot in self.graph.get_state_history(config):
+            if snapshot.metadata.get("source") == "input":
+                break
+        else:
+            raise ValueError("no previous turn to regenerate")
+        # Same input as that turn: what followed its starting state,
+        # minus the reply being replaced
+        new_messages = current[len(snapshot.values.get("messages", [])):]
+        while new_messages and isinstance(new_messages[-1], AIMessage):
+            new_messages.pop()
+        attached = snapshot.values.get("attachments", [])
+        return self._run(new_messages, snapshot.config, model, on_chunk,
+                         cancel, retriever, bypass_cache=True,
+                         attachments=[p for p in values.get("attachments", [])
+                                      if p not in attached],
+                         on_progress=on_progress, options=options)
+
+    def _run(self, new_messages, config, model, on_chunk, cancel, retriever,
+             bypass_cache=False, attachments=(), on_progress=None,
+             options=None) -> dict:
+        config = {"configurable": {**config["configurable"],
+                                   "model": model,
+                                   "options": dict(options or {}),
+                                   "cancel": cancel,
+                                   "retriever": retriever,
+                                   "bypass_cache": bypass_cache},
+                  # Map steps run in parallel, as many as Ollama serves
+                  "max_concurrency": MAX_PARALLEL}
+        text = ""
+        prompt_tokens = 0
+        start = time.perf_counter()
+        first_token = None
+        n_tokens = 0
+        meta = {}
+        sources = []
+        chunks = [0, 0]             # notes ready, total
+        with tracer.span("engine.generate", "engine", model=model):
+            stream = self.graph.stream({"messages": new_messages,
+                                        "attachments": attachments,
+                                        "notes": None},
+                                       config=config,
+                                       stream_mode=["custom", "values"])
+            for mode, payload in stream:
+                if mode == "custom" and isinstance(payload, dict):
+                    if "map_total" in payload or "map_done" in payload:
+                        chunks[0] += payload.get("map_cached",
+                                                 payload.get("map_done", 0))
+                        chunks[1] = payload.get("map_total", chunks[1])
+                        if on_progress is not None:
+                            on_progress(*chunks)
+                    meta.update(payload)
+                elif mode == "custom":
+                    if first_token is None:
+                        first_token = time.perf_counter()
+                    n_tokens += 1
+                    if on_chunk is not None:
+                        on_chunk(payload)
+                elif "messages" in payload:
+                    text = payload["messages"][-1].content
+                    prompt_tokens = payload.get("prompt_tokens", 0)
+                    sources = payload.get("sources", [])
+        end = time.perf_counter()
+
+        result = {
+            "text": text,
+            "stopped": cancel is not None and cancel.is_set(),
+            "prompt_tokens": prompt_tokens,
+            "latency": end - start,
+            "ttft": None,
+            "tps": 0.0,
+            "ollama": meta.get("ollama", {}),
+            "cached": meta.get("cached", False),
+            "prefix_tokens": meta.get("prefix_tokens", 0),
+            "sources": sources,
+            "chunks": {"total": chunks[1], "cached": meta.get("map_cached", 0)},
+        }
+        if first_token is not None:
+            gen_time = end - first_token
+            result["ttft"] = first_token - start
+            result["tps"] = (n_tokens - 1) / gen_time if gen_time > 0 else 0.0
+        return result
@@ -0,0 +1,91 @@
+"""Syntax highlighting for fenced code blocks.
+
+A small regex tokenizer, not a parser: comments, strings, numbers, keywords
+and called names are enough to make code in an answer readable. Languages
+are matched by the fence hint (```python); unknown hints get a generic mix
+of the common rules. Results are cached by (code, language), so a message
+that is rendered again — recycled bubble, window resize, streaming — never
+tokenizes its code twice.
+"""
+import re
+from functools import lru_cache
+
+_KEYWORDS = {
+    "python": "and as assert async await break class continue def del elif "
+              "else except False finally for from global if import in is "
+              "lambda None nonlocal not or pass raise return True try while "
+              "with yield match case self",
+    "js": "async await break case catch class const continue default delete "
+          "do else export extends false finally for from function if import "
+          "in instanceof let new null return static super switch this throw "
+          "true try typeof undefined var void while yield interface type "
+          "enum implements",
+    "c": "auto break case catch char class const continue default delete do "
+         "double else enum extern false final float for fn func go if impl "
+         "import int let long match mod mut namespace new nil null package "
+         "private protected public pub return self short signed sizeof "
+         "static struct super switch template this throw true try typedef "
+         "union unsigned use using var virtual void volatile while bool "
+         "string interface defer range chan map",
+    "shell": "if then else elif fi for while until do done case esac in "
+             "function return export local echo exit set unset source",
+    "sql": "select from where and or not insert into values update set "
+           "delete create table drop alter index join left right inner outer "
+           "on group by order having limit offset as distinct null is in "
+           "primary key references union all case when then else end",
+}
+_ALIASES = {
+    "py": "python", "python": "python", "python3": "python",
+    "js": "js", "javascript": "js", "ts": "js", "typescript": "js",
+    "jsx": "js", "tsx": "js", "json": "js",
+    "c": "c", "h": "c", "cpp": "c", "c++": "c", "cc": "c", "cs": "c",
+    "csharp": "c", "java": "c", "go": "c", "rust": "c", "rs": "c",
+    "kotlin": "c", "swift": "c", "php": "c",
+    "sh": "shell", "bash": "shell", "shell": "shell", "zsh": "shell",
+    "console": "shell",
+    "sql": "sql", "sqlite": "sql", "postgresql": "sql", "mysql": "sql",
+}
+_COMMENTS = {
+    "python": r"#[^\n]*",
+    "js": r"//[^\n]*|/\*[\s\S]*?\*/",
+    "c": r"//[^\n]*|/\*[\s\S]*?\*/",
+    "shell": r"#[^\n]*",
+    "sql": r"--[^\n]*|/\*[\s\S]*?\*/",
+    "": r"#[^\n]*|//[^\n]*|/\*[\s\S]*?\*/",
+}
+_STRINGS = (r'"""[\s\S]*?"""|\'\'\'[\s\S]*?\'\'\'|"(?:\\.|[^"\\\n])*"?'
+            r"|'(?:\\.|[^'\\\n])*'?|`(?:\\.|[^`\\])*`?")
+_NUMBER = r"\b(?:0[xXbBoO][0-9a-fA-F_]+|\d[\d_]*(?:\.\d+)?(?:[eE][+-]?\d+)?)\b"
+_CALL = r"\b[A-Za-z_]\w*(?=\s*\()"
+
+# Token kinds, in the order of the pattern's groups
+KINDS = ("comment", "string", "number", "keyword", "call")
+
+
+@lru_cache(maxsize=None)
+def _pattern(family: str):
+    words = _KEYWORDS.get(family) or " ".join(_KEYWORDS.values())
+    keywords = "|".join(sorted(set(words.split()), key=len, reverse=True))
+    flags = re.IGNORECASE if family == "sql" else 0
+    return re.compile(
+        f"({_COMMENTS.get(family, _COMMENTS[''])})|({_STRINGS})|({_NUMBER})"
+        f"|\\b({keywords})\\b|({_CALL})", flags)
+
+
+@lru_cache(maxsize=1024)
+def tokenize(code: str, lang: str = "") -> tuple:
+    """Split `code` into (text, kind) pieces covering all of it; plain text
+    has the kind ""."""
+    pattern = _pattern(_ALIASES.get(lang.lower(), ""))
+    tokens = []
+    pos = 0
+    for m in pattern.finditer(code):
+        if m.start() == m.end():
+            continue
+        if m.start() > pos:
+            tokens.append((code[pos:m.start()], ""))
+        tokens.append((m.group(), KINDS[m.lastindex - 1]))
+        pos = m.end()
+    if pos < len(code):
+        tokens.append((code[pos:], ""))
+    return tuple(tokens)
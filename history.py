@@ -0,0 +1,128 @@
+"""Context-window budgeting for the chat graph.
+
+Token counts are estimated (≈4 characters per token plus a small per-message
+overhead), which is close enough to keep prompts inside the model's context
+without loading a tokenizer for every model.
+"""
+from functools import lru_cache
+
+from langchain_core.messages import BaseMessage, HumanMessage, SystemMessage
+
+HISTORY_BUDGET = 3000       # prompt tokens sent to the model per turn
+SUMMARIZE_HISTORY = False   # fold trimmed turns into a running summary
+SUMMARY_BATCH = 6           # trimmed messages to collect before summarizing
+MESSAGE_OVERHEAD = 4        # role markers / separators per message
+STOPPED_REPLY = "⏹"         # stands in for a reply stopped before any token
+# Share of the budget freed whenever the window has to slide. The window
+# then stays put for a few turns, so consecutive prompts share a prefix
+# that Ollama can reuse instead of evaluating the whole history again.
+WINDOW_SLACK = 0.25
+
+
+@lru_cache(maxsize=16384)
+def count_text_tokens(text: str) -> int:
+    """Estimated tokens of `text` sent as one message."""
+    return MESSAGE_OVERHEAD + (len(text) + 3) // 4
+
+
+def count_tokens(message: BaseMessage) -> int:
+    content = message.content
+    return count_text_tokens(content if isinstance(content, str)
+                             else str(content))
+
+
+def pinned_count(messages: list) -> int:
+    """Leading system messages plus the first user message are always kept."""
+    n = 0
+    while n < len(messages) and isinstance(messages[n], SystemMessage):
+        n += 1
+    if n < len(messages) and isinstance(messages[n], HumanMessage):
+        n += 1
+    return n
+
+
+def select_window(messages: list, budget: int, reserved: int = 0,
+                  previous=None):
+    """Split `messages` into (pinned, start) for a prompt within `budget`.
+
+    `pinned` is the number of leading messages always sent and `start` the
+    index of the oldest recent message that still fits; messages in
+    [pinned, start) are left out. The newest message is always included.
+
+    The `previous` window is kept while it still fits, so the prompt only
+    grows at the end. Once it overflows, the window slides far enough to
+    leave WINDOW_SLACK of the budget free for the next turns.
+    """
+    pinned = min(pinned_count(messages), max(len(messages) - 1, 0))
+    used = reserved + sum(count_tokens(m) for m in messages[:pinned])
+    if previous and previous[0] == pinned \
+            and pinned <= previous[1] < len(messages):
+        kept = used + sum(count_tokens(m) for m in messages[previous[1]:])
+        if kept <= budget:
+            return tuple(previous)
+    if used + sum(count_tokens(m) for m in messages[pinned:]) <= budget:
+        return pinned, pinned
+    limit = budget - int(budget * WINDOW_SLACK)
+    start = len(messages)
+    while start > pinned:
+        cost = count_tokens(messages[start - 1])
+        if used + cost > limit and start < len(messages):
+            break
+        used += cost
+        start -= 1
+    return pinned, start
+
+
+def summary_prompt(previous: str, messages: list) -> str:
+    lines = [f"{'Usuario' if isinstance(m, HumanMessage) else 'Asistente'}: "
+             f"{m.content}" for m in messages]
+    return ("Resume de forma breve la siguiente conversación, conservando "
+            "nombres, datos y decisiones importantes.\n\n"
+            + (f"Resumen previo:\n{previous}\n\n" if previous else "")
+            + "Conversación:\n" + "\n".join(lines) + "\n\nResumen:")
+
+
+def title_prompt(messages: list) -> str:
+    """Ask for a chat title from its opening messages."""
+    lines = [f"{'Usuario' if isinstance(m, HumanMessage) else 'Asistente'}: "
+             f"{m.content[:600]}" for m in messages]
+    return ("Escribe un título breve (máximo 6 palabras) para esta "
+            "conversación, en su mismo idioma. Responde solo con el título."
+            "\n\n" + "\n".join(lines) + "\n\nTítulo:")
+
+
+def summary_message(summary: str):
+    if not summary:
+        return None
+    return SystemMessage(content=f"Resumen de la conversación anterior:\n{summary}")
+
+
+def context_message(context: str):
+    if not context:
+        return None
+    return SystemMessage(content=(
+        "Fragmentos de documentos locales que pueden ser relevantes. Úsalos "
+        "para responder si aplican y cita el número del fragmento; si no "
+        "bastan, dilo.\n\n" + context))
+
+
+def build_prompt(messages: list, window, summary: str = "",
+                 context: str = "") -> list:
+    """Messages actually sent to the model for a (pinned, start) window.
+
+    Retrieved `context` goes right before the newest message, which is the
+    question it was retrieved for.
+    """
+    if not window:
+        prompt = list(messages)
+    else:
+        pinned, start = window
+        prompt = list(messages[:pinned])
+        summary_msg = summary_message(summary)
+        if summary_msg is not None and start > pinned:
+            prompt.append(summary_msg)
+        prompt.extend(messages[start:])
+    context_msg = context_message(context)
+    if context_msg is not None and prompt:
+        prompt.insert(len(prompt) - 1, context_msg)
+    return prompt
@@ -0,0 +1,131 @@
+"""Low-priority background jobs: chat titles and rolling summaries.
+
+Jobs run one at a time on a daemon thread, and only while no interactive
+reply is being generated. The app calls `hold()` when a reply starts: the
+job running at that moment is stopped mid-stream and queued again, so a
+prompt never waits behind background work. After `release()`, jobs resume
+once things have been quiet for IDLE_DELAY seconds.
+"""
+import os
+import threading
+import time
+
+# Model for background jobs; empty = the chat's own model, which is already
+# loaded (a second model can push the chat model out of memory)
+IDLE_MODEL = os.environ.get("OLLAMA_IDLE_MODEL", "")
+IDLE_DELAY = 1.5            # seconds without interactive replies before a job
+TITLE_CHARS = 40
+
+# Job priorities: lower runs first
+TITLE, SUMMARY = 0, 1
+
+
+def complete(llm, prompt, cancel) -> str | None:
+    """Stream `prompt` through `llm`; None if `cancel` was set midway."""
+    from engine import stream     # loaded already: `llm` comes from it
+    # Cancelling cuts the HTTP stream, which makes Ollama stop generating
+    parts = list(stream(llm, prompt, cancel))
+    if cancel.is_set():
+        return None
+    return "".join(parts).strip()
+
+
+def clean_title(text: str) -> str:
+    """First line of a model-written title, without quotes or a final dot."""
+    line = next((ln for ln in text.splitlines() if ln.strip()), "")
+    line = line.strip().strip("\"'«»*#").removeprefix("Título:").strip()
+    line = line.rstrip(".").strip()
+    if len(line) > TITLE_CHARS:
+        line = line[:TITLE_CHARS - 1].rstrip() + "…"
+    return line
+
+
+class IdleWorker:
+    def __init__(self, delay: float = IDLE_DELAY):
+        self.delay = delay
+        self._jobs: dict = {}           # key -> (priority, seq, fn)
+        self._seq = 0
+        self._holds = 0
+        self._quiet_since = time.monotonic()
+        self._running = None            # (key, priority, seq, fn) in progress
+        self._preempt = threading.Event()
+        self._stopped = False
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._loop, daemon=True,
+                                        name="idle")
+        self._thread.start()
+
+    def submit(self, key, fn, priority=SUMMARY):
+        """Queue `fn(cancel)`; it replaces any job queued under `key`.
+
+        `fn` must give up without side effects once `cancel` is set; it is
+        then run again later.
+        """
+        with self._cond:
+            self._seq += 1
+            self._jobs[key] = (priority, self._seq, fn)
+            self._cond.notify()
+
+    def discard(self, key):
+        """Drop the job queued or running under `key`."""
+        with self._cond:
+            self._jobs.pop(key, None)
+            if self._running is not None and self._running[0] == key:
+                self._running = None
+                self._preempt.set()
+
+    def hold(self):
+        """An interactive reply started: stop background work right away."""
+        with self._cond:
+            self._holds += 1
+            self._preempt.set()
+
+    def release(self):
+        with self._cond:
+            self._holds = max(self._holds - 1, 0)
+            self._quiet_since = time.monotonic()
+            self._cond.notify()
+
+    def pending(self) -> int:
+        with self._cond:
+            return len(self._jobs)
+
+    def shutdown(self):
+        with self._cond:
+            self._stopped = True
+            self._jobs.clear()
+            self._preempt.set()
+            self._cond.notify()
+
+    def _next(self):
+        with self._cond:
+            while True:
+                if self._stopped:
+                    return None
+                wait = self._quiet_since + self.delay - time.monotonic()
+                if self._jobs and not self._holds and wait <= 0:
+                    key = min(self._jobs, key=lambda k: self._jobs[k][:2])
+                    self._running = (key, *self._jobs.pop(key))
+                    self._preempt.clear()
+                    return self._running
+                self._cond.wait(wait if self._jobs and not self._holds
+                                else None)
+
+    def _loop(self):
+        while True:
+            job = self._next()
+            if job is None:
+                return
+            key, priority, seq, fn = job
+            try:
+                fn(self._preempt)
+            except Exception:
+                # Background niceties: a failed job is simply dropped
+                pass
+            with self._cond:
+                interrupted = (self._running is job and self._preempt.is_set()
+                               and not self._stopped)
+                self._running = None
+                if interrupted and key not in self._jobs:
+                    # Run it again, in its old place, at the next quiet moment
+                    self._jobs[key] = (priority, seq, fn)
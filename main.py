@@ -1,23 +1,33 @@
 import customtkinter as ctk
+import tkinter as tk
+import tkinter.font as tkfont
 from tkinter import messagebox, filedialog
 import threading
 import queue
 import time
-import re
-from langchain_ollama import OllamaLLM
-from langchain_core.messages import HumanMessage, AIMessage
-from langgraph.graph import StateGraph, END, START
-from langgraph.checkpoint.memory import MemorySaver
-from typing import Annotated, TypedDict
+import bisect
+import itertools
+import math
+import os
+import shutil
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from markdown_tree import IncrementalParser, parse
+from highlight import tokenize
+from store import DB_PATH, HIT_END, HIT_START, SEARCH_LIMIT, ChatStore
+from archive import export_jsonl, export_markdown, import_jsonl, write_markdown
+from ollama_api import MAX_PARALLEL, fetch_models, preload_async
+from profiling import tracer
+from idle import IDLE_MODEL, TITLE, IdleWorker, clean_title, complete
 import requests
 
 # ── CustomTkinter global config ─────────────────────
 ctk.set_appearance_mode("dark")
 ctk.set_default_color_theme("blue")
 
-# ── State definition ─────────────────────────────────
-class ChatState(TypedDict):
-    messages: Annotated[list, lambda x, y: x + y]
+# ── Ollama connection ────────────────────────────────
+MAX_BACKOFF = 10            # max seconds between model discovery retries
 
 
 # ── Palette (Synthwave / Neon) ───────────────────────
@@ -64,8 +74,17 @@ FONTS = {
     "small":     ("Segoe UI", 10),
     "mono":      ("Cascadia Code", 10),
     "nano":      ("Segoe UI", 9),
+    "heading":   ("Segoe UI Semibold", 14),
 }
 
+# Streamed tokens are painted at most once per frame (~60 fps)
+FRAME_MS = 16
+
+# "text" draws each message into one Tk Text widget; "widgets" is the
+# original renderer, with a frame per line and a label per span
+BUBBLE_RENDERER = os.environ.get("OLLAMA_CHAT_RENDERER", "text")
+TEXT_WIDTH = 544            # text width (px) until the bubble is laid out
+
 
 # ── Typing indicator ─────────────────────────────────
 class TypingIndicator(ctk.CTkFrame):
@@ -98,6 +117,10 @@ class TypingIndicator(ctk.CTkFrame):
             self.after_cancel(self._job)
             self._job = None
 
+    def destroy(self):
+        self.stop()
+        super().destroy()
+
     def _animate(self):
         colors = [C["purple"], C["cyan"], C["pink"]]
         for i, dot in enumerate(self._dots):
@@ -108,8 +131,25 @@ class TypingIndicator(ctk.CTkFrame):
 
 # ── Chat bubble ──────────────────────────────────────
 class ChatBubble(ctk.CTkFrame):
-    def __init__(self, parent, role: str, text: str, timestamp: str, **kw):
+    def __init__(self, parent, role: str, text: str, timestamp: str,
+                 streaming: bool = False, **kw):
         super().__init__(parent, fg_color="transparent", **kw)
+        self._meta = None
+        self._bubble = None
+        self._parser = None
+        self.show(role, text, timestamp, streaming)
+
+    @tracer.traced("ChatBubble.show", "ui")
+    def show(self, role: str, text: str, timestamp: str,
+             streaming: bool = False):
+        """(Re)build the bubble content so the widget can be recycled."""
+        if self._meta is not None:
+            self._meta.destroy()
+            self._bubble.destroy()
+        self._parser = None
+        self._tail = []
+        self._n_rendered = 0
+        self._prev = None
         is_user = role == "user"
 
         # Meta row
@@ -126,6 +166,7 @@ class ChatBubble(ctk.CTkFrame):
                          font=FONTS["small"], fg_color="transparent").pack(side="left")
             ctk.CTkLabel(meta, text=f"  {timestamp}", text_color=C["text_dim"],
                          font=FONTS["nano"], fg_color="transparent").pack(side="left")
+        self._meta = meta
 
         # Bubble container
         bubble_color = C["bubble_user"] if is_user else C["card"]
@@ -139,108 +180,622 @@ class ChatBubble(ctk.CTkFrame):
             bubble.pack(anchor="e", padx=(80, 14), pady=(0, 8))
         else:
             bubble.pack(anchor="w", padx=(14, 80), pady=(0, 8))
+        self._bubble = bubble
+
+        if streaming:
+            self._parser = IncrementalParser()
+            self.set_text(text)
+        else:
+            self._render(bubble, text)
+
+    def set_text(self, text):
+        """Show the text streamed so far; only the open tail is re-rendered."""
+        if self._parser is None:
+            return
+        blocks = self._parser.feed(text)
+        self._render_stream(blocks, self._parser.closed)
 
-        self._render(bubble, text)
+    def finish(self, text):
+        """Render the final text of a streaming bubble."""
+        if self._parser is None:
+            return
+        blocks = self._parser.feed(text, final=True)
+        self._render_stream(blocks, len(blocks))
+        self._parser = None
+
+    def _render_stream(self, blocks, closed):
+        for w in self._tail:
+            w.destroy()
+        self._tail = []
+        for block in blocks[self._n_rendered:closed]:
+            if self._render_block(self._bubble, block, self._prev) is not None:
+                self._prev = block
+        self._n_rendered = closed
+        prev = self._prev
+        for block in blocks[closed:]:
+            w = self._render_block(self._bubble, block, prev)
+            if w is not None:
+                self._tail.append(w)
+                prev = block
 
     def _render(self, parent, text):
-        """Render with basic markdown: ```blocks```, **bold**, `code`."""
-        parts = re.split(r'(```[\s\S]*?```)', text)
-        for part in parts:
-            if part.startswith("```") and part.endswith("```"):
-                raw = part[3:-3].strip()
-                # Strip language hint
-                if "\n" in raw:
-                    first, rest = raw.split("\n", 1)
-                    if re.match(r'^[a-zA-Z0-9+#-]+$', first.strip()):
-                        raw = rest
-
-                code_frame = ctk.CTkFrame(parent, fg_color="#050710",
-                                           corner_radius=8,
-                                           border_width=1,
-                                           border_color=C["cyan"])
-                code_frame.pack(fill="x", padx=12, pady=6)
-                ctk.CTkLabel(code_frame, text=raw,
-                             text_color=C["text_code"],
-                             font=FONTS["mono"],
-                             justify="left", anchor="w",
-                             wraplength=520,
-                             fg_color="transparent").pack(
-                    padx=12, pady=8, anchor="w")
-            else:
-                stripped = part.strip()
-                if stripped:
-                    for line in stripped.split("\n"):
-                        if not line.strip():
-                            ctk.CTkFrame(parent, fg_color="transparent",
-                                         height=4).pack()
-                            continue
-                        self._render_line(parent, line.strip())
-
-    def _render_line(self, parent, line):
+        """Render the cached markdown tree of `text`."""
+        prev = None
+        for block in parse(text):
+            if self._render_block(parent, block, prev) is not None:
+                prev = block
+
+    def _render_block(self, parent, block, prev):
+        if block.kind == "blank":
+            if prev is None or prev.kind in ("blank", "code"):
+                return None
+            spacer = ctk.CTkFrame(parent, fg_color="transparent", height=4)
+            spacer.pack()
+            return spacer
+
+        if block.kind == "code":
+            code_frame = ctk.CTkFrame(parent, fg_color="#050710",
+                                       corner_radius=8,
+                                       border_width=1,
+                                       border_color=C["cyan"])
+            code_frame.pack(fill="x", padx=12, pady=6)
+            ctk.CTkLabel(code_frame, text=block.code,
+                         text_color=C["text_code"],
+                         font=FONTS["mono"],
+                         justify="left", anchor="w",
+                         wraplength=520,
+                         fg_color="transparent").pack(
+                padx=12, pady=8, anchor="w")
+            return code_frame
+
         row = ctk.CTkFrame(parent, fg_color="transparent")
         row.pack(fill="x", padx=12, pady=1, anchor="w")
-
-        pattern = re.compile(r'(\*\*(.+?)\*\*|`([^`]+)`)')
-        pos = 0
         col = 0
-        for m in pattern.finditer(line):
-            before = line[pos:m.start()]
-            if before:
-                ctk.CTkLabel(row, text=before, text_color=C["text"],
-                             font=FONTS["body"], fg_color="transparent",
-                             wraplength=520, justify="left").grid(
-                    row=0, column=col, sticky="w")
-                col += 1
-            if m.group(1).startswith("**"):
-                ctk.CTkLabel(row, text=m.group(2), text_color=C["text"],
-                             font=FONTS["body_bold"], fg_color="transparent",
-                             wraplength=520, justify="left").grid(
-                    row=0, column=col, sticky="w")
-            else:
-                ctk.CTkLabel(row, text=m.group(3), text_color=C["text_code"],
+        if block.kind == "list":
+            ctk.CTkLabel(row, text=f"{block.marker} ", text_color=C["purple"],
+                         font=FONTS["body_bold"], fg_color="transparent").grid(
+                row=0, column=col, sticky="nw")
+            col += 1
+        base_font = FONTS["heading"] if block.kind == "heading" else FONTS["body"]
+        for span in block.spans:
+            if span.style == "code":
+                ctk.CTkLabel(row, text=span.text, text_color=C["text_code"],
                              font=FONTS["mono"], fg_color="#050710",
                              corner_radius=4,
                              wraplength=520, justify="left").grid(
                     row=0, column=col, sticky="w", padx=2)
+            else:
+                font = FONTS["body_bold"] if span.style == "bold" else base_font
+                ctk.CTkLabel(row, text=span.text, text_color=C["text"],
+                             font=font, fg_color="transparent",
+                             wraplength=520, justify="left").grid(
+                    row=0, column=col, sticky="w")
             col += 1
-            pos = m.end()
-        tail = line[pos:]
-        if tail:
-            ctk.CTkLabel(row, text=tail, text_color=C["text"],
-                         font=FONTS["body"], fg_color="transparent",
-                         wraplength=520, justify="left").grid(
-                row=0, column=col, sticky="w")
+        return row
+
+
+# ── Text-widget bubble ───────────────────────────────
+TEXT_TAGS = {
+    "b":      {"font": FONTS["body_bold"]},
+    "ic":     {"font": FONTS["mono"], "foreground": C["text_code"],
+               "background": "#050710"},
+    "h":      {"font": FONTS["heading"], "spacing1": 4, "spacing3": 2},
+    "li":     {"lmargin2": 16},
+    "marker": {"font": FONTS["body_bold"], "foreground": C["purple"]},
+    "gap":    {"font": (FONTS["nano"][0], 3)},
+    "pre":    {"font": FONTS["mono"], "foreground": C["text_code"],
+               "background": "#050710", "lmargin1": 8, "lmargin2": 8,
+               "wrap": "char"},
+    "pre_pad": {"font": (FONTS["mono"][0], 4)},
+    # Syntax highlighting; created after "pre", so they take precedence
+    "tok_comment": {"foreground": C["text_dim"]},
+    "tok_string":  {"foreground": C["green"]},
+    "tok_number":  {"foreground": C["yellow"]},
+    "tok_keyword": {"foreground": C["pink"]},
+    "tok_call":    {"foreground": C["purple"]},
+}
+_SPAN_TAGS = {"bold": ("b",), "code": ("ic",)}
+_BLOCK_TAGS = {"heading": ("h",), "list": ("li",)}
+_fonts: dict = {}           # font spec -> tkfont.Font, for measuring
+
+
+@lru_cache(maxsize=4096)
+def text_runs(block, prev_kind) -> tuple:
+    """(text, tags) runs drawing `block` after a block of `prev_kind`
+    (None at the top), each block ending with its newline."""
+    if block.kind == "blank":
+        if prev_kind in (None, "blank", "code"):
+            return ()
+        return (("\n", ("gap",)),)
+    if block.kind == "code":
+        # Newlines tagged "pre" paint the background to the right edge
+        return (("\n", ("pre", "pre_pad")),
+                *((text, ("pre", f"tok_{kind}") if kind else ("pre",))
+                  for text, kind in tokenize(block.code, block.lang)),
+                ("\n", ("pre",)), ("\n", ("pre", "pre_pad")))
+    base = _BLOCK_TAGS.get(block.kind, ())
+    runs = []
+    if block.kind == "list":
+        runs.append((f"{block.marker} ", base + ("marker",)))
+    for span in block.spans:
+        runs.append((span.text, base + _SPAN_TAGS.get(span.style, ())))
+    runs.append(("\n", base))
+    return tuple(runs)
+
+
+def _font_for(tags):
+    if "pre" in tags or "ic" in tags:
+        spec = FONTS["mono"]
+    elif "h" in tags:
+        spec = FONTS["heading"]
+    elif "b" in tags or "marker" in tags:
+        spec = FONTS["body_bold"]
+    else:
+        spec = FONTS["body"]
+    font = _fonts.get(spec)
+    if font is None:
+        font = _fonts[spec] = tkfont.Font(font=spec)
+    return font
+
+
+class MarkdownText(tk.Text):
+    """Read-only Text that draws markdown blocks with tags.
+
+    It sits in a frame sized in pixels: as wide as the longest line, up to
+    the space available, and as tall as the wrapped text. A width change
+    re-wraps the text in place; nothing is rebuilt.
+    """
+
+    PADX, PADY = 4, 2
+
+    def __init__(self, parent, bg):
+        self.holder = tk.Frame(parent, bg=bg, width=1, height=1)
+        self.holder.pack_propagate(False)
+        super().__init__(self.holder, wrap="word", bg=bg, fg=C["text"],
+                         font=FONTS["body"], bd=0, highlightthickness=0,
+                         relief="flat", padx=self.PADX, pady=self.PADY,
+                         spacing1=1, spacing3=1, cursor="arrow",
+                         insertwidth=0, takefocus=0,
+                         selectbackground=C["border_glow"],
+                         inactiveselectbackground=C["border_glow"],
+                         yscrollcommand=self._pin_top)
+        self.pack(fill="both", expand=True)
+        for tag, options in TEXT_TAGS.items():
+            self.tag_configure(tag, **options)
+        # Start of the blocks that may still change while streaming
+        self.mark_set("tail", "1.0")
+        self.mark_gravity("tail", "left")
+        self.configure(state="disabled")
+        self._closed = 0
+        self._prev = None
+        self._natural = 0           # widest closed line (px), inf if too wide
+        self._tail_width = 0
+        self._avail = TEXT_WIDTH
+        self.bind("<Configure>", self._fit)
+
+    def render(self, blocks, closed):
+        """Draw `blocks`. The first `closed` ones are final and drawn once;
+        the rest replace whatever open blocks the last call drew."""
+        self.configure(state="normal")
+        self.delete("tail", "end-1c")
+        runs, self._prev = self._runs(blocks[self._closed:closed], self._prev)
+        self._insert(runs)
+        self._natural = max(self._natural, self._measure(runs))
+        self._closed = max(closed, self._closed)
+        self.mark_set("tail", "end-1c")
+        runs, _ = self._runs(blocks[closed:], self._prev)
+        self._insert(runs)
+        self._tail_width = self._measure(runs)
+        self.configure(state="disabled")
+        self.reflow()
+
+    def reflow(self, avail=None):
+        """Fit the frame within `avail` pixels (the last width if None)."""
+        if avail is not None:
+            self._avail = avail
+        # Padding plus the left margin of code and list lines
+        natural = max(self._natural, self._tail_width) + 2 * self.PADX + 12
+        width = int(min(natural, self._avail))
+        if width != self.holder.winfo_reqwidth():
+            # The text re-wraps and reports its new size via <Configure>
+            self.holder.configure(width=width)
+        else:
+            self._fit()
+
+    @staticmethod
+    def _runs(blocks, prev):
+        runs = []
+        for block in blocks:
+            block_runs = text_runs(block, prev)
+            if block_runs:
+                runs.extend(block_runs)
+                prev = block.kind
+        return runs, prev
+
+    def _insert(self, runs):
+        if runs:
+            # One Tcl call for the whole batch: text, tags, text, tags...
+            self.insert("end-1c", *itertools.chain.from_iterable(runs))
+
+    def _measure(self, runs):
+        """Widest line of `runs` in pixels; inf once it can't fit anyway."""
+        widest = line = 0
+        for text, tags in runs:
+            font = _font_for(tags)
+            for i, part in enumerate(text.split("\n")):
+                if i:
+                    widest, line = max(widest, line), 0
+                if part:
+                    line += font.measure(part)
+            if max(widest, line) >= self._avail:
+                return math.inf
+        return max(widest, line)
+
+    def _pin_top(self, first, _last):
+        # The chat view scrolls, not the text (the wheel or a drag
+        # selection would otherwise scroll it by a line)
+        if float(first) > 0:
+            self.yview_moveto(0)
+
+    def _fit(self, _=None):
+        """Make the frame as tall as the text wrapped at its width."""
+        if self.winfo_width() <= 1:
+            return          # not laid out yet; <Configure> calls back
+        height = int(self.tk.call(self._w, "count", "-update", "-ypixels",
+                                  "1.0", "end-1c")) + 2 * self.PADY
+        if height != self.holder.winfo_reqheight():
+            self.holder.configure(height=height)
+
+
+class TextBubble(ChatBubble):
+    """ChatBubble drawn into a single MarkdownText.
+
+    The number of widgets no longer grows with the message, the text can be
+    selected and copied, and resizing re-wraps it instead of rebuilding.
+    """
+
+    INSET = 14 + 80 + 2 * 12    # bubble side padding plus the text's inset
+
+    def __init__(self, parent, role: str, text: str, timestamp: str,
+                 streaming: bool = False, **kw):
+        self._body = None
+        self._avail = TEXT_WIDTH
+        super().__init__(parent, role, text, timestamp, streaming, **kw)
+        self.bind("<Configure>", self._on_resize, add="+")
+
+    def show(self, role: str, text: str, timestamp: str,
+             streaming: bool = False):
+        self._body = None
+        super().show(role, text, timestamp, streaming)
+
+    def _content(self):
+        if self._body is None:
+            self._body = MarkdownText(self._bubble,
+                                      bg=self._bubble.cget("fg_color"))
+            self._body.holder.pack(padx=12, pady=8)
+            self._body.reflow(self._avail)
+        return self._body
+
+    def _render(self, parent, text):
+        blocks = parse(text)
+        self._content().render(blocks, len(blocks))
+
+    def _render_stream(self, blocks, closed):
+        self._content().render(blocks, closed)
+
+    def _on_resize(self, event):
+        avail = max(event.width - self.INSET, 120)
+        if avail != self._avail:
+            self._avail = avail
+            if self._body is not None:
+                self._body.reflow(avail)
+
+
+Bubble = TextBubble if BUBBLE_RENDERER == "text" else ChatBubble
+
+
+# ── Virtualized chat view ────────────────────────────
+class ChatView(ctk.CTkFrame):
+    """Message list that only keeps widgets for the bubbles near the viewport.
+
+    Messages live in a plain list; bubbles are placed on a canvas at offsets
+    computed from per-message heights (estimated until measured once).
+    Bubbles that scroll out of range go back to a small pool and are reused
+    for the next message that scrolls in.
+    """
+
+    OVERSCAN = 3        # extra bubbles materialized above/below the viewport
+    POOL_SIZE = 8       # detached bubbles kept around for reuse
+    WHEEL_UNITS = 3
+    HEIGHT_CACHE_SIZE = 20000   # measured heights remembered, LRU
+
+    def __init__(self, parent, **kw):
+        super().__init__(parent, fg_color=C["surface"], corner_radius=0, **kw)
+        # (role, text, width) -> measured height
+        self._height_cache: OrderedDict = OrderedDict()
+        self.grid_rowconfigure(0, weight=1)
+        self.grid_columnconfigure(0, weight=1)
+
+        self.canvas = tk.Canvas(self, bg=C["surface"], highlightthickness=0,
+                                bd=0, yscrollincrement=20)
+        self.canvas.grid(row=0, column=0, sticky="nsew")
+        self.scrollbar = ctk.CTkScrollbar(self, command=self._yview,
+                                          button_color=C["border"],
+                                          button_hover_color=C["purple"])
+        self.scrollbar.grid(row=0, column=1, sticky="ns")
+        self.canvas.configure(yscrollcommand=self.scrollbar.set)
+
+        self.messages: list = []
+        self._heights: list[int] = []
+        self._offsets: list[int] = [0]
+        self._live: dict = {}           # idx -> (bubble, canvas window id)
+        self._pool: list = []
+        self._pinned = None             # idx of the bubble being streamed
+        self._footer = None
+        self._footer_id = None
+        self._width = 1
+        self._region = 1
+
+        self.canvas.bind("<Configure>", self._on_resize)
+        self.canvas.bind_all("<MouseWheel>", self._on_wheel, add="+")
+        self.canvas.bind_all("<Button-4>", self._on_wheel, add="+")
+        self.canvas.bind_all("<Button-5>", self._on_wheel, add="+")
+
+    # ── Public API ─────────────────────────────
+    def set_messages(self, messages):
+        for idx in list(self._live):
+            self._release(idx, force=True)
+        self._pinned = None
+        self.set_footer(None)
+        self.messages = list(messages)
+        self._heights = [self._estimate(role, text)
+                         for role, text, _ in self.messages]
+        self._relayout()
+        self.canvas.yview_moveto(0.0)
+
+    def append(self, role, text, ts, streaming=False):
+        self.messages.append((role, text, ts))
+        self._heights.append(self._estimate(role, text))
+        self._offsets.append(self._offsets[-1] + self._heights[-1])
+        idx = len(self.messages) - 1
+        if streaming:
+            self._materialize(idx, streaming=True)
+            self._pinned = idx
+        self._update_region()
+
+    def update_stream(self, text):
+        """Show new text in the bubble being streamed."""
+        if self._pinned is None:
+            return
+        role, _, ts = self.messages[self._pinned]
+        self.messages[self._pinned] = (role, text, ts)
+        self._live[self._pinned][0].set_text(text)
+        self._measure(self._pinned)
+
+    def finish_stream(self, text):
+        """Render the final markdown of the streamed bubble and unpin it."""
+        if self._pinned is None:
+            return False
+        idx, self._pinned = self._pinned, None
+        role, _, ts = self.messages[idx]
+        self.messages[idx] = (role, text, ts)
+        self._live[idx][0].finish(text)
+        self._measure(idx)
+        return True
+
+    def set_footer(self, widget):
+        """Place `widget` (a child of self.canvas) after the last message."""
+        if self._footer is not None:
+            self.canvas.delete(self._footer_id)
+            self._footer.destroy()
+        self._footer = widget
+        self._footer_id = None
+        if widget is not None:
+            self._footer_id = self.canvas.create_window(
+                0, self._offsets[-1], window=widget, anchor="nw",
+                width=self._width)
+        self._relayout()
+
+    def scroll_bottom(self):
+        self.canvas.update_idletasks()
+        self.canvas.yview_moveto(1.0)
+        self._render_visible()
+        self.canvas.yview_moveto(1.0)
+
+    def scroll_to(self, idx):
+        """Bring message `idx` to the top of the viewport."""
+        if not 0 <= idx < len(self.messages):
+            return
+        self.canvas.update_idletasks()
+        # Measuring the bubbles that come into view can move the target
+        for _ in range(2):
+            self.canvas.yview_moveto(self._offsets[idx] / self._region)
+            self._render_visible()
+
+    # ── Layout ──────────────────────────────────
+    def _estimate(self, role, text):
+        key = (role, text, self._width)
+        cached = self._height_cache.get(key)
+        if cached is not None:
+            self._height_cache.move_to_end(key)
+            return cached
+        lines = text.count("\n") + 1 + len(text) // 80
+        return 60 + 22 * lines
+
+    def _relayout(self):
+        self._offsets = [0, *itertools.accumulate(self._heights)]
+        for idx, (_, wid) in self._live.items():
+            self.canvas.coords(wid, 0, self._offsets[idx])
+        self._update_region()
+
+    def _update_region(self):
+        total = self._offsets[-1]
+        if self._footer is not None:
+            self.canvas.coords(self._footer_id, 0, total)
+            self.canvas.update_idletasks()
+            total += self._footer.winfo_reqheight()
+        height = max(total, self.canvas.winfo_height(), 1)
+        self._region = height
+        self.canvas.configure(scrollregion=(0, 0, self._width, height))
+
+    def _measure(self, idx):
+        self.canvas.update_idletasks()
+        h = self._live[idx][0].winfo_reqheight()
+        self._remember_height(idx, h)
+        if h != self._heights[idx]:
+            self._heights[idx] = h
+            self._relayout()
+
+    def _remember_height(self, idx, h):
+        if idx == self._pinned:
+            return      # still streaming, its text isn't final
+        role, text, _ = self.messages[idx]
+        key = (role, text, self._width)
+        self._height_cache[key] = h
+        self._height_cache.move_to_end(key)
+        if len(self._height_cache) > self.HEIGHT_CACHE_SIZE:
+            self._height_cache.popitem(last=False)
+
+    def _render_visible(self):
+        # Measuring new bubbles can shift offsets, so settle in a few passes
+        for _ in range(3):
+            if not self._fill_viewport():
+                break
+
+    def _fill_viewport(self):
+        n = len(self.messages)
+        top = self.canvas.canvasy(0)
+        bottom = top + max(self.canvas.winfo_height(), 1)
+        first = max(bisect.bisect_right(self._offsets, top) - 1
+                    - self.OVERSCAN, 0)
+        last = min(bisect.bisect_left(self._offsets, bottom)
+                   + self.OVERSCAN, n)
+
+        for idx in list(self._live):
+            if not first <= idx < last:
+                self._release(idx)
+        fresh = [i for i in range(first, last) if i not in self._live]
+        for idx in fresh:
+            self._materialize(idx)
+        if not fresh:
+            return False
+
+        self.canvas.update_idletasks()
+        changed = False
+        for idx in fresh:
+            h = self._live[idx][0].winfo_reqheight()
+            self._remember_height(idx, h)
+            if h != self._heights[idx]:
+                self._heights[idx] = h
+                changed = True
+        if changed:
+            self._relayout()
+        return changed
+
+    def _materialize(self, idx, streaming=False):
+        role, text, ts = self.messages[idx]
+        if self._pool:
+            bubble = self._pool.pop()
+            bubble.show(role, text, ts, streaming)
+        else:
+            bubble = Bubble(self.canvas, role, text, ts, streaming)
+        wid = self.canvas.create_window(0, self._offsets[idx], window=bubble,
+                                        anchor="nw", width=self._width)
+        self._live[idx] = (bubble, wid)
+
+    def _release(self, idx, force=False):
+        if idx == self._pinned and not force:
+            return
+        bubble, wid = self._live.pop(idx)
+        self.canvas.delete(wid)
+        if len(self._pool) < self.POOL_SIZE:
+            self._pool.append(bubble)
+        else:
+            bubble.destroy()
+
+    # ── Events ──────────────────────────────────
+    def _yview(self, *args):
+        self.canvas.yview(*args)
+        self._render_visible()
+
+    def _on_resize(self, event):
+        self._width = event.width
+        for _, wid in self._live.values():
+            self.canvas.itemconfigure(wid, width=event.width)
+        if self._footer_id is not None:
+            self.canvas.itemconfigure(self._footer_id, width=event.width)
+        if self._live:
+            # Text bubbles re-wrap to the new width, changing their height
+            self.canvas.update_idletasks()
+            for idx, (bubble, _) in self._live.items():
+                self._heights[idx] = bubble.winfo_reqheight()
+        self._relayout()
+        self._render_visible()
+
+    def _on_wheel(self, event):
+        if not str(event.widget).startswith(str(self.canvas)):
+            return
+        if event.num == 4 or getattr(event, "delta", 0) > 0:
+            step = -self.WHEEL_UNITS
+        else:
+            step = self.WHEEL_UNITS
+        self.canvas.yview_scroll(step, "units")
+        self._render_visible()
 
 
 # ── Session item in sidebar ──────────────────────────
 class SessionItem(ctk.CTkFrame):
-    def __init__(self, parent, title, on_click, on_delete, **kw):
+    """One sidebar row; `show` rebinds it to another session when recycled."""
+
+    def __init__(self, parent, on_click, on_delete, **kw):
         super().__init__(parent, fg_color="transparent",
                          corner_radius=10, cursor="hand2", **kw)
+        self.sid = None
         self._active = False
-        self._on_click = on_click
-
-        self.lbl = ctk.CTkLabel(self, text=title, text_color=C["text_dim"],
-                                 font=FONTS["small"], anchor="w",
-                                 wraplength=150, justify="left",
-                                 fg_color="transparent")
-        self.lbl.pack(side="left", fill="x", expand=True, padx=(10, 0), pady=8)
 
+        # Packed first so long titles get clipped instead of pushing them out
         self.del_btn = ctk.CTkButton(self, text="✕", width=22, height=22,
                                       fg_color="transparent",
                                       hover_color=C["btn_delete"],
                                       text_color=C["text_dim"],
                                       font=FONTS["nano"],
                                       corner_radius=6,
-                                      command=on_delete)
+                                      command=lambda: on_delete(self.sid))
         self.del_btn.pack(side="right", padx=(0, 6))
 
-        self.bind("<Button-1>", lambda _: on_click())
-        self.lbl.bind("<Button-1>", lambda _: on_click())
-        self.bind("<Enter>", self._hover_on)
-        self.bind("<Leave>", self._hover_off)
-        self.lbl.bind("<Enter>", self._hover_on)
-        self.lbl.bind("<Leave>", self._hover_off)
+        # Shown while this chat has a reply in progress
+        self.busy_lbl = ctk.CTkLabel(self, text="", width=14,
+                                      text_color=C["cyan"], font=FONTS["nano"],
+                                      fg_color="transparent")
+        self.busy_lbl.pack(side="right", padx=(4, 0))
+
+        # Title, and below it the background summary once there is one
+        text = ctk.CTkFrame(self, fg_color="transparent")
+        text.pack(side="left", fill="both", expand=True, padx=(10, 0))
+        self.lbl = ctk.CTkLabel(text, text="", text_color=C["text_dim"],
+                                 font=FONTS["small"], anchor="w", height=18,
+                                 fg_color="transparent")
+        self.lbl.pack(fill="x", expand=True)
+        self.sub = ctk.CTkLabel(text, text="", text_color=C["text_dim"],
+                                 font=FONTS["nano"], anchor="w", height=14,
+                                 fg_color="transparent")
+
+        for widget in (self, text, self.lbl, self.sub):
+            widget.bind("<Button-1>", lambda _: on_click(self.sid))
+            widget.bind("<Enter>", self._hover_on)
+            widget.bind("<Leave>", self._hover_off)
+
+    def show(self, session, active):
+        self.sid = session["id"]
+        self.lbl.configure(text=session["title"])
+        summary = " ".join(session["summary"].split())
+        if summary:
+            self.sub.configure(text=summary)
+            self.sub.pack(fill="x", expand=True)
+        else:
+            self.sub.pack_forget()
+        self.set_busy(session["_busy"])
+        self.set_active(active)
 
     def set_active(self, active: bool):
         self._active = active
@@ -249,6 +804,9 @@ class SessionItem(ctk.CTkFrame):
         self.lbl.configure(text_color=C["text"] if active else C["text_dim"],
                            font=FONTS["body_bold"] if active else FONTS["small"])
 
+    def set_busy(self, busy: bool):
+        self.busy_lbl.configure(text="●" if busy else "")
+
     def _hover_on(self, _):
         if not self._active:
             self.configure(fg_color=C["border"])
@@ -258,9 +816,379 @@ class SessionItem(ctk.CTkFrame):
             self.configure(fg_color="transparent")
 
 
+# ── Virtualized session list ─────────────────────────
+class SessionList(ctk.CTkFrame):
+    """Sidebar chat list that only keeps widgets for the visible rows.
+
+    Sessions stay in the app's dict keyed by id, in sidebar order. Rows have
+    a fixed height, so the visible range is plain arithmetic, and the same
+    few SessionItem widgets are rebound as the list scrolls. Adding,
+    deleting, renaming or switching chats touches at most the rows on
+    screen, however many chats there are.
+    """
+
+    ROW_HEIGHT = 44
+    OVERSCAN = 2        # extra rows kept above/below the viewport
+    WHEEL_ROWS = 2
+
+    def __init__(self, parent, sessions: dict, on_click, on_delete, **kw):
+        super().__init__(parent, fg_color="transparent", corner_radius=0, **kw)
+        self.grid_rowconfigure(0, weight=1)
+        self.grid_columnconfigure(0, weight=1)
+
+        self.canvas = tk.Canvas(self, bg=C["sidebar"], highlightthickness=0,
+                                bd=0, yscrollincrement=self.ROW_HEIGHT // 2)
+        self.canvas.grid(row=0, column=0, sticky="nsew")
+        self.scrollbar = ctk.CTkScrollbar(self, command=self._yview,
+                                          button_color=C["border"],
+                                          button_hover_color=C["purple"])
+        self.scrollbar.grid(row=0, column=1, sticky="ns")
+        self.canvas.configure(yscrollcommand=self.scrollbar.set)
+
+        self.sessions = sessions
+        self.active_id = None
+        self._on_click = on_click
+        self._on_delete = on_delete
+        self._order: list | None = None     # ids by row, rebuilt lazily
+        self._rows: dict = {}               # row -> (item, canvas window id)
+        self._pool: list = []
+        self._width = 1
+
+        self.canvas.bind("<Configure>", self._on_resize)
+        self.canvas.bind_all("<MouseWheel>", self._on_wheel, add="+")
+        self.canvas.bind_all("<Button-4>", self._on_wheel, add="+")
+        self.canvas.bind_all("<Button-5>", self._on_wheel, add="+")
+
+    # ── Public API ─────────────────────────────
+    def reload(self):
+        """Sessions were added or removed: refresh the rows on screen."""
+        self._order = None
+        self._update_region()
+        self._render_visible(force=True)
+
+    def refresh(self, sid):
+        """Redraw the row of session `sid` if it is on screen."""
+        for item, _ in self._rows.values():
+            if item.sid == sid:
+                item.show(self.sessions[sid], sid == self.active_id)
+                return
+
+    def set_active(self, sid):
+        old, self.active_id = self.active_id, sid
+        for item, _ in self._rows.values():
+            if item.sid in (old, sid):
+                item.set_active(item.sid == sid)
+
+    def neighbour(self, sid):
+        """Id of the row below `sid`, or above it for the last row."""
+        ids = self._ids()
+        row = ids.index(sid)
+        return ids[row + 1] if row + 1 < len(ids) else ids[row - 1]
+
+    def see(self, sid):
+        """Scroll just enough to show the row of session `sid`."""
+        row = self._ids().index(sid)
+        top = self.canvas.canvasy(0)
+        height = max(self.canvas.winfo_height(), 1)
+        y = row * self.ROW_HEIGHT
+        if y < top:
+            self.canvas.yview_moveto(y / self._region())
+        elif y + self.ROW_HEIGHT > top + height:
+            self.canvas.yview_moveto(
+                (y + self.ROW_HEIGHT - height) / self._region())
+        self._render_visible()
+
+    # ── Rows ────────────────────────────────────
+    def _ids(self):
+        if self._order is None:
+            self._order = list(self.sessions)
+        return self._order
+
+    def _region(self):
+        return max(len(self.sessions) * self.ROW_HEIGHT,
+                   self.canvas.winfo_height(), 1)
+
+    def _update_region(self):
+        self.canvas.configure(scrollregion=(0, 0, self._width,
+                                            self._region()))
+
+    def _render_visible(self, force=False):
+        ids = self._ids()
+        top = self.canvas.canvasy(0)
+        bottom = top + max(self.canvas.winfo_height(), 1)
+        first = max(int(top) // self.ROW_HEIGHT - self.OVERSCAN, 0)
+        last = min(int(bottom) // self.ROW_HEIGHT + 1 + self.OVERSCAN,
+                   len(ids))
+
+        for row in list(self._rows):
+            if force or not first <= row < last:
+                item, wid = self._rows.pop(row)
+                self.canvas.delete(wid)
+                self._pool.append(item)
+        for row in range(first, last):
+            if row in self._rows:
+                continue
+            item = (self._pool.pop() if self._pool else
+                    SessionItem(self.canvas, self._on_click, self._on_delete))
+            item.show(self.sessions[ids[row]], ids[row] == self.active_id)
+            wid = self.canvas.create_window(
+                0, row * self.ROW_HEIGHT, window=item, anchor="nw",
+                width=self._width, height=self.ROW_HEIGHT - 4)
+            self._rows[row] = (item, wid)
+
+    # ── Events ──────────────────────────────────
+    def _yview(self, *args):
+        self.canvas.yview(*args)
+        self._render_visible()
+
+    def _on_resize(self, event):
+        self._width = event.width
+        for _, wid in self._rows.values():
+            self.canvas.itemconfigure(wid, width=event.width)
+        self._update_region()
+        self._render_visible()
+
+    def _on_wheel(self, event):
+        if not str(event.widget).startswith(str(self.canvas)):
+            return
+        if event.num == 4 or getattr(event, "delta", 0) > 0:
+            step = -self.WHEEL_ROWS
+        else:
+            step = self.WHEEL_ROWS
+        self.canvas.yview_scroll(step, "units")
+        self._render_visible()
+
+
+# ── Search result in sidebar ─────────────────────────
+class SearchResult(ctk.CTkFrame):
+    """One matching message: chat title, then the snippet with hits marked."""
+
+    def __init__(self, parent, title, role, ts, snippet, on_click, **kw):
+        super().__init__(parent, fg_color="transparent",
+                         corner_radius=10, cursor="hand2", **kw)
+        who = "Tú" if role == "user" else "Ollama"
+        head = ctk.CTkLabel(self, text=f"{title}  ·  {who} {ts}",
+                            text_color=C["purple"], font=FONTS["nano"],
+                            anchor="w", fg_color="transparent")
+        head.pack(fill="x", padx=10, pady=(6, 0))
+
+        snippet = " ".join(snippet.split())
+        self.text = tk.Text(self, height=min(3, len(snippet) // 30 + 1),
+                            width=24, wrap="word", bd=0, highlightthickness=0,
+                            bg=C["sidebar"], fg=C["text_dim"],
+                            font=FONTS["small"], cursor="hand2")
+        self.text.tag_configure("hit", foreground=C["yellow"])
+        # Markers come in pairs, so every odd part is a match
+        parts = snippet.replace(HIT_END, HIT_START).split(HIT_START)
+        for i, part in enumerate(parts):
+            self.text.insert("end", part, ("hit",) if i % 2 else ())
+        self.text.configure(state="disabled")
+        self.text.pack(fill="x", padx=10, pady=(2, 6))
+
+        for w in (self, head, self.text):
+            w.bind("<Button-1>", lambda _: on_click())
+            w.bind("<Enter>", lambda _: self._hover(True))
+            w.bind("<Leave>", lambda _: self._hover(False))
+
+    def _hover(self, on):
+        self.configure(fg_color=C["border"] if on else "transparent")
+        self.text.configure(bg=C["border"] if on else C["sidebar"])
+
+
+# ── Compare window ───────────────────────────────────
+class CompareWindow(ctk.CTkToplevel):
+    """One prompt sent to several models, answers streamed side by side."""
+
+    def __init__(self, app):
+        super().__init__(app.root)
+        self.app = app
+        self.title("Comparar modelos")
+        self.geometry("1200x720")
+        self.configure(fg_color=C["bg"])
+        self.grid_columnconfigure(0, weight=1)
+        self.grid_rowconfigure(2, weight=1)
+
+        self._run = 0
+        self._cancel = None
+        self._busy = False
+        self._pending: set = set()
+        self._columns: dict = {}        # model -> (column frame, status, textbox)
+        self._buffers: dict = {}        # model -> text waiting for the next frame
+        self._flush_job = None
+        # Each model keeps its own thread for the life of the window
+        self._thread_prefix = f"compare_{time.time()}"
+
+        # Model picker
+        picker = ctk.CTkFrame(self, fg_color=C["sidebar"], corner_radius=0)
+        picker.grid(row=0, column=0, sticky="ew")
+        ctk.CTkLabel(picker, text="🤖  Modelos", text_color=C["text_dim"],
+                     font=FONTS["nano"], fg_color="transparent").grid(
+            row=0, column=0, padx=(16, 10), pady=10, sticky="w")
+        current = app.model_var.get()
+        models = sorted(app.models, key=lambda m: m != current)
+        self._checks = {}
+        for i, model in enumerate(models):
+            var = ctk.BooleanVar(value=i < 2)
+            ctk.CTkCheckBox(picker, text=model, variable=var,
+                            text_color=C["text"], font=FONTS["small"],
+                            fg_color=C["purple"], hover_color=C["btn_hover"],
+                            border_color=C["border"]).grid(
+                row=i // 5, column=1 + i % 5, padx=8, pady=8, sticky="w")
+            self._checks[model] = var
+
+        # Prompt
+        row = ctk.CTkFrame(self, fg_color=C["sidebar"], corner_radius=0)
+        row.grid(row=1, column=0, sticky="ew")
+        row.grid_columnconfigure(0, weight=1)
+        self.prompt_box = ctk.CTkTextbox(row, height=70,
+                                          fg_color=C["input_bg"],
+                                          text_color=C["text"],
+                                          font=FONTS["body"],
+                                          border_width=1,
+                                          border_color=C["border"],
+                                          corner_radius=12, wrap="word")
+        self.prompt_box.grid(row=0, column=0, padx=(16, 8), pady=(0, 12),
+                             sticky="ew")
+        self.prompt_box.bind("<Control-Return>", self._send)
+        self.send_btn = ctk.CTkButton(row, text="Comparar\n➤", width=100,
+                                      height=70, fg_color=C["btn_primary"],
+                                      hover_color=C["btn_hover"],
+                                      text_color=C["text"],
+                                      font=FONTS["body_bold"],
+                                      corner_radius=12, command=self._send)
+        self.send_btn.grid(row=0, column=1, padx=(0, 16), pady=(0, 12))
+
+        # Answer columns
+        self._grid = ctk.CTkFrame(self, fg_color=C["surface"], corner_radius=0)
+        self._grid.grid(row=2, column=0, sticky="nsew")
+        self._grid.grid_rowconfigure(0, weight=1)
+
+        self.bind("<Escape>", self._stop)
+        self.protocol("WM_DELETE_WINDOW", self.close)
+        self.prompt_box.focus_set()
+
+    def _layout(self, models):
+        """Keep columns (and their text) for models still selected."""
+        for model in list(self._columns):
+            if model not in models:
+                self._columns.pop(model)[0].destroy()
+        for i in range(max(len(models), len(self._columns)) + 1):
+            self._grid.grid_columnconfigure(i, weight=0, uniform="")
+        for i, model in enumerate(models):
+            if model not in self._columns:
+                col = ctk.CTkFrame(self._grid, fg_color=C["card"],
+                                   corner_radius=12, border_width=1,
+                                   border_color=C["border"])
+                col.grid_rowconfigure(2, weight=1)
+                col.grid_columnconfigure(0, weight=1)
+                ctk.CTkLabel(col, text=f"✦ {model}", text_color=C["cyan"],
+                             font=FONTS["body_bold"],
+                             fg_color="transparent").grid(
+                    row=0, column=0, padx=12, pady=(10, 0), sticky="w")
+                status = ctk.CTkLabel(col, text="", text_color=C["text_dim"],
+                                      font=FONTS["nano"],
+                                      fg_color="transparent")
+                status.grid(row=1, column=0, padx=12, sticky="w")
+                box = ctk.CTkTextbox(col, fg_color=C["card"],
+                                     text_color=C["text"], font=FONTS["body"],
+                                     wrap="word", state="disabled")
+                box.grid(row=2, column=0, padx=8, pady=(4, 8), sticky="nsew")
+                self._columns[model] = (col, status, box)
+            col = self._columns[model][0]
+            col.grid(row=0, column=i, padx=6, pady=10, sticky="nsew")
+            self._grid.grid_columnconfigure(i, weight=1, uniform="answers")
+
+    def _send(self, _=None):
+        models = [m for m, var in self._checks.items() if var.get()]
+        prompt = self.prompt_box.get("0.0", "end").strip()
+        if self._pending or not prompt or not models:
+            return "break"
+        self.prompt_box.delete("0.0", "end")
+        self._layout(models)
+        self._run += 1
+        self._cancel = threading.Event()
+        self._pending = set(models)
+        for model in models:
+            _, status, box = self._columns[model]
+            status.configure(text="⏳  En cola…")
+            self._write(box, f"▶ {prompt}\n\n")
+        self._lock(True)
+        self.app.pool.submit(self.app._start_compare, self._run, prompt,
+                             models, self._thread_prefix, self._cancel)
+        return "break"
+
+    def _stop(self, _=None):
+        if self._cancel is not None:
+            self._cancel.set()
+
+    def _lock(self, busy):
+        if busy != self._busy:
+            # Background work in the app pauses while models are answering
+            (self.app.idle.hold if busy else self.app.idle.release)()
+            self._busy = busy
+        if busy:
+            self.send_btn.configure(text="Detener\n■", command=self._stop,
+                                    fg_color=C["btn_delete"],
+                                    hover_color=C["btn_delete_h"])
+        else:
+            self.send_btn.configure(text="Comparar\n➤", command=self._send,
+                                    fg_color=C["btn_primary"],
+                                    hover_color=C["btn_hover"])
+
+    def on_event(self, kind, key, payload):
+        run, model = key
+        if run != self._run or model not in self._columns:
+            return      # from an earlier comparison
+        _, status, box = self._columns[model]
+        if kind == "start":
+            status.configure(text="✍️  Generando…")
+        elif kind == "chunk":
+            self._buffers[model] = self._buffers.get(model, "") + payload
+            if self._flush_job is None:
+                self._flush_job = self.after(FRAME_MS, self._flush)
+            return
+        else:
+            self._flush()
+            if kind == "error":
+                status.configure(text=f"⚠️  {payload}")
+            elif payload["stopped"]:
+                status.configure(text="⏹  Detenida")
+            elif payload["ttft"] is not None:
+                status.configure(
+                    text=f"⚡  {payload['ttft']:.2f} s primer token  ·  "
+                         f"{payload['tps']:.1f} tok/s  ·  "
+                         f"{payload['latency']:.1f} s total")
+            self._write(box, "\n\n" + "─" * 24 + "\n\n")
+            self._pending.discard(model)
+            if not self._pending:
+                self._lock(False)
+
+    def _flush(self):
+        if self._flush_job is not None:
+            self.after_cancel(self._flush_job)
+            self._flush_job = None
+        for model, text in self._buffers.items():
+            if model in self._columns:
+                self._write(self._columns[model][2], text)
+        self._buffers.clear()
+
+    def _write(self, box, text):
+        box.configure(state="normal")
+        box.insert("end", text)
+        box.configure(state="disabled")
+        box.see("end")
+
+    def close(self):
+        self._stop()
+        if self._busy:
+            self.app.idle.release()
+        self.app._compare = None
+        self.destroy()
+
+
 # ── Main Application ─────────────────────────────────
 class OllamaInterface:
-    def __init__(self, root: ctk.CTk):
+    def __init__(self, root: ctk.CTk, db_path: str = DB_PATH):
         self.root = root
         self.root.title("Ollama Chat")
         self.root.geometry("1260x780")
@@ -269,52 +1197,54 @@ class OllamaInterface:
 
         self.window_open = True
         self.response_queue: queue.Queue = queue.Queue()
-        self.llm = None
-        self.checkpointer = MemorySaver()
-        self.conversation_graph = self._build_graph()
+        self._wake_lock = threading.Lock()
+        self._wake_pending = False
+        self.pool = ThreadPoolExecutor(max_workers=MAX_PARALLEL,
+                                       thread_name_prefix="generate")
+        self.store = ChatStore(db_path, on_error=lambda msg: self._post(
+            ("status", None, f"⚠️  No se pudo guardar: {msg}")))
+        self.engine = None              # imported lazily, see _get_engine
+        self._engine_lock = threading.Lock()
+        # Per-chat document indexes (RAG), opened on first use
+        self._rag_dir = os.path.join(os.path.dirname(db_path), "rag")
+        self._paste_dir = os.path.join(os.path.dirname(db_path), "pastes")
+        self._indexes: dict = {}
+        self._ingest_pool = ThreadPoolExecutor(max_workers=1,
+                                               thread_name_prefix="ingest")
+        self._ingest_cancel: dict = {}  # session id -> Event
+        self._archive_cancel = None     # Event while an export/import runs
+        self._compare = None            # open CompareWindow
+        self.cache = None               # ResponseCache while enabled
+        self._compare_runner = None
         self.typing_indicator = None
+        self._welcome = None
+        self._streaming = False
+        self._flush_job = None
+        self._last_stats = None
+        self._search_job = None
         self._initialized = False
 
-        self.sessions: list[dict] = []
-        self.active_idx: int | None = None
-        self._session_cnt = 0
+        # Keyed by session id, in sidebar order
+        self.sessions: dict[int, dict] = {}
+        self.active_id: int | None = None
+        self._session_cnt = self.store.max_session_id()
+        self._id_lock = threading.Lock()    # archive imports also take ids
+        self.idle = IdleWorker()
 
-        self.models = self._fetch_models()
-        if not self.models:
-            messagebox.showerror(
-                "Sin conexión",
-                "No se encontraron modelos.\nAsegúrate de que Ollama esté corriendo:\n\n  ollama serve"
-            )
-            self.root.after(0, self.root.destroy)
-            return
+        self.models: list[str] = []
 
         self._build_ui()
-        self._new_session()
-        self._poll_queue()
+        if self.cache_var.get():
+            self._on_cache_toggle()
+        self._load_sessions()
+        self.root.bind("<<ResponseReady>>", self._drain_queue)
+        self.root.bind("<Escape>", self._stop)
+        self.root.bind("<F12>", self._toggle_metrics)
+        # Pick up anything posted before the main loop started
+        self.root.after(0, self._drain_queue)
+        self._start_discovery()
         self._initialized = True
 
-    # ── LangGraph ─────────────────────────────────
-    def _build_graph(self):
-        builder = StateGraph(ChatState)
-        builder.add_node("chatbot", self._invoke_model)
-        builder.add_edge(START, "chatbot")
-        builder.add_edge("chatbot", END)
-        return builder.compile(checkpointer=self.checkpointer)
-
-    def _invoke_model(self, state: ChatState):
-        response = self.llm.invoke(state["messages"])
-        return {"messages": [AIMessage(content=response)]}
-
-    # ── Fetch models ───────────────────────────────
-    def _fetch_models(self):
-        try:
-            r = requests.get("http://localhost:11434/api/tags", timeout=5)
-            if r.status_code == 200:
-                return [m["name"] for m in r.json().get("models", [])]
-        except Exception:
-            pass
-        return []
-
     # ── Build UI ───────────────────────────────────
     def _build_ui(self):
         # Root 2-column grid
@@ -353,21 +1283,45 @@ class OllamaInterface:
                                  command=self._new_session)
         new_btn.grid(row=1, column=0, sticky="ew", padx=12, pady=(0, 8))
 
-        # Separator line
-        ctk.CTkFrame(sidebar, height=1, fg_color=C["border"],
+        # Search box + separator line
+        search_frame = ctk.CTkFrame(sidebar, fg_color="transparent")
+        search_frame.grid(row=2, column=0, sticky="ew", padx=12, pady=(0, 6))
+        search_frame.grid_columnconfigure(0, weight=1)
+        # No textvariable: CTkEntry hides its placeholder when one is set
+        self.search_entry = ctk.CTkEntry(search_frame,
+                                          placeholder_text="🔍  Buscar en chats…",
+                                          fg_color=C["input_bg"],
+                                          border_color=C["border"],
+                                          text_color=C["text"],
+                                          font=FONTS["small"],
+                                          corner_radius=8, height=30)
+        self.search_entry.grid(row=0, column=0, sticky="ew")
+        self.search_entry.bind("<KeyRelease>", self._on_search_key)
+        self.search_entry.bind("<Escape>", self._clear_search)
+        self._search_info = ctk.CTkLabel(search_frame, text="",
+                                          text_color=C["text_dim"],
+                                          font=FONTS["nano"],
+                                          fg_color="transparent")
+        ctk.CTkFrame(search_frame, height=1, fg_color=C["border"],
                      corner_radius=0).grid(row=2, column=0, sticky="ew",
-                                           padx=8, pady=(0, 6))
+                                           pady=(8, 0))
 
         # Session list
-        self.session_scroll = ctk.CTkScrollableFrame(
-            sidebar, fg_color="transparent",
-            scrollbar_button_color=C["border"],
-            scrollbar_button_hover_color=C["purple"])
+        self.session_scroll = SessionList(sidebar, self.sessions,
+                                          on_click=self._switch_session,
+                                          on_delete=self._delete_session)
         self.session_scroll.grid(row=3, column=0, sticky="nsew",
                                   padx=6, pady=(0, 6))
-        self.session_scroll.grid_columnconfigure(0, weight=1)
         sidebar.grid_rowconfigure(3, weight=1)
 
+        # Search results take the session list's place while searching
+        self.search_scroll = ctk.CTkScrollableFrame(
+            sidebar, fg_color="transparent",
+            scrollbar_button_color=C["border"],
+            scrollbar_button_hover_color=C["purple"])
+        self.search_scroll.grid_columnconfigure(0, weight=1)
+        self._search_results = []
+
         # Model selector footer
         ctk.CTkFrame(sidebar, height=1, fg_color=C["border"],
                      corner_radius=0).grid(row=4, column=0, sticky="ew", padx=8)
@@ -380,9 +1334,9 @@ class OllamaInterface:
                      font=FONTS["nano"], fg_color="transparent").grid(
             row=0, column=0, sticky="w", pady=(0, 4))
 
-        self.model_var = ctk.StringVar(value=self.models[0])
+        self.model_var = ctk.StringVar(value="Conectando…")
         self.model_combo = ctk.CTkComboBox(footer,
-                                            values=self.models,
+                                            values=[],
                                             variable=self.model_var,
                                             fg_color=C["input_bg"],
                                             border_color=C["border"],
@@ -392,9 +1346,20 @@ class OllamaInterface:
                                             dropdown_hover_color=C["border"],
                                             text_color=C["text"],
                                             font=FONTS["small"],
-                                            state="readonly")
+                                            state="readonly",
+                                            command=self._on_model_change)
         self.model_combo.grid(row=1, column=0, sticky="ew")
 
+        self.cache_var = ctk.BooleanVar(
+            value=self.store.get_setting("response_cache") == "1")
+        ctk.CTkSwitch(footer, text="Caché de respuestas",
+                      variable=self.cache_var, command=self._on_cache_toggle,
+                      text_color=C["text_dim"], font=FONTS["nano"],
+                      progress_color=C["purple"],
+                      button_color=C["text"],
+                      button_hover_color=C["text"]).grid(
+            row=2, column=0, sticky="w", pady=(8, 0))
+
         # ── Main panel ────────────────────────────
         main = ctk.CTkFrame(self.root, fg_color=C["surface"], corner_radius=0)
         main.grid(row=0, column=1, sticky="nsew")
@@ -418,6 +1383,38 @@ class OllamaInterface:
         actions = ctk.CTkFrame(topbar, fg_color="transparent")
         actions.grid(row=0, column=1, padx=12, sticky="e")
 
+        ctk.CTkButton(actions, text="📊  Métricas",
+                       fg_color="transparent",
+                       hover_color=C["border"],
+                       border_width=1, border_color=C["border"],
+                       text_color=C["text_dim"], font=FONTS["small"],
+                       corner_radius=8, height=30, width=100,
+                       command=self._toggle_metrics).pack(side="left", padx=(0, 6))
+
+        ctk.CTkButton(actions, text="⚖  Comparar",
+                       fg_color="transparent",
+                       hover_color=C["border"],
+                       border_width=1, border_color=C["border"],
+                       text_color=C["text_dim"], font=FONTS["small"],
+                       corner_radius=8, height=30, width=100,
+                       command=self._open_compare).pack(side="left", padx=(0, 6))
+
+        ctk.CTkButton(actions, text="📎  Docs",
+                       fg_color="transparent",
+                       hover_color=C["border"],
+                       border_width=1, border_color=C["border"],
+                       text_color=C["text_dim"], font=FONTS["small"],
+                       corner_radius=8, height=30, width=90,
+                       command=self._attach_docs).pack(side="left", padx=(0, 6))
+
+        ctk.CTkButton(actions, text="📄  Adjuntar",
+                       fg_color="transparent",
+                       hover_color=C["border"],
+                       border_width=1, border_color=C["border"],
+                       text_color=C["text_dim"], font=FONTS["small"],
+                       corner_radius=8, height=30, width=100,
+                       command=self._attach_files).pack(side="left", padx=(0, 6))
+
         ctk.CTkButton(actions, text="💾  Exportar",
                        fg_color="transparent",
                        hover_color=C["border"],
@@ -426,6 +1423,16 @@ class OllamaInterface:
                        corner_radius=8, height=30, width=100,
                        command=self._export_chat).pack(side="left", padx=(0, 6))
 
+        self._archive_btn = ctk.CTkButton(
+            actions, text="📦  Archivo",
+            fg_color="transparent",
+            hover_color=C["border"],
+            border_width=1, border_color=C["border"],
+            text_color=C["text_dim"], font=FONTS["small"],
+            corner_radius=8, height=30, width=100,
+            command=self._archive_menu)
+        self._archive_btn.pack(side="left", padx=(0, 6))
+
         ctk.CTkButton(actions, text="🗑  Borrar",
                        fg_color="transparent",
                        hover_color=C["btn_delete"],
@@ -438,13 +1445,10 @@ class OllamaInterface:
         ctk.CTkFrame(main, height=1, fg_color=C["border"],
                      corner_radius=0).grid(row=0, column=0, sticky="sew")
 
-        # Chat scroll area
-        self.chat_scroll = ctk.CTkScrollableFrame(
-            main, fg_color=C["surface"],
-            scrollbar_button_color=C["border"],
-            scrollbar_button_hover_color=C["purple"])
-        self.chat_scroll.grid(row=1, column=0, sticky="nsew")
-        self.chat_scroll.grid_columnconfigure(0, weight=1)
+        # Chat area (virtualized)
+        self.chat_view = ChatView(main)
+        self.chat_view.grid(row=1, column=0, sticky="nsew")
+        self._build_metrics_panel(main)
 
         # ── Input area ────────────────────────────
         input_panel = ctk.CTkFrame(main, fg_color=C["sidebar"],
@@ -478,6 +1482,7 @@ class OllamaInterface:
         self.prompt_box.bind("<FocusIn>", self._clear_ph)
         self.prompt_box.bind("<FocusOut>", self._restore_ph)
         self.prompt_box.bind("<Control-Return>", self._send)
+        self.prompt_box.bind("<<Paste>>", self._on_paste)
 
         # Send button
         self.send_btn = ctk.CTkButton(input_panel,
@@ -498,8 +1503,125 @@ class OllamaInterface:
                                          text_color=C["text_dim"],
                                          font=FONTS["nano"],
                                          fg_color="transparent")
-        self._status_lbl.grid(row=2, column=0, columnspan=2,
-                               sticky="w", padx=18, pady=(0, 8))
+        self._status_lbl.grid(row=2, column=0, sticky="w",
+                               padx=18, pady=(0, 8))
+
+        # Regenerate skips the response cache and replaces the last reply
+        self.regen_btn = ctk.CTkButton(input_panel, text="↻  Regenerar",
+                                        width=90, height=24,
+                                        fg_color="transparent",
+                                        hover_color=C["card"],
+                                        text_color=C["text_dim"],
+                                        font=FONTS["nano"],
+                                        corner_radius=8,
+                                        command=self._regenerate)
+        self.regen_btn.grid(row=2, column=1, padx=(0, 16), pady=(0, 8))
+
+        # Files waiting to go out with the next message; click to drop them
+        self._attach_chip = ctk.CTkButton(input_panel, text="",
+                                           height=24, fg_color=C["card"],
+                                           hover_color=C["btn_delete"],
+                                           text_color=C["text"],
+                                           font=FONTS["nano"],
+                                           corner_radius=8, width=0,
+                                           command=self._clear_attachments)
+
+        # Shown while a bulk export/import runs, or attachments are read
+        self._progress = ctk.CTkProgressBar(input_panel, height=4,
+                                            fg_color=C["border"],
+                                            progress_color=C["purple"])
+
+    def _build_metrics_panel(self, parent):
+        """Overlay with per-reply Ollama stats and span timings (F12)."""
+        panel = ctk.CTkFrame(parent, fg_color=C["card"], corner_radius=12,
+                             border_width=1, border_color=C["border"])
+        header = ctk.CTkFrame(panel, fg_color="transparent")
+        header.pack(fill="x", padx=12, pady=(10, 4))
+        ctk.CTkLabel(header, text="📊  Rendimiento", text_color=C["purple"],
+                     font=FONTS["body_bold"],
+                     fg_color="transparent").pack(side="left")
+        for text, command in (("✕", self._toggle_metrics),
+                              ("Limpiar", self._clear_metrics),
+                              ("Exportar traza", self._export_trace)):
+            ctk.CTkButton(header, text=text, fg_color="transparent",
+                          hover_color=C["border"], border_width=1,
+                          border_color=C["border"], text_color=C["text_dim"],
+                          font=FONTS["nano"], corner_radius=8, height=24,
+                          width=30 if text == "✕" else 90,
+                          command=command).pack(side="right", padx=(6, 0))
+        self._metrics_lbl = ctk.CTkLabel(panel, text="", justify="left",
+                                         anchor="w", text_color=C["text"],
+                                         font=FONTS["mono"],
+                                         fg_color="transparent")
+        self._metrics_lbl.pack(fill="both", padx=14, pady=(0, 12))
+        self._metrics_panel = panel
+        self._metrics_visible = False
+
+    def _on_model_change(self, model):
+        # Warm the model up while the user is still typing
+        preload_async(model)
+
+    # ── Startup ──────────────────────────────────────
+    def _start_discovery(self):
+        self.status_var.set("🔌  Conectando con Ollama…")
+        threading.Thread(target=self._discover_models, daemon=True).start()
+
+    def _discover_models(self):
+        """Poll /api/tags with exponential backoff until models show up."""
+        delay = 0.5
+        while self.window_open:
+            try:
+                models = fetch_models()
+                reason = "No hay modelos instalados (ollama pull llama3)"
+            except requests.RequestException:
+                models = []
+                reason = "Ollama no responde (ollama serve)"
+            if models:
+                self._post(("models", None, models))
+                return
+            self._post(("status", None,
+                        f"⚠️  {reason} · reintento en {delay:.0f} s"))
+            time.sleep(delay)
+            delay = min(delay * 2, MAX_BACKOFF)
+
+    def _on_models(self, models):
+        self.models = models
+        self.model_combo.configure(values=models)
+        self.model_var.set(models[0])
+        if self._welcome is not None:
+            self._welcome_model.configure(text=f"Modelo activo: {models[0]}")
+        session = self.sessions[self.active_id]
+        if not session["_busy"]:
+            self.status_var.set("")
+        preload_async(models[0])
+        # Import the LLM stack in the background before the first send
+        self.pool.submit(self._get_engine)
+
+    def _get_engine(self):
+        """Build the engine on first use; called from worker threads only."""
+        with self._engine_lock:
+            if self.engine is None:
+                from attachments import NOTES_ENTRIES
+                from cache import ResponseCache
+                from engine import ChatEngine
+                notes = ResponseCache(
+                    os.path.join(os.path.dirname(self.store.path),
+                                 "attachment_notes.db"),
+                    max_entries=NOTES_ENTRIES)
+                self.engine = ChatEngine(self.store.checkpointer,
+                                         cache=self.cache, notes=notes)
+            return self.engine
+
+    def _on_cache_toggle(self):
+        enabled = self.cache_var.get()
+        self.store.set_setting("response_cache", int(enabled))
+        if enabled and self.cache is None:
+            from cache import ResponseCache
+            self.cache = ResponseCache(os.path.join(
+                os.path.dirname(self.store.path), "response_cache.db"))
+        with self._engine_lock:
+            if self.engine is not None:
+                self.engine.cache = self.cache if enabled else None
 
     # ── Placeholder ────────────────────────────────
     def _clear_ph(self, _=None):
@@ -517,75 +1639,114 @@ class OllamaInterface:
             self._ph_active = True
 
     # ── Sessions ────────────────────────────────────
-    def _new_session(self):
-        self._session_cnt += 1
-        session = {
-            "id":        self._session_cnt,
-            "title":     f"Chat {self._session_cnt}",
-            "thread_id": f"thread_{time.time()}_{self._session_cnt}",
-            "history":   [],
-            "_widget":   None,
+    def _load_sessions(self):
+        """Populate the sidebar from the store; messages load on first open."""
+        for row in self.store.list_sessions():
+            self.sessions[row[0]] = self._make_session(row)
+        self.session_scroll.reload()
+        if self.sessions:
+            self._switch_session(next(reversed(self.sessions)))
+        else:
+            self._new_session()
+
+    @staticmethod
+    def _make_session(row, history=None):
+        """Session dict for a `ChatStore.list_sessions()` row."""
+        sid, title, thread_id, titled, summary, summary_upto = row
+        return {
+            "id":           sid,
+            "title":        title,
+            "thread_id":    thread_id,
+            "titled":       bool(titled),   # title written by the model
+            "summary":      summary,        # rolling summary (idle worker)
+            "summary_upto": summary_upto,   # messages covered by it
+            "history":      history,
+            "_busy":        False,
+            "_stream":      None,
+            "_cancel":      None,
+            "_attach":      [],             # files for the next message
         }
-        self.sessions.append(session)
-        idx = len(self.sessions) - 1
-        self._add_session_widget(idx)
-        self._switch_session(idx)
-
-    def _add_session_widget(self, idx):
-        session = self.sessions[idx]
-
-        item = SessionItem(
-            self.session_scroll,
-            title=session["title"],
-            on_click=lambda i=idx: self._switch_session(i),
-            on_delete=lambda i=idx: self._delete_session(i),
-        )
-        item.grid(row=idx, column=0, sticky="ew", pady=2)
-        session["_widget"] = item
 
-    def _switch_session(self, idx):
-        if self.active_idx is not None and self.active_idx < len(self.sessions):
-            self.sessions[self.active_idx]["_widget"].set_active(False)
+    def _next_session_id(self):
+        with self._id_lock:
+            self._session_cnt += 1
+            return self._session_cnt
 
-        self.active_idx = idx
-        s = self.sessions[idx]
-        s["_widget"].set_active(True)
+    def _new_session(self):
+        sid = self._next_session_id()
+        session = self._make_session(
+            (sid, f"Chat {sid}", f"thread_{time.time()}_{sid}", False, "", 0),
+            history=[])
+        self.sessions[session["id"]] = session
+        self.store.add_session(session["id"], session["title"],
+                               session["thread_id"])
+        self.session_scroll.reload()
+        self._switch_session(session["id"])
+
+    def _switch_session(self, sid):
+        self.active_id = sid
+        s = self.sessions[sid]
+        if s["history"] is None:
+            s["history"] = [tuple(m) for m in self.store.load_messages(sid)]
+        self.session_scroll.set_active(sid)
+        self.session_scroll.see(sid)
         self.title_var.set(s["title"])
+        self._lock_input(s["_busy"])
+        self._show_attachments(s)
         self._rebuild_chat(s)
 
-    def _delete_session(self, idx):
+    def _delete_session(self, sid):
         if len(self.sessions) == 1:
             messagebox.showinfo("Info", "Debe haber al menos una sesión.")
             return
-        # Destroy widget
-        self.sessions[idx]["_widget"].destroy()
-        self.sessions.pop(idx)
-
-        # Rebuild all widgets with correct indices
-        for w in self.session_scroll.winfo_children():
-            w.destroy()
-        for i in range(len(self.sessions)):
-            self._add_session_widget(i)
-
-        new_idx = min(idx, len(self.sessions) - 1)
-        self.active_idx = None
-        self._switch_session(new_idx)
+        if sid == self.active_id:
+            next_id = self.session_scroll.neighbour(sid)
+        removed = self.sessions[sid]
+        if removed["_busy"]:
+            # Stop the reply and give back its hold on the idle worker;
+            # its "done" event is dropped once the session is gone
+            if removed["_cancel"] is not None:
+                removed["_cancel"].set()
+            self._set_busy(removed, False)
+        del self.sessions[sid]
+        self._discard_background(sid)
+        self.store.delete_session(removed["id"], removed["thread_id"])
+        self._drop_docs(removed["id"])
+        self._drop_pastes(removed["id"])
+        self.session_scroll.reload()
+        if sid == self.active_id:
+            self._switch_session(next_id)
 
     def _rebuild_chat(self, session):
-        for w in self.chat_scroll.winfo_children():
-            w.destroy()
         self.typing_indicator = None
-
-        if not session["history"]:
+        self._streaming = False
+        self._welcome = None
+        if self._flush_job is not None:
+            self.root.after_cancel(self._flush_job)
+            self._flush_job = None
+        self.chat_view.set_messages(session["history"])
+
+        if session["_stream"] is not None:
+            # Resume showing a reply that kept streaming in the background
+            self._streaming = True
+            self.chat_view.append("ai", session["_stream"],
+                                  time.strftime("%H:%M"), streaming=True)
+        elif session["_busy"]:
+            self._show_typing()
+        elif not session["history"]:
             self._show_welcome()
-        else:
-            for role, text, ts in session["history"]:
-                ChatBubble(self.chat_scroll, role, text, ts).pack(
-                    fill="x", pady=0)
         self._scroll_bottom()
 
+    def _append_bubble(self, role, text, ts, **kw):
+        """Add one message at the end of the chat without touching the rest."""
+        if self._welcome is not None:
+            self.chat_view.set_footer(None)
+            self._welcome = None
+        self.chat_view.append(role, text, ts, **kw)
+
     def _show_welcome(self):
-        frame = ctk.CTkFrame(self.chat_scroll, fg_color="transparent")
+        outer = ctk.CTkFrame(self.chat_view.canvas, fg_color="transparent")
+        frame = ctk.CTkFrame(outer, fg_color="transparent")
         frame.pack(expand=True, pady=80)
 
         # Glowing icon
@@ -597,10 +1758,11 @@ class OllamaInterface:
                      text_color=C["text"],
                      font=FONTS["title"],
                      fg_color="transparent").pack(pady=(10, 4))
-        ctk.CTkLabel(frame, text=f"Modelo activo: {self.model_var.get()}",
-                     text_color=C["text_dim"],
-                     font=FONTS["small"],
-                     fg_color="transparent").pack()
+        self._welcome_model = ctk.CTkLabel(
+            frame, text=f"Modelo activo: {self.model_var.get()}",
+            text_color=C["text_dim"], font=FONTS["small"],
+            fg_color="transparent")
+        self._welcome_model.pack()
 
         # Quick tip chips
         tips_frame = ctk.CTkFrame(frame, fg_color="transparent")
@@ -616,9 +1778,15 @@ class OllamaInterface:
                           font=FONTS["small"],
                           fg_color="transparent").pack(padx=14, pady=8)
 
+        self.chat_view.set_footer(outer)
+        self._welcome = outer
+
     # ── Send ─────────────────────────────────────────
     def _send(self, _=None):
-        if self._ph_active:
+        if self._ph_active or not self.models:
+            return
+        session = self.sessions[self.active_id]
+        if session["_busy"]:
             return
         prompt = self.prompt_box.get("0.0", "end").strip()
         if not prompt:
@@ -627,97 +1795,691 @@ class OllamaInterface:
         self.prompt_box.delete("0.0", "end")
         self._ph_active = False
 
-        session = self.sessions[self.active_idx]
         ts = time.strftime("%H:%M")
 
         # Auto-title
         if not session["history"]:
             title = prompt[:28] + ("…" if len(prompt) > 28 else "")
             session["title"] = title
-            session["_widget"].lbl.configure(text=title)
+            self.session_scroll.refresh(session["id"])
             self.title_var.set(title)
+            self.store.rename_session(session["id"], title)
 
         # User bubble
-        session["history"].append(("user", prompt, ts))
-        for w in self.chat_scroll.winfo_children():
-            w.destroy()
-        for role, text, t in session["history"]:
-            ChatBubble(self.chat_scroll, role, text, t).pack(fill="x")
-
-        # Typing indicator
-        self.typing_indicator = TypingIndicator(self.chat_scroll)
-        self.typing_indicator.pack(anchor="w", padx=14, pady=8)
-        self.typing_indicator.start()
+        attached, session["_attach"] = session["_attach"], []
+        self._show_attachments(session)
+        text = prompt
+        if attached:
+            text += "\n\n" + "  ".join(f"📄 {os.path.basename(p)}"
+                                        for p in attached)
+        session["history"].append(("user", text, ts))
+        self.store.add_message(session["id"], "user", text, ts)
+        self._append_bubble("user", text, ts)
+
+        self._set_busy(session, True)
+        self._show_typing()
         self._scroll_bottom()
 
-        # Lock input
-        self.send_btn.configure(state="disabled",
-                                 fg_color=C["border"],
-                                 text_color=C["text_dim"])
-        self.prompt_box.configure(state="disabled")
-        self.status_var.set("⏳  Generando respuesta…")
+        session["_cancel"] = threading.Event()
+        docs = self._docs_path(session["id"])
+        self.pool.submit(self._generate, session["id"], prompt,
+                         session["thread_id"], self.model_var.get(),
+                         session["_cancel"],
+                         docs if os.path.isdir(docs) else None, attached)
 
-        self.llm = OllamaLLM(model=self.model_var.get())
-        threading.Thread(target=self._generate,
-                         args=(prompt, session["thread_id"]),
-                         daemon=True).start()
-
-    def _generate(self, prompt, thread_id):
+    def _regenerate(self):
+        """Drop the last reply and ask the model again, bypassing the cache."""
+        if self.active_id is None or not self.models:
+            return
+        session = self.sessions[self.active_id]
+        if session["_busy"] or not session["history"] \
+                or session["history"][-1][0] != "ai":
+            return
+        session["history"].pop()
+        self.store.delete_last_message(session["id"])
+        self._set_busy(session, True)
+        self._rebuild_chat(session)
+
+        session["_cancel"] = threading.Event()
+        docs = self._docs_path(session["id"])
+        self.pool.submit(self._generate, session["id"], None,
+                         session["thread_id"], self.model_var.get(),
+                         session["_cancel"],
+                         docs if os.path.isdir(docs) else None)
+
+    def _generate(self, sid, prompt, thread_id, model, cancel=None,
+                  docs=None, attached=()):
+        """Run one turn; a `prompt` of None regenerates the last reply."""
         try:
-            config = {"configurable": {"thread_id": thread_id}}
-            msg = HumanMessage(content=prompt)
-            response_text = ""
-            for event in self.conversation_graph.stream(
-                {"messages": [msg]}, config=config, stream_mode="values"
-            ):
-                if "messages" in event:
-                    response_text = event["messages"][-1].content
-            self.response_queue.put(("ok", response_text))
+            with tracer.span("_generate", "worker", model=model):
+                retriever = self._open_index(docs) if docs else None
+                on_chunk = lambda chunk: self._post(("chunk", sid, chunk))
+                on_progress = lambda done, total: self._post(
+                    ("map_progress", sid, (done, total)))
+                engine = self._get_engine()
+                if prompt is None:
+                    result = engine.regenerate(thread_id, model,
+                                               on_chunk=on_chunk,
+                                               cancel=cancel,
+                                               retriever=retriever,
+                                               on_progress=on_progress)
+                else:
+                    result = engine.generate(prompt, thread_id, model,
+                                             on_chunk=on_chunk, cancel=cancel,
+                                             retriever=retriever,
+                                             attachments=attached,
+                                             on_progress=on_progress)
+            if result["stopped"]:
+                self._post(("stopped", sid, result["text"]))
+                return
+            text = result["text"]
+            if result["sources"]:
+                names = dict.fromkeys(os.path.basename(path)
+                                      for _, path in result["sources"])
+                text += "\n\n📎 Fuentes: " + ", ".join(names)
+            self._post(("ok", sid, text))
+            if result["ttft"] is not None:
+                self._post(("stats", sid, result))
         except Exception as e:
-            self.response_queue.put(("error", str(e)))
-
-    def _poll_queue(self):
+            self._post(("error", sid, str(e)))
+        finally:
+            if sid not in self.sessions:
+                # Deleted mid-reply: drop the checkpoints the run wrote
+                self.store.delete_thread(thread_id)
+
+    # ── UI dispatcher ───────────────────────────────
+    def _post(self, item):
+        """Queue `item` for the UI thread and wake the Tk loop if needed.
+
+        Called from worker threads. Only one wake-up event is in flight at a
+        time; the handler drains everything queued up to that point.
+        """
+        self.response_queue.put(item)
+        with self._wake_lock:
+            if self._wake_pending or not self.window_open:
+                return
+            self._wake_pending = True
+        try:
+            self.root.event_generate("<<ResponseReady>>", when="tail")
+        except (RuntimeError, tk.TclError):
+            # Main loop not running (yet, or anymore); the next post retries
+            with self._wake_lock:
+                self._wake_pending = False
+
+    def _drain_queue(self, _=None):
+        with self._wake_lock:
+            self._wake_pending = False
         if not self.window_open:
             return
-        try:
-            kind, content = self.response_queue.get_nowait()
+        while True:
+            try:
+                kind, sid, content = self.response_queue.get_nowait()
+            except queue.Empty:
+                break
+            if kind == "models":
+                self._on_models(content)
+                continue
+            if kind == "status":
+                self.status_var.set(content)
+                continue
+            if kind == "docs":
+                self._on_docs(content)
+                continue
+            if kind == "archive_progress":
+                verb, done, total = content
+                if total:
+                    self._progress.set(done / total)
+                self.status_var.set(f"📦  {verb}: {done}/{total or '?'} chats")
+                continue
+            if kind == "archive":
+                self._on_archive(*content)
+                continue
+            if kind.startswith("cmp_"):
+                if self._compare is not None:
+                    self._compare.on_event(kind[4:], sid, content)
+                continue
+            session = self._session_by_id(sid)
+            if session is None:
+                # Deleted while generating
+                continue
+            if kind == "chunk":
+                self._on_chunk(session, content)
+            elif kind == "map_progress":
+                self._on_map_progress(session, *content)
+            elif kind == "attached":
+                self._on_attached(session, *content)
+            elif kind == "title":
+                self._on_title(session, content)
+            elif kind == "summary":
+                self._on_summary(session, *content)
+            elif kind == "stats":
+                self._last_stats = content
+                if self._metrics_visible:
+                    self._refresh_metrics()
+                if self._is_active(session) and content["cached"]:
+                    self.status_var.set("⚡  Desde caché  ·  "
+                                        "↻ Regenerar para pedir otra")
+                elif self._is_active(session):
+                    self.status_var.set(
+                        f"⚡  Primer token: {content['ttft']:.2f} s  ·  "
+                        f"{content['tps']:.1f} tok/s  ·  "
+                        f"Contexto: ~{content['prompt_tokens']} tok"
+                        f" (~{content['prefix_tokens']} reutilizados)")
+            else:
+                self._on_done(session, kind, content)
+
+    def cancel(self, session):
+        """Stop the reply being generated for `session`, keeping its text."""
+        if session["_busy"] and session["_cancel"] is not None:
+            session["_cancel"].set()
+            if self._is_active(session):
+                self.status_var.set("⏹  Deteniendo…")
+
+    def _stop(self, _=None):
+        if self.active_id is not None:
+            self.cancel(self.sessions[self.active_id])
+
+    def _session_by_id(self, sid):
+        return self.sessions.get(sid)
+
+    def _is_active(self, session):
+        return session["id"] == self.active_id
+
+    def _set_busy(self, session, busy):
+        if busy != session["_busy"]:
+            # Background titles/summaries pause while any reply streams
+            (self.idle.hold if busy else self.idle.release)()
+        session["_busy"] = busy
+        self.session_scroll.refresh(session["id"])
+        if self._is_active(session):
+            self._lock_input(busy)
+
+    def _lock_input(self, locked):
+        # While busy, the send button turns into a stop button
+        if locked:
+            self.send_btn.configure(text="Detener\n■",
+                                     fg_color=C["btn_delete"],
+                                     hover_color=C["btn_delete_h"],
+                                     command=self._stop)
+            self.prompt_box.configure(state="disabled")
+            self.regen_btn.configure(state="disabled")
+            self.status_var.set("⏳  Generando respuesta…  (Esc para detener)")
+        else:
+            self.send_btn.configure(text="Enviar\n➤",
+                                     fg_color=C["btn_primary"],
+                                     hover_color=C["btn_hover"],
+                                     command=self._send)
+            self.prompt_box.configure(state="normal")
+            self.regen_btn.configure(state="normal")
+            self.status_var.set("")
 
-            if self.typing_indicator:
-                self.typing_indicator.stop()
-                self.typing_indicator.destroy()
-                self.typing_indicator = None
+    def _show_typing(self):
+        holder = ctk.CTkFrame(self.chat_view.canvas, fg_color="transparent")
+        self.typing_indicator = TypingIndicator(holder)
+        self.typing_indicator.pack(anchor="w", padx=14, pady=8)
+        self.typing_indicator.start()
+        self.chat_view.set_footer(holder)
 
-            session = self.sessions[self.active_idx]
-            ts = time.strftime("%H:%M")
+    def _hide_typing(self):
+        if self.typing_indicator:
+            self.typing_indicator.stop()
+            self.chat_view.set_footer(None)
+            self.typing_indicator = None
 
-            if kind == "error":
-                content = f"⚠️  **Error:**\n{content}"
+    def _on_chunk(self, session, chunk):
+        session["_stream"] = (session["_stream"] or "") + chunk
+        if not self._is_active(session):
+            return
+        if not self._streaming:
+            self._hide_typing()
+            self._streaming = True
+            self._append_bubble("ai", session["_stream"],
+                                time.strftime("%H:%M"), streaming=True)
+            self._scroll_bottom()
+            return
+        # Coalesce all chunks received within one frame into a single repaint
+        if self._flush_job is None:
+            self._flush_job = self.root.after(FRAME_MS, self._flush_stream)
+
+    @tracer.traced("_flush_stream", "ui")
+    def _flush_stream(self):
+        self._flush_job = None
+        if self._streaming:
+            session = self.sessions[self.active_id]
+            self.chat_view.update_stream(session["_stream"])
+            self._scroll_bottom()
 
-            session["history"].append(("ai", content, ts))
-            ChatBubble(self.chat_scroll, "ai", content, ts).pack(fill="x")
+    def _on_done(self, session, kind, content):
+        ts = time.strftime("%H:%M")
+        if kind == "error":
+            content = f"{session['_stream'] or ''}\n\n⚠️  **Error:**\n{content}".lstrip()
+
+        session["history"].append(("ai", content, ts))
+        self.store.add_message(session["id"], "ai", content, ts)
+        session["_stream"] = None
+
+        if self._is_active(session):
+            self._hide_typing()
+            if self._flush_job is not None:
+                self.root.after_cancel(self._flush_job)
+                self._flush_job = None
+            if self._streaming:
+                self.chat_view.finish_stream(content)
+                self._streaming = False
+            else:
+                self._append_bubble("ai", content, ts)
             self._scroll_bottom()
 
-            # Unlock input
-            self.send_btn.configure(state="normal",
-                                     fg_color=C["btn_primary"],
-                                     text_color=C["text"])
-            self.prompt_box.configure(state="normal")
-            self.status_var.set("")
+        session["_cancel"] = None
+        self._set_busy(session, False)
+        if self._is_active(session) and self._archive_cancel is None:
+            self._progress.grid_remove()
+        if kind == "ok":
+            self._queue_background(session)
+        if self._is_active(session):
+            if kind == "stopped":
+                self.status_var.set("⏹  Respuesta detenida")
             self.prompt_box.focus_set()
 
-        except queue.Empty:
-            pass
-        finally:
-            if self.window_open:
-                self.root.after(100, self._poll_queue)
-
+    @tracer.traced("_scroll_bottom", "ui")
     def _scroll_bottom(self):
-        self.chat_scroll.update_idletasks()
-        self.chat_scroll._parent_canvas.yview_moveto(1.0)
+        self.chat_view.scroll_bottom()
+
+    # ── Background titles and summaries ─────────────
+    def _queue_background(self, session):
+        """After a reply: title a new chat and extend its rolling summary.
+
+        Results are kept on the session (and in the store), so each piece
+        of work is done once.
+        """
+        from history import SUMMARIZE_HISTORY, SUMMARY_BATCH
+
+        sid, history = session["id"], session["history"]
+        model = IDLE_MODEL or self.model_var.get()
+        if not session["titled"]:
+            turns = history[:2]
+            self.idle.submit(("title", sid), lambda cancel: self._title_job(
+                sid, turns, model, cancel), TITLE)
+        upto = session["summary_upto"]
+        if len(history) - upto >= SUMMARY_BATCH:
+            previous, new = session["summary"], history[upto:]
+            self.idle.submit(("summary", sid),
+                             lambda cancel: self._summary_job(
+                                 sid, previous, new, len(history), model,
+                                 cancel))
+        if SUMMARIZE_HISTORY:
+            thread_id = session["thread_id"]
+            self.idle.submit(("trim", sid), lambda cancel: self._get_engine()
+                             .prepare_summary(thread_id, model, cancel))
+
+    def _discard_background(self, sid):
+        for kind in ("title", "summary", "trim"):
+            self.idle.discard((kind, sid))
+
+    @staticmethod
+    def _as_messages(rows):
+        from langchain_core.messages import AIMessage, HumanMessage
+        return [(HumanMessage if role == "user" else AIMessage)(content=text)
+                for role, text, _ in rows]
+
+    def _title_job(self, sid, turns, model, cancel):
+        """Idle worker: ask the model for a title for chat `sid`."""
+        from history import title_prompt
+        llm = self._get_engine().registry.get(model)
+        text = complete(llm, title_prompt(self._as_messages(turns)), cancel)
+        if text and clean_title(text):
+            self._post(("title", sid, clean_title(text)))
+
+    def _summary_job(self, sid, previous, rows, upto, model, cancel):
+        """Idle worker: fold `rows` into the rolling summary of chat `sid`."""
+        from history import summary_prompt
+        llm = self._get_engine().registry.get(model)
+        text = complete(llm, summary_prompt(previous, self._as_messages(rows)),
+                        cancel)
+        if text:
+            self._post(("summary", sid, (text, upto)))
+
+    def _on_title(self, session, title):
+        session["title"] = title
+        session["titled"] = True
+        self.store.rename_session(session["id"], title, titled=True)
+        self.session_scroll.refresh(session["id"])
+        if self._is_active(session):
+            self.title_var.set(title)
+
+    def _on_summary(self, session, summary, upto):
+        if upto <= session["summary_upto"]:
+            return
+        session["summary"], session["summary_upto"] = summary, upto
+        self.store.set_summary(session["id"], summary, upto)
+        self.session_scroll.refresh(session["id"])
+
+    # ── Metrics ──────────────────────────────────────
+    def _toggle_metrics(self, _=None):
+        if self._metrics_visible:
+            self._metrics_panel.place_forget()
+        else:
+            self._refresh_metrics()
+            self._metrics_panel.place(in_=self.chat_view, relx=1.0, x=-18,
+                                      y=12, anchor="ne")
+            self._metrics_panel.lift()
+        self._metrics_visible = not self._metrics_visible
+
+    def _refresh_metrics(self):
+        lines = ["ÚLTIMA RESPUESTA"]
+        stats = self._last_stats
+        if stats is None:
+            lines.append("  (sin datos todavía)")
+        else:
+            lines.append(f"  Primer token       {stats['ttft']:8.2f} s")
+            lines.append(f"  Velocidad          {stats['tps']:8.1f} tok/s")
+            lines.append(f"  Latencia total     {stats['latency']:8.2f} s")
+            lines.append(f"  Prefijo reutilizado{stats['prefix_tokens']:8d} tok"
+                         f"  (de ~{stats['prompt_tokens']})")
+            o = stats.get("ollama") or {}
+            if o:
+                # Ollama reports durations in nanoseconds
+                load, prompt_eval, gen = (o.get(k, 0) / 1e6 for k in (
+                    "load_duration", "prompt_eval_duration", "eval_duration"))
+                lines.append(f"  Carga del modelo   {load:8.0f} ms")
+                lines.append(f"  Evaluar prompt     {prompt_eval:8.0f} ms"
+                             f"  ({o.get('prompt_eval_count', 0)} tok)")
+                lines.append(f"  Generación         {gen:8.0f} ms"
+                             f"  ({o.get('eval_count', 0)} tok)")
+                if gen:
+                    rate = o.get("eval_count", 0) / (gen / 1000)
+                    lines.append(f"  Velocidad Ollama   {rate:8.1f} tok/s")
+        if self.cache is not None and self.cache_var.get():
+            c = self.cache.stats()
+            lines += ["", "CACHÉ DE RESPUESTAS",
+                      f"  Entradas           {c['entries']:8d}"
+                      f"  ({c['bytes'] / 1e6:.1f} MB)",
+                      f"  Aciertos           {c['hits']:8d}"
+                      f"  ({c['hit_rate']:.0%})",
+                      f"  Fallos             {c['misses']:8d}"]
+        summary = tracer.summary()
+        if summary:
+            lines += ["", f"{'SPANS':<24}{'n':>6}{'p50 ms':>9}{'máx ms':>9}"]
+            for name, s in sorted(summary.items(),
+                                  key=lambda kv: -kv[1]["total_ms"]):
+                lines.append(f"  {name[:22]:<22}{s['count']:>6}"
+                             f"{s['p50_ms']:>9.1f}{s['max_ms']:>9.1f}")
+        self._metrics_lbl.configure(text="\n".join(lines))
+
+    def _clear_metrics(self):
+        tracer.clear()
+        self._last_stats = None
+        self._refresh_metrics()
+
+    def _export_trace(self):
+        path = filedialog.asksaveasfilename(
+            defaultextension=".json",
+            filetypes=[("Chrome trace", "*.json")],
+            initialfile="ollama_chat_trace.json"
+        )
+        if path:
+            try:
+                n = tracer.export_chrome(path)
+                messagebox.showinfo("✅  Exportado",
+                                    f"{n} spans guardados en:\n{path}\n\n"
+                                    "Ábrelo en chrome://tracing o ui.perfetto.dev")
+            except OSError as e:
+                messagebox.showerror("Error", str(e))
+
+    # ── Compare mode ─────────────────────────────────
+    def _open_compare(self):
+        if not self.models:
+            messagebox.showinfo("Info", "Todavía no hay modelos disponibles.")
+            return
+        if self._compare is not None:
+            self._compare.lift()
+            self._compare.focus_force()
+            return
+        self._compare = CompareWindow(self)
+
+    def _start_compare(self, run, prompt, models, prefix, cancel):
+        """Worker side of a comparison: queue one generation per model."""
+        try:
+            runner = self._get_compare_runner()
+        except Exception as e:
+            for model in models:
+                self._post(("cmp_error", (run, model), str(e)))
+            return
+        runner.run(prompt, models, prefix, cancel=cancel,
+                   on_event=lambda kind, model, payload: self._post(
+                       (f"cmp_{kind}", (run, model), payload)))
+
+    def _get_compare_runner(self):
+        engine = self._get_engine()
+        with self._engine_lock:
+            if self._compare_runner is None:
+                from langgraph.checkpoint.memory import MemorySaver
+
+                from compare import CompareRunner
+                from engine import ChatEngine
+                # Comparison threads are scratch work: kept in memory only,
+                # sharing the chat engine's model clients
+                self._compare_runner = CompareRunner(
+                    ChatEngine(MemorySaver(), engine.registry))
+            return self._compare_runner
+
+    # ── Documents (RAG) ──────────────────────────────
+    def _docs_path(self, session_id):
+        return os.path.join(self._rag_dir, f"session_{session_id}")
+
+    def _open_index(self, path):
+        """Document index at `path`, opened once; called from worker threads."""
+        with self._engine_lock:
+            index = self._indexes.get(path)
+            if index is None:
+                from rag import DocumentIndex
+                index = self._indexes[path] = DocumentIndex(path)
+            return index
+
+    def _attach_docs(self):
+        session = self.sessions[self.active_id]
+        folder = filedialog.askdirectory(
+            title="Carpeta de documentos para este chat")
+        if not folder:
+            return
+        cancel = self._ingest_cancel.setdefault(session["id"],
+                                                threading.Event())
+        self.status_var.set("📚  Indexando documentos…")
+        self._ingest_pool.submit(self._ingest, session["id"], folder, cancel)
+
+    def _ingest(self, sid, folder, cancel):
+        """Index `folder` for chat `sid` in the background."""
+        last = 0.0
+
+        def progress(stats):
+            nonlocal last
+            # Status updates at most ~5 per second
+            if time.monotonic() - last > 0.2:
+                last = time.monotonic()
+                self._post(("status", None,
+                            f"📚  Indexando: {stats['files']} archivos · "
+                            f"{stats['chunks']} fragmentos nuevos"))
+        try:
+            index = self._open_index(self._docs_path(sid))
+            stats = index.ingest([folder], progress=progress, cancel=cancel)
+            stats["total"] = len(index)
+        except Exception as e:
+            stats = {"errors": 1, "last_error": str(e), "total": 0,
+                     "files": 0}
+        if not cancel.is_set():
+            self._post(("docs", sid, stats))
+
+    def _on_docs(self, stats):
+        if stats["errors"] and not stats["total"]:
+            self.status_var.set(
+                f"⚠️  No se pudo indexar: {stats['last_error']}  "
+                "(¿ollama pull nomic-embed-text?)")
+            return
+        msg = (f"📚  {stats['total']} fragmentos de {stats['files']} "
+               "archivos listos para este chat")
+        if stats["errors"]:
+            msg += f" · {stats['errors']} con errores"
+        self.status_var.set(msg)
+
+    def _drop_docs(self, session_id):
+        """Stop indexing and delete the document index of a deleted chat."""
+        cancel = self._ingest_cancel.pop(session_id, None)
+        if cancel is not None:
+            cancel.set()
+        path = self._docs_path(session_id)
+
+        def remove():
+            with self._engine_lock:
+                index = self._indexes.pop(path, None)
+            if index is not None:
+                index.close()
+            shutil.rmtree(path, ignore_errors=True)
+        # Queued behind any ingestion still writing to the directory
+        self._ingest_pool.submit(remove)
+
+    # ── Attachments (map-reduce) ─────────────────────
+    def _attach_files(self):
+        session = self.sessions[self.active_id]
+        paths = filedialog.askopenfilenames(
+            title="Archivos para el próximo mensaje")
+        for path in paths:
+            self._ingest_pool.submit(self._scan_attachment, session["id"],
+                                     path)
+        if paths:
+            self.status_var.set("📄  Leyendo adjuntos…")
+
+    def _on_paste(self, _=None):
+        """Attach very long pastes as a file instead of inserting them."""
+        from attachments import PASTE_CHARS
+        try:
+            text = self.root.clipboard_get()
+        except tk.TclError:
+            return None
+        if len(text) < PASTE_CHARS or self.active_id is None:
+            return None
+        self._ingest_pool.submit(self._save_paste, self.active_id, text)
+        self.status_var.set("📄  Texto largo: se adjuntará como archivo")
+        return "break"
+
+    def _save_paste(self, sid, text):
+        os.makedirs(self._paste_dir, exist_ok=True)
+        path = os.path.join(self._paste_dir,
+                            f"paste_{sid}_{time.strftime('%Y%m%d_%H%M%S')}.txt")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(text)
+        self._scan_attachment(sid, path)
+
+    def _scan_attachment(self, sid, path):
+        """Chunk `path` in the background; the engine reuses the scan."""
+        from attachments import scan
+        try:
+            chunks = scan(path)
+        except (OSError, ValueError) as e:
+            self._post(("status", None, f"⚠️  No se pudo adjuntar: {e}"))
+            return
+        self._post(("attached", sid, (path, len(chunks))))
+
+    def _on_attached(self, session, path, chunks):
+        if path not in session["_attach"]:
+            session["_attach"].append(path)
+        if self._is_active(session):
+            self._show_attachments(session)
+            self.status_var.set(f"📄  {os.path.basename(path)}: {chunks} "
+                                "partes · se enviará con tu próximo mensaje")
+
+    def _show_attachments(self, session):
+        names = [os.path.basename(p) for p in session["_attach"]]
+        if not names:
+            self._attach_chip.grid_remove()
+            return
+        self._attach_chip.configure(text="📄 " + ", ".join(names) + "  ✕")
+        self._attach_chip.grid(row=2, column=0, sticky="e", padx=(0, 8),
+                               pady=(0, 8))
+
+    def _clear_attachments(self):
+        session = self.sessions[self.active_id]
+        session["_attach"] = []
+        self._show_attachments(session)
+
+    def _on_map_progress(self, session, done, total):
+        if not self._is_active(session) or not total:
+            return
+        if self._archive_cancel is None:
+            self._progress.set(done / total)
+            self._progress.grid(row=3, column=0, columnspan=2, sticky="ew",
+                                padx=18, pady=(0, 8))
+        if done < total:
+            self.status_var.set(f"📄  Leyendo adjuntos: {done}/{total} partes")
+        else:
+            self.status_var.set("📄  Combinando notas de los adjuntos…")
+
+    def _drop_pastes(self, session_id):
+        """Delete the files saved from long pastes into a deleted chat."""
+        prefix = f"paste_{session_id}_"
+
+        def remove():
+            if os.path.isdir(self._paste_dir):
+                for name in os.listdir(self._paste_dir):
+                    if name.startswith(prefix):
+                        os.remove(os.path.join(self._paste_dir, name))
+        self._ingest_pool.submit(remove)
+
+    # ── Search ───────────────────────────────────────
+    def _on_search_key(self, event=None):
+        # Search once typing pauses, not on every keystroke
+        if self._search_job is not None:
+            self.root.after_cancel(self._search_job)
+        self._search_job = self.root.after(120, self._run_search)
+
+    def _run_search(self):
+        self._search_job = None
+        for w in self._search_results:
+            w.destroy()
+        self._search_results = []
+        query = self.search_entry.get().strip()
+        if not query:
+            self.search_scroll.grid_remove()
+            self._search_info.grid_remove()
+            self.session_scroll.grid(row=3, column=0, sticky="nsew",
+                                     padx=6, pady=(0, 6))
+            return
+
+        t0 = time.perf_counter()
+        rows = self.store.search(query)
+        ms = (time.perf_counter() - t0) * 1000
+        for row, (mid, sid, title, role, ts, snippet) in enumerate(rows):
+            item = SearchResult(
+                self.search_scroll, title, role, ts, snippet,
+                on_click=lambda s=sid, m=mid: self._open_result(s, m))
+            item.grid(row=row, column=0, sticky="ew", pady=2)
+            self._search_results.append(item)
+        count = (f"{len(rows)}+ resultados" if len(rows) >= SEARCH_LIMIT
+                 else f"{len(rows)} resultado{'s' if len(rows) != 1 else ''}")
+        self._search_info.configure(
+            text=f"{count} · {ms:.0f} ms" if rows else "Sin resultados")
+        self._search_info.grid(row=1, column=0, sticky="w", pady=(4, 0))
+        self.session_scroll.grid_remove()
+        self.search_scroll.grid(row=3, column=0, sticky="nsew",
+                                padx=6, pady=(0, 6))
+
+    def _clear_search(self, _=None):
+        self.search_entry.delete(0, "end")
+        self._run_search()
+        return "break"
+
+    def _open_result(self, session_id, message_id):
+        if session_id not in self.sessions:
+            # Deleted since the search ran
+            self._run_search()
+            return
+        if session_id != self.active_id:
+            self._switch_session(session_id)
+        self.chat_view.scroll_to(self.store.message_index(session_id,
+                                                          message_id))
 
     # ── Actions ──────────────────────────────────────
     def _export_chat(self):
-        session = self.sessions[self.active_idx]
+        session = self.sessions[self.active_id]
         if not session["history"]:
             messagebox.showinfo("Info", "No hay mensajes para exportar.")
             return
@@ -729,28 +2491,150 @@ class OllamaInterface:
         if path:
             try:
                 with open(path, "w", encoding="utf-8") as f:
-                    f.write(f"# {session['title']}\n\n")
-                    for role, text, ts in session["history"]:
-                        label = "**Tú**" if role == "user" else "**Ollama**"
-                        f.write(f"### {label} · {ts}\n{text}\n\n---\n\n")
+                    write_markdown(f, session["title"], session["history"])
                 messagebox.showinfo("✅  Exportado", f"Guardado en:\n{path}")
             except Exception as e:
                 messagebox.showerror("Error", str(e))
 
+    # ── Archive (all chats) ─────────────────────────
+    def _archive_menu(self):
+        menu = tk.Menu(self.root, tearoff=0, bg=C["card"], fg=C["text"],
+                       activebackground=C["border"],
+                       activeforeground=C["text"], bd=0)
+        if self._archive_cancel is not None:
+            menu.add_command(label="⏹  Cancelar",
+                             command=self._archive_cancel.set)
+        else:
+            menu.add_command(label="Exportar todos los chats (.jsonl.gz)",
+                             command=lambda: self._start_archive("export"))
+            menu.add_command(label="Exportar todos como Markdown (.zip)",
+                             command=lambda: self._start_archive("markdown"))
+            menu.add_separator()
+            menu.add_command(label="Importar chats…",
+                             command=lambda: self._start_archive("import"))
+        btn = self._archive_btn
+        menu.tk_popup(btn.winfo_rootx(), btn.winfo_rooty() + btn.winfo_height())
+
+    def _start_archive(self, action):
+        stamp = time.strftime("%Y%m%d")
+        if action == "import":
+            path = filedialog.askopenfilename(
+                filetypes=[("Chats exportados", "*.jsonl.gz"),
+                           ("Todos", "*.*")])
+        elif action == "markdown":
+            path = filedialog.asksaveasfilename(
+                defaultextension=".zip", filetypes=[("Zip", "*.zip")],
+                initialfile=f"chats_{stamp}.zip")
+        else:
+            path = filedialog.asksaveasfilename(
+                defaultextension=".gz",
+                filetypes=[("Chats exportados", "*.jsonl.gz")],
+                initialfile=f"chats_{stamp}.jsonl.gz")
+        if not path:
+            return
+        self._archive_cancel = threading.Event()
+        self._progress.set(0)
+        self._progress.grid(row=3, column=0, columnspan=2, sticky="ew",
+                            padx=18, pady=(0, 8))
+        self.status_var.set("📦  Preparando archivo…")
+        # Queued on the background pool so it never takes a generation slot
+        self._ingest_pool.submit(self._run_archive, action, path,
+                                 self._archive_cancel)
+
+    def _run_archive(self, action, path, cancel):
+        """Export or import every chat in the background."""
+        last = 0.0
+        verb = "Importando" if action == "import" else "Exportando"
+
+        def progress(done, total):
+            nonlocal last
+            if time.monotonic() - last > 0.2:
+                last = time.monotonic()
+                self._post(("archive_progress", None, (verb, done, total)))
+        try:
+            if action == "import":
+                stats = import_jsonl(self.store, path, self._next_session_id,
+                                     progress, cancel)
+            else:
+                # Messages still in the write queue belong in the archive
+                self.store.flush()
+                export = export_markdown if action == "markdown" \
+                    else export_jsonl
+                stats = export(self.store, path, progress, cancel)
+        except Exception as e:
+            stats = {"error": str(e)}
+        self._post(("archive", None, (action, path, stats)))
+
+    def _on_archive(self, action, path, stats):
+        self._archive_cancel = None
+        self._progress.grid_remove()
+        if "error" in stats:
+            self.status_var.set("")
+            messagebox.showerror("Error", stats["error"])
+            return
+        if action == "import":
+            for row in stats["new"]:
+                self.sessions[row[0]] = self._make_session(row)
+            for sid in stats["updated"]:
+                session = self.sessions.get(sid)
+                if session is not None and not session["_busy"]:
+                    # Reloaded from the store next time it is opened
+                    session["history"] = None
+            self.session_scroll.reload()
+            if self.active_id in stats["updated"] \
+                    and not self.sessions[self.active_id]["_busy"]:
+                self._switch_session(self.active_id)
+            msg = (f"📦  {len(stats['new'])} chats nuevos · "
+                   f"{stats['messages']} mensajes importados")
+        else:
+            msg = (f"📦  {stats['sessions']} chats · {stats['messages']} "
+                   f"mensajes exportados a {os.path.basename(path)}")
+        if stats["cancelled"]:
+            msg += "  (cancelado)"
+        self.status_var.set(msg)
+
     def _clear_chat(self):
-        session = self.sessions[self.active_idx]
-        if not session["history"]:
+        session = self.sessions[self.active_id]
+        if not session["history"] or session["_busy"]:
             return
         if messagebox.askyesno("Confirmar", "¿Borrar el historial de este chat?"):
+            old_thread = session["thread_id"]
             session["history"].clear()
+            self._discard_background(session["id"])
+            session.update(titled=False, summary="", summary_upto=0)
             session["title"] = f"Chat {session['id']}"
             session["thread_id"] = f"thread_{time.time()}_{session['id']}"
-            session["_widget"].lbl.configure(text=session["title"])
+            self.store.clear_session(session["id"], old_thread,
+                                     session["thread_id"])
+            self.store.rename_session(session["id"], session["title"])
+            self.session_scroll.refresh(session["id"])
             self.title_var.set(session["title"])
             self._rebuild_chat(session)
 
     def on_close(self):
         self.window_open = False
+        # Stop everything first: cancelled replies end within CANCEL_POLL
+        for session in self.sessions.values():
+            if session["_busy"] and session["_cancel"] is not None:
+                session["_cancel"].set()
+        for cancel in self._ingest_cancel.values():
+            cancel.set()
+        if self._archive_cancel is not None:
+            self._archive_cancel.set()
+        if self._compare is not None:
+            self._compare._stop()
+        self.idle.shutdown()
+        if self._compare_runner is not None:
+            self._compare_runner.shutdown()
+        # Workers still commit their last checkpoint, cache entry or
+        # export batch; let them before the connections close
+        self.pool.shutdown(wait=True, cancel_futures=True)
+        self._ingest_pool.shutdown(wait=True, cancel_futures=True)
+        if self.cache is not None:
+            self.cache.close()
+        if self.engine is not None:
+            self.engine.notes.close()
+        self.store.close()
         self.root.destroy()
 
 
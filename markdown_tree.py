@@ -0,0 +1,141 @@
+"""Markdown → render tree for chat bubbles.
+
+Supports the small subset the chat UI draws: fenced code blocks, headings,
+bullet/numbered lists, **bold** and `inline code`. The tree is made of
+immutable tuples, so parsed messages can be cached and shared freely.
+"""
+import re
+from functools import lru_cache
+from typing import NamedTuple
+
+FENCE_RE = re.compile(r"```([\s\S]*?)```")
+LANG_RE = re.compile(r"^[a-zA-Z0-9+#-]+$")
+INLINE_RE = re.compile(r"\*\*(.+?)\*\*|`([^`]+)`")
+HEADING_RE = re.compile(r"^(#{1,6})\s+(.*)$")
+LIST_RE = re.compile(r"^([-*+]|\d+[.)])\s+(.*)$")
+
+
+class Span(NamedTuple):
+    style: str          # "text" | "bold" | "code"
+    text: str
+
+
+class Block(NamedTuple):
+    kind: str           # "para" | "heading" | "list" | "code" | "blank"
+    spans: tuple = ()
+    code: str = ""
+    lang: str = ""
+    level: int = 0      # heading level
+    marker: str = ""    # list bullet or number
+
+
+def parse_inline(line: str) -> tuple:
+    spans = []
+    pos = 0
+    for m in INLINE_RE.finditer(line):
+        if m.start() > pos:
+            spans.append(Span("text", line[pos:m.start()]))
+        if m.group(1) is not None:
+            spans.append(Span("bold", m.group(1)))
+        else:
+            spans.append(Span("code", m.group(2)))
+        pos = m.end()
+    if pos < len(line):
+        spans.append(Span("text", line[pos:]))
+    return tuple(spans)
+
+
+def _line_block(line: str) -> Block:
+    line = line.strip()
+    if not line:
+        return Block("blank")
+    m = HEADING_RE.match(line)
+    if m:
+        return Block("heading", parse_inline(m.group(2)), level=len(m.group(1)))
+    m = LIST_RE.match(line)
+    if m:
+        marker = m.group(1)
+        if marker in "-*+":
+            marker = "•"
+        return Block("list", parse_inline(m.group(2)), marker=marker)
+    return Block("para", parse_inline(line))
+
+
+def _code_block(body: str) -> Block:
+    raw = body.strip()
+    lang = ""
+    # Strip language hint
+    if "\n" in raw:
+        first, rest = raw.split("\n", 1)
+        if LANG_RE.match(first.strip()):
+            lang, raw = first.strip(), rest
+    return Block("code", code=raw, lang=lang)
+
+
+def _scan(text: str, final: bool):
+    """Yield (block, end_offset, closed) for every block in `text`.
+
+    A block is closed when no text appended later can change it: a line
+    with its newline already received, or a fence with its closing ```.
+    """
+    pos = 0
+    for m in FENCE_RE.finditer(text):
+        yield from _scan_lines(text, pos, m.start(), closed_tail=True)
+        yield _code_block(m.group(1)), m.end(), True
+        pos = m.end()
+
+    start = text.find("```", pos)
+    if start == -1:
+        yield from _scan_lines(text, pos, len(text), closed_tail=final)
+    else:
+        yield from _scan_lines(text, pos, start, closed_tail=True)
+        yield _code_block(text[start + 3:]), len(text), final
+
+
+def _scan_lines(text, start, end, closed_tail):
+    if start >= end:
+        return
+    while True:
+        nl = text.find("\n", start, end)
+        if nl == -1:
+            yield _line_block(text[start:end]), end, closed_tail
+            return
+        yield _line_block(text[start:nl]), nl + 1, True
+        start = nl + 1
+        if start == end:
+            return
+
+
+@lru_cache(maxsize=4096)
+def parse(text: str) -> tuple:
+    """Parse a complete message. Results are cached by content."""
+    return tuple(block for block, _, _ in _scan(text, final=True))
+
+
+class IncrementalParser:
+    """Parser for a message that is still being streamed.
+
+    Closed blocks are kept and never parsed again; each `feed` only scans
+    the text after the last closed block.
+    """
+
+    def __init__(self):
+        self._closed: list = []
+        self._end = 0
+
+    @property
+    def closed(self) -> int:
+        """Number of leading blocks that will not change anymore."""
+        return len(self._closed)
+
+    def feed(self, text: str, final: bool = False) -> tuple:
+        """Parse the full text received so far (a continuation of the last)."""
+        base = self._end
+        open_blocks = []
+        for block, end, closed in _scan(text[base:], final):
+            if closed and not open_blocks:
+                self._closed.append(block)
+                self._end = base + end
+            else:
+                open_blocks.append(block)
+        return tuple(self._closed) + tuple(open_blocks)
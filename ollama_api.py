@@ -0,0 +1,64 @@
+"""Small helpers for Ollama's HTTP API.
+
+Kept free of the LangChain/LangGraph stack so the GUI can talk to Ollama
+(model discovery, preloading) before that stack has been imported.
+"""
+import os
+import threading
+
+import requests
+
+OLLAMA_URL = os.environ.get("OLLAMA_URL", "http://localhost:11434")
+# How long Ollama keeps a model (and its prompt cache) loaded after use
+KEEP_ALIVE = os.environ.get("OLLAMA_KEEP_ALIVE", "30m")
+# Concurrent generations; match the server's OLLAMA_NUM_PARALLEL
+MAX_PARALLEL = int(os.environ.get("OLLAMA_NUM_PARALLEL", "4"))
+
+# Shared keep-alive connection pool for the light API calls
+http = requests.Session()
+
+
+def fetch_models(base_url: str = OLLAMA_URL, timeout: float = 5) -> list:
+    """Names of the installed models. Raises requests.RequestException."""
+    r = http.get(f"{base_url}/api/tags", timeout=timeout)
+    r.raise_for_status()
+    return [m["name"] for m in r.json().get("models", [])]
+
+
+def loaded_models(base_url: str = OLLAMA_URL, timeout: float = 5) -> list:
+    """Names of the models currently in memory (/api/ps).
+
+    Raises requests.RequestException.
+    """
+    r = http.get(f"{base_url}/api/ps", timeout=timeout)
+    r.raise_for_status()
+    return [m["name"] for m in r.json().get("models", [])]
+
+
+def embed(texts: list, model: str, base_url: str = OLLAMA_URL,
+          timeout: float = 120) -> list:
+    """Embedding vectors for `texts` (one request for the whole batch).
+
+    Raises requests.RequestException.
+    """
+    r = http.post(f"{base_url}/api/embed",
+                  json={"model": model, "input": texts,
+                        "keep_alive": KEEP_ALIVE},
+                  timeout=timeout)
+    r.raise_for_status()
+    return r.json()["embeddings"]
+
+
+def preload(model: str, base_url: str = OLLAMA_URL):
+    """Ask Ollama to load `model` into memory (empty generate request)."""
+    try:
+        http.post(f"{base_url}/api/generate",
+                  json={"model": model, "keep_alive": KEEP_ALIVE},
+                  timeout=120)
+    except requests.RequestException:
+        pass
+
+
+def preload_async(model: str, base_url: str = OLLAMA_URL):
+    threading.Thread(target=preload, args=(model, base_url),
+                     daemon=True).start()
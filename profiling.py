@@ -0,0 +1,94 @@
+"""Lightweight span tracing for the hot paths.
+
+Spans are kept in a bounded in-memory ring buffer and can be exported in
+the Chrome trace event format (open the file in chrome://tracing or
+https://ui.perfetto.dev). Recording a span costs two `perf_counter` calls
+and a deque append, so tracing stays on all the time.
+"""
+import functools
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+MAX_SPANS = 50_000
+
+
+class Tracer:
+    def __init__(self, max_spans=MAX_SPANS):
+        self.enabled = True
+        self._spans: deque = deque(maxlen=max_spans)
+        self._origin = time.perf_counter()
+
+    @contextmanager
+    def span(self, name, cat="app", **args):
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, start, time.perf_counter() - start, cat, args)
+
+    def add(self, name, start, duration, cat="app", args=None):
+        """Record a span that started at `start` (a perf_counter value)."""
+        if self.enabled:
+            self._spans.append((name, cat, start, duration,
+                                threading.get_ident(), args or None))
+
+    def traced(self, name=None, cat="app"):
+        """Decorator form of `span`."""
+        def wrap(fn):
+            label = name or fn.__qualname__
+
+            @functools.wraps(fn)
+            def inner(*a, **kw):
+                with self.span(label, cat):
+                    return fn(*a, **kw)
+            return inner
+        return wrap
+
+    def wrap_methods(self, obj, names, cat):
+        """Trace the given bound methods of `obj` in place."""
+        for attr in names:
+            method = getattr(obj, attr)
+            label = f"{type(obj).__name__}.{attr}"
+            setattr(obj, attr, self.traced(label, cat)(method))
+
+    def clear(self):
+        self._spans.clear()
+
+    def summary(self) -> dict:
+        """{name: {"count", "total_ms", "p50_ms", "max_ms"}} over all spans."""
+        by_name: dict = {}
+        for name, _, _, dur, _, _ in list(self._spans):
+            by_name.setdefault(name, []).append(dur)
+        out = {}
+        for name, durs in by_name.items():
+            durs.sort()
+            out[name] = {"count": len(durs),
+                         "total_ms": sum(durs) * 1000,
+                         "p50_ms": durs[len(durs) // 2] * 1000,
+                         "max_ms": durs[-1] * 1000}
+        return out
+
+    def export_chrome(self, path):
+        """Write every recorded span as Chrome trace "complete" events."""
+        pid = os.getpid()
+        events = []
+        for name, cat, start, dur, tid, args in list(self._spans):
+            event = {"name": name, "cat": cat, "ph": "X", "pid": pid,
+                     "tid": tid, "ts": (start - self._origin) * 1e6,
+                     "dur": dur * 1e6}
+            if args:
+                event["args"] = args
+            events.append(event)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+        return len(events)
+
+
+tracer = Tracer()
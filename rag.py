@@ -0,0 +1,326 @@
+"""Local document retrieval: chunking, Ollama embeddings and a vector index.
+
+Each index is a directory holding a memory-mapped float32 matrix of
+normalized chunk embeddings (`vectors.f32`, append-only) plus a small
+SQLite file with the chunk texts and the files they came from. Search is
+a blocked matrix product over the memmap, so the index never has to fit
+in memory. Re-ingesting a folder only embeds files whose content changed;
+chunks of changed or removed files are masked out rather than rewritten.
+"""
+import hashlib
+import os
+import sqlite3
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import numpy as np
+import requests
+
+from ollama_api import embed
+
+EMBED_MODEL = os.environ.get("OLLAMA_EMBED_MODEL", "nomic-embed-text")
+CHUNK_CHARS = 1200          # target chunk size
+CHUNK_OVERLAP = 200         # characters repeated between split chunks
+EMBED_BATCH = 32            # chunks per /api/embed request
+INGEST_WORKERS = 2
+TOP_K = 4
+MIN_SCORE = 0.3             # cosine similarity below this is not "relevant"
+SEARCH_BLOCK = 65536        # rows scored per matrix product
+MAX_FILE_BYTES = 5_000_000
+TEXT_EXTENSIONS = {".txt", ".md", ".rst", ".py", ".js", ".ts", ".java",
+                   ".c", ".h", ".cpp", ".cs", ".go", ".rs", ".rb", ".php",
+                   ".sh", ".sql", ".json", ".yaml", ".yml", ".toml", ".ini",
+                   ".csv", ".html", ".htm", ".xml", ".tex"}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS files (
+    path    TEXT PRIMARY KEY,
+    sha1    TEXT NOT NULL,
+    mtime   REAL NOT NULL,
+    size    INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS chunks (
+    row     INTEGER PRIMARY KEY,    -- row in vectors.f32
+    path    TEXT NOT NULL,
+    seq     INTEGER NOT NULL,
+    text    TEXT NOT NULL,
+    alive   INTEGER NOT NULL DEFAULT 1
+);
+CREATE INDEX IF NOT EXISTS idx_chunks_path ON chunks(path);
+"""
+
+
+# ── Chunking ─────────────────────────────────────────
+def chunk_text(text: str, size: int = CHUNK_CHARS,
+               overlap: int = CHUNK_OVERLAP) -> list:
+    """Split on blank lines, packing paragraphs into chunks of ~`size`."""
+    chunks, current = [], ""
+    for para in text.split("\n\n"):
+        para = para.strip()
+        if not para:
+            continue
+        if current and len(current) + len(para) + 2 > size:
+            chunks.append(current)
+            current = ""
+        while len(para) > size:
+            # A single oversized paragraph: hard split with some overlap
+            chunks.append(para[:size])
+            para = para[size - overlap:]
+        current = f"{current}\n\n{para}" if current else para
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def iter_files(paths):
+    """Yield indexable files under `paths` (files or folders), lazily."""
+    for path in paths:
+        if os.path.isfile(path):
+            yield os.path.abspath(path)
+            continue
+        for folder, dirs, files in os.walk(path):
+            dirs[:] = [d for d in dirs if not d.startswith(".")]
+            for name in files:
+                if os.path.splitext(name)[1].lower() in TEXT_EXTENSIONS:
+                    yield os.path.abspath(os.path.join(folder, name))
+
+
+def _normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+# ── Index ────────────────────────────────────────────
+class DocumentIndex:
+    def __init__(self, path: str, model: str = EMBED_MODEL):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.model = model
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(os.path.join(path, "meta.db"),
+                                   check_same_thread=False)
+        self._db.executescript(SCHEMA)
+        row = self._db.execute(
+            "SELECT value FROM meta WHERE key = 'dim'").fetchone()
+        self.dim = int(row[0]) if row else None
+
+        self._vec_path = os.path.join(path, "vectors.f32")
+        alive = [a for (a,) in self._db.execute(
+            "SELECT alive FROM chunks ORDER BY row")]
+        self._alive = np.array(alive, dtype=bool)
+        self._rows = len(alive)
+        if self.dim is not None:
+            # Drop vectors written by a run that died before committing
+            with open(self._vec_path, "ab") as f:
+                f.truncate(self._rows * self.dim * 4)
+        self._mm = None
+        self._mm_rows = 0
+
+    def __len__(self):
+        """Number of live chunks."""
+        return int(self._alive.sum())
+
+    def close(self):
+        with self._lock:
+            self._mm = None
+            self._db.close()
+
+    # ── Ingestion ───────────────────────────────────
+    def ingest(self, paths, workers: int = INGEST_WORKERS, progress=None,
+               cancel: threading.Event | None = None) -> dict:
+        """Index every text file under `paths`; returns counters.
+
+        Files are discovered lazily and processed by a small pool, a bounded
+        number at a time. `progress(stats)` is called after every file.
+        """
+        stats = {"files": 0, "indexed": 0, "skipped": 0, "errors": 0,
+                 "chunks": 0, "last_error": None}
+        seen = set()
+
+        def collect(done):
+            for fut in done:
+                try:
+                    n = fut.result()
+                except (OSError, ValueError, requests.RequestException) as e:
+                    stats["errors"] += 1
+                    stats["last_error"] = str(e)
+                else:
+                    stats["chunks"] += n
+                    stats["indexed" if n else "skipped"] += 1
+                stats["files"] += 1
+                if progress is not None:
+                    progress(dict(stats))
+
+        in_flight = set()
+        with ThreadPoolExecutor(max_workers=workers,
+                                thread_name_prefix="ingest") as pool:
+            for file in iter_files(paths):
+                if cancel is not None and cancel.is_set():
+                    break
+                seen.add(file)
+                if len(in_flight) >= workers * 2:
+                    done, in_flight = wait(in_flight,
+                                           return_when=FIRST_COMPLETED)
+                    collect(done)
+                in_flight.add(pool.submit(self._ingest_file, file))
+            collect(wait(in_flight).done)
+        if cancel is None or not cancel.is_set():
+            self._forget_missing(paths, seen)
+        return stats
+
+    def _ingest_file(self, path) -> int:
+        """Embed and store one file. Returns its chunk count, 0 if unchanged."""
+        st = os.stat(path)
+        if st.st_size > MAX_FILE_BYTES:
+            return 0
+        known = self._db_read("SELECT sha1, mtime, size FROM files "
+                              "WHERE path = ?", (path,))
+        if known and known[0][1:] == (st.st_mtime, st.st_size):
+            return 0
+        with open(path, "rb") as f:
+            data = f.read()
+        sha1 = hashlib.sha1(data).hexdigest()
+        if known and known[0][0] == sha1:
+            # Touched but not changed: just remember the new mtime
+            self._db_write("UPDATE files SET mtime = ? WHERE path = ?",
+                           (st.st_mtime, path))
+            return 0
+
+        chunks = chunk_text(data.decode("utf-8", errors="replace"))
+        vectors = [vec for i in range(0, len(chunks), EMBED_BATCH)
+                   for vec in embed(chunks[i:i + EMBED_BATCH], self.model)]
+        self._store(path, sha1, st, chunks, vectors)
+        return len(chunks)
+
+    def _store(self, path, sha1, st, chunks, vectors):
+        vectors = _normalize(vectors) if chunks else None
+        with self._lock:
+            if vectors is not None and self.dim is None:
+                self.dim = vectors.shape[1]
+                self._db.execute("INSERT INTO meta VALUES ('dim', ?)",
+                                 (str(self.dim),))
+            if vectors is not None and vectors.shape[1] != self.dim:
+                raise ValueError(f"embedding size changed ({vectors.shape[1]} "
+                                 f"vs {self.dim}); rebuild the index")
+            dead = self._mark_dead(path)
+            start = self._rows
+            if vectors is not None:
+                with open(self._vec_path, "ab") as f:
+                    f.write(vectors.tobytes())
+            with self._db:
+                self._db.executemany(
+                    "INSERT INTO chunks (row, path, seq, text) "
+                    "VALUES (?, ?, ?, ?)",
+                    [(start + i, path, i, c) for i, c in enumerate(chunks)])
+                self._db.execute(
+                    "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)",
+                    (path, sha1, st.st_mtime, st.st_size))
+            alive = self._alive.copy()
+            alive[dead] = False
+            self._alive = np.concatenate([alive,
+                                          np.ones(len(chunks), dtype=bool)])
+            self._rows = start + len(chunks)
+
+    def _mark_dead(self, path):
+        """Retire the chunks of an older version of `path` (lock held)."""
+        rows = [r for (r,) in self._db.execute(
+            "SELECT row FROM chunks WHERE path = ? AND alive = 1", (path,))]
+        if rows:
+            self._db.execute("UPDATE chunks SET alive = 0 WHERE path = ?",
+                             (path,))
+        return np.array(rows, dtype=np.int64)
+
+    def _forget_missing(self, roots, seen):
+        """Mask chunks of files under `roots` that no longer exist."""
+        exact = {os.path.abspath(r) for r in roots}
+        # A trailing separator so /x/docs doesn't also match /x/docs2
+        prefixes = tuple(r.rstrip(os.sep) + os.sep for r in exact)
+        with self._lock:
+            gone = [p for (p,) in self._db.execute("SELECT path FROM files")
+                    if (p in exact or p.startswith(prefixes))
+                    and p not in seen]
+            if not gone:
+                return
+            alive = self._alive.copy()
+            with self._db:
+                for path in gone:
+                    alive[self._mark_dead(path)] = False
+                    self._db.execute("DELETE FROM files WHERE path = ?",
+                                     (path,))
+            self._alive = alive
+
+    def _db_read(self, sql, params):
+        with self._lock:
+            return self._db.execute(sql, params).fetchall()
+
+    def _db_write(self, sql, params):
+        with self._lock, self._db:
+            self._db.execute(sql, params)
+
+    # ── Search ──────────────────────────────────────
+    def search(self, query: str, k: int = TOP_K,
+               min_score: float = MIN_SCORE) -> list:
+        return self.search_many([query], k, min_score)[0]
+
+    def search_many(self, queries: list, k: int = TOP_K,
+                    min_score: float = MIN_SCORE) -> list:
+        """Top-`k` chunks per query as (score, path, text), best first.
+
+        All queries are embedded in one request and scored together, one
+        block of the memmap at a time.
+        """
+        if not queries or not len(self):
+            return [[] for _ in queries]
+        q = _normalize(embed(list(queries), self.model))
+        with self._lock:
+            mm, alive = self._matrix(), self._alive
+
+        best_scores = np.full((len(queries), 0), -np.inf, dtype=np.float32)
+        best_rows = np.zeros((len(queries), 0), dtype=np.int64)
+        for start in range(0, len(alive), SEARCH_BLOCK):
+            block = mm[start:start + SEARCH_BLOCK]
+            scores = q @ block.T
+            scores[:, ~alive[start:start + len(block)]] = -np.inf
+            take = min(k, scores.shape[1])
+            top = np.argpartition(-scores, take - 1, axis=1)[:, :take]
+            best_scores = np.concatenate(
+                [best_scores, np.take_along_axis(scores, top, axis=1)], axis=1)
+            best_rows = np.concatenate([best_rows, top + start], axis=1)
+            if best_scores.shape[1] > k:
+                keep = np.argpartition(-best_scores, k - 1, axis=1)[:, :k]
+                best_scores = np.take_along_axis(best_scores, keep, axis=1)
+                best_rows = np.take_along_axis(best_rows, keep, axis=1)
+
+        results = []
+        for scores, rows in zip(best_scores, best_rows):
+            order = np.argsort(-scores)
+            hits = [(float(scores[i]), int(rows[i])) for i in order
+                    if scores[i] >= min_score]
+            results.append(self._chunks(hits))
+        return results
+
+    def _matrix(self):
+        """Read-only memmap over the committed rows (lock held)."""
+        if self._mm is None or self._mm_rows != self._rows:
+            self._mm = np.memmap(self._vec_path, dtype=np.float32, mode="r",
+                                 shape=(self._rows, self.dim))
+            self._mm_rows = self._rows
+        return self._mm
+
+    def _chunks(self, hits):
+        if not hits:
+            return []
+        rows = [row for _, row in hits]
+        marks = ",".join("?" * len(rows))
+        found = dict((r, (p, t)) for r, p, t in self._db_read(
+            f"SELECT row, path, text FROM chunks WHERE row IN ({marks})", rows))
+        return [(score, *found[row]) for score, row in hits if row in found]
+
+
+def format_context(hits) -> str:
+    """Retrieved chunks as numbered excerpts for the prompt."""
+    return "\n\n".join(f"[{i}] {os.path.basename(path)}\n{text}"
+                       for i, (_, path, text) in enumerate(hits, 1))
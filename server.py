@@ -0,0 +1,265 @@
+"""OpenAI-compatible HTTP server backed by the chat engine.
+
+    python server.py --port 8000
+
+Endpoints:
+  GET  /v1/models
+  POST /v1/chat/completions   (supports "stream": true via Server-Sent Events)
+
+Conversation state lives in LangGraph threads. Send a `thread_id` field
+(or an `X-Thread-Id` header) to continue a thread: for a thread that
+already exists only the messages after the last assistant reply are
+appended, so clients may keep resending the full history. Without one,
+every request runs on a throwaway in-memory thread seeded with `messages`.
+
+Threads are kept in their own database (SERVER_DB_PATH), apart from the
+desktop app's chats.
+"""
+import argparse
+import asyncio
+import json
+import os
+import threading
+import time
+import uuid
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from aiohttp import web
+
+from ollama_api import MAX_PARALLEL, fetch_models
+from store import DB_PATH, ChatStore
+
+MAX_QUEUE = 64              # requests waiting or running before 429s
+PER_MODEL = 2               # concurrent generations per model
+SERVER_DB_PATH = os.path.join(os.path.dirname(DB_PATH), "server.db")
+
+
+class ChatServer:
+    def __init__(self, engine, max_queue=MAX_QUEUE, per_model=PER_MODEL,
+                 workers=MAX_PARALLEL, scratch=None):
+        """`scratch` answers requests without a thread id; by default an
+        engine on an in-memory checkpointer sharing `engine`'s models."""
+        self.engine = engine
+        self.scratch = scratch or _scratch_engine(engine)
+        self.max_queue = max_queue
+        self.per_model = per_model
+        self.pool = ThreadPoolExecutor(max_workers=workers,
+                                       thread_name_prefix="generate")
+        self._pending = 0
+        self._model_slots: dict[str, asyncio.Semaphore] = {}
+        # Dropped automatically once no request on the thread is active
+        self._thread_locks = weakref.WeakValueDictionary()
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_get("/v1/models", self.list_models)
+        app.router.add_post("/v1/chat/completions", self.chat_completions)
+        app.on_cleanup.append(self._shutdown)
+        return app
+
+    async def _shutdown(self, _):
+        self.pool.shutdown(wait=False, cancel_futures=True)
+
+    # ── Handlers ────────────────────────────────────
+    async def list_models(self, request):
+        loop = asyncio.get_running_loop()
+        try:
+            names = await loop.run_in_executor(None, fetch_models)
+        except requests.RequestException as e:
+            return _error(502, f"Ollama unavailable: {e}")
+        return web.json_response({
+            "object": "list",
+            "data": [{"id": n, "object": "model", "owned_by": "ollama"}
+                     for n in names],
+        })
+
+    async def chat_completions(self, request):
+        try:
+            body = await request.json()
+            model = body["model"]
+            messages = [_to_message(m) for m in body["messages"]]
+        except (ValueError, KeyError, TypeError) as e:
+            return _error(400, f"invalid request: {e}")
+        if not messages:
+            return _error(400, "messages must not be empty")
+        # Backpressure: refuse instead of queueing without bound
+        if self._pending >= self.max_queue:
+            return _error(429, "server busy, retry later",
+                          headers={"Retry-After": "1"})
+
+        thread_id = body.get("thread_id") or request.headers.get("X-Thread-Id")
+        stateless = not thread_id
+        if stateless:
+            thread_id = f"api_{uuid.uuid4().hex}"
+        generate = self._generate_once if stateless else self.engine.generate
+
+        self._pending += 1
+        try:
+            slots = self._model_slots.setdefault(
+                model, asyncio.Semaphore(self.per_model))
+            lock = self._thread_locks.get(thread_id)
+            if lock is None:
+                lock = self._thread_locks[thread_id] = asyncio.Lock()
+            # One turn at a time per thread keeps its checkpoints ordered
+            async with lock:
+                if not stateless:
+                    loop = asyncio.get_running_loop()
+                    if await loop.run_in_executor(
+                            self.pool, self.engine.has_thread, thread_id):
+                        messages = _new_turn(messages)
+                async with slots:
+                    if body.get("stream"):
+                        return await self._stream(request, generate, model,
+                                                  messages, thread_id)
+                    return await self._complete(generate, model, messages,
+                                                thread_id)
+        finally:
+            self._pending -= 1
+
+    def _generate_once(self, messages, thread_id, model, **kwargs):
+        """Answer on a throwaway scratch thread, then drop it."""
+        try:
+            return self.scratch.generate(messages, thread_id, model, **kwargs)
+        finally:
+            saver = self.scratch.checkpointer
+            saver.storage.pop(thread_id, None)
+            for key in list(saver.writes):
+                if key[0] == thread_id:
+                    saver.writes.pop(key, None)
+            self.scratch.prefixes.forget(thread_id)
+
+    async def _complete(self, generate, model, messages, thread_id):
+        loop = asyncio.get_running_loop()
+        cancel = threading.Event()
+        try:
+            result = await loop.run_in_executor(
+                self.pool, lambda: generate(
+                    messages, thread_id, model, cancel=cancel))
+        except asyncio.CancelledError:
+            cancel.set()
+            raise
+        except Exception as e:
+            return _error(502, str(e))
+        return web.json_response({
+            "id": f"chatcmpl-{uuid.uuid4().hex}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "thread_id": thread_id,
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": result["text"]},
+                "finish_reason": "stop",
+            }],
+            "usage": {"prompt_tokens": result["prompt_tokens"],
+                      "prompt_tokens_details": {
+                          "cached_tokens": result["prefix_tokens"]}},
+        })
+
+    async def _stream(self, request, generate, model, messages, thread_id):
+        loop = asyncio.get_running_loop()
+        chunks: asyncio.Queue = asyncio.Queue()
+        cancel = threading.Event()
+
+        def on_chunk(text):
+            loop.call_soon_threadsafe(chunks.put_nowait, text)
+
+        future = loop.run_in_executor(
+            self.pool, lambda: generate(
+                messages, thread_id, model, on_chunk=on_chunk, cancel=cancel))
+        future.add_done_callback(
+            lambda _: loop.call_soon_threadsafe(chunks.put_nowait, None))
+
+        resp = web.StreamResponse(headers={
+            "Content-Type": "text/event-stream",
+            "Cache-Control": "no-cache",
+            "X-Thread-Id": thread_id,
+        })
+        await resp.prepare(request)
+        cid = f"chatcmpl-{uuid.uuid4().hex}"
+        created = int(time.time())
+
+        def event(delta, finish=None):
+            data = {"id": cid, "object": "chat.completion.chunk",
+                    "created": created, "model": model,
+                    "choices": [{"index": 0, "delta": delta,
+                                 "finish_reason": finish}]}
+            return f"data: {json.dumps(data, ensure_ascii=False)}\n\n".encode()
+
+        try:
+            await resp.write(event({"role": "assistant"}))
+            while (text := await chunks.get()) is not None:
+                await resp.write(event({"content": text}))
+            try:
+                await future
+                await resp.write(event({}, "stop"))
+            except Exception as e:
+                err = {"error": {"message": str(e)}}
+                await resp.write(f"data: {json.dumps(err)}\n\n".encode())
+            await resp.write(b"data: [DONE]\n\n")
+        except (asyncio.CancelledError, ConnectionResetError):
+            # Client went away: stop generating, keep the thread consistent
+            cancel.set()
+            raise
+        return resp
+
+
+def _scratch_engine(engine):
+    from langgraph.checkpoint.memory import MemorySaver
+    from engine import ChatEngine
+    return ChatEngine(MemorySaver(), registry=engine.registry,
+                      cache=engine.cache, notes=engine.notes)
+
+
+def _new_turn(messages):
+    """Messages after the last assistant reply.
+
+    OpenAI clients resend the whole conversation; a thread that already
+    exists only needs what was added since its last answer.
+    """
+    from langchain_core.messages import AIMessage
+    for i in range(len(messages) - 1, -1, -1):
+        if isinstance(messages[i], AIMessage):
+            return messages[i + 1:]
+    return messages
+
+
+def _to_message(m: dict):
+    from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+    kind = {"system": SystemMessage, "user": HumanMessage,
+            "assistant": AIMessage}[m["role"]]
+    return kind(content=m["content"])
+
+
+def _error(status, message, headers=None):
+    return web.json_response({"error": {"message": message}},
+                             status=status, headers=headers)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="OpenAI-compatible server "
+                                                 "for the Ollama chat engine")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--db", default=SERVER_DB_PATH,
+                        help="SQLite file holding the conversation threads")
+    parser.add_argument("--max-queue", type=int, default=MAX_QUEUE)
+    parser.add_argument("--per-model", type=int, default=PER_MODEL)
+    parser.add_argument("--cache", metavar="PATH",
+                        help="reuse replies from this response cache file")
+    args = parser.parse_args(argv)
+
+    from engine import ChatEngine
+    cache = None
+    if args.cache:
+        from cache import ResponseCache
+        cache = ResponseCache(args.cache)
+    engine = ChatEngine(ChatStore(args.db).checkpointer, cache=cache)
+    server = ChatServer(engine, args.max_queue, args.per_model)
+    web.run_app(server.app(), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
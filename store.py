@@ -0,0 +1,329 @@
+"""SQLite persistence for sessions, messages and LangGraph checkpoints.
+
+Everything lives in one WAL-mode database. Reads run on the caller's
+thread; writes are queued and committed in batches by a background
+writer so the UI thread never waits on disk. Message text is indexed
+with FTS5; triggers keep the index in step with every insert and delete.
+"""
+import os
+import queue
+import sqlite3
+import sys
+import threading
+import time
+
+from profiling import tracer
+
+DB_PATH = os.path.join(os.path.expanduser("~"), ".ollama_chat", "chats.db")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    id          INTEGER PRIMARY KEY,
+    title       TEXT NOT NULL,
+    thread_id   TEXT NOT NULL,
+    created     REAL NOT NULL,
+    updated     REAL NOT NULL,
+    titled      INTEGER NOT NULL DEFAULT 0, -- title written by the model
+    summary     TEXT NOT NULL DEFAULT '',   -- rolling summary of the chat
+    summary_upto INTEGER NOT NULL DEFAULT 0 -- messages covered by it
+);
+CREATE TABLE IF NOT EXISTS messages (
+    id          INTEGER PRIMARY KEY AUTOINCREMENT,
+    session_id  INTEGER NOT NULL REFERENCES sessions(id) ON DELETE CASCADE,
+    role        TEXT NOT NULL,
+    content     TEXT NOT NULL,
+    ts          TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_messages_session ON messages(session_id, id);
+CREATE TABLE IF NOT EXISTS settings (
+    key         TEXT PRIMARY KEY,
+    value       TEXT NOT NULL
+);
+"""
+
+FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+    content,
+    content='messages',
+    content_rowid='id',
+    tokenize='unicode61 remove_diacritics 2'
+);
+CREATE TRIGGER IF NOT EXISTS messages_fts_ai AFTER INSERT ON messages BEGIN
+    INSERT INTO messages_fts(rowid, content) VALUES (new.id, new.content);
+END;
+CREATE TRIGGER IF NOT EXISTS messages_fts_ad AFTER DELETE ON messages BEGIN
+    INSERT INTO messages_fts(messages_fts, rowid, content)
+    VALUES ('delete', old.id, old.content);
+END;
+CREATE TRIGGER IF NOT EXISTS messages_fts_au AFTER UPDATE ON messages BEGIN
+    INSERT INTO messages_fts(messages_fts, rowid, content)
+    VALUES ('delete', old.id, old.content);
+    INSERT INTO messages_fts(rowid, content) VALUES (new.id, new.content);
+END;
+"""
+
+# Columns added to existing databases: name -> definition
+SESSION_COLUMNS = {
+    "titled":       "INTEGER NOT NULL DEFAULT 0",
+    "summary":      "TEXT NOT NULL DEFAULT ''",
+    "summary_upto": "INTEGER NOT NULL DEFAULT 0",
+}
+
+# Marks around matched terms in search snippets
+HIT_START, HIT_END = "\x02", "\x03"
+SEARCH_LIMIT = 50
+
+BATCH_SIZE = 256
+WRITE_RETRIES = 5           # for writes that find the database locked
+RETRY_DELAY = 0.05          # seconds, doubled on every retry
+
+
+def _connect(path):
+    conn = sqlite3.connect(path, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA foreign_keys=ON")
+    return conn
+
+
+def _is_busy(error) -> bool:
+    """Whether `error` is a transient lock conflict worth retrying."""
+    if not isinstance(error, sqlite3.OperationalError):
+        return False
+    text = str(error).lower()
+    return "locked" in text or "busy" in text
+
+
+def fts_query(text: str) -> str:
+    """Turn free text into an FTS5 query: every word must match, the last
+    one as a prefix so results update while typing."""
+    words = [w.replace('"', '""') for w in text.split()]
+    if not words:
+        return ""
+    terms = [f'"{w}"' for w in words]
+    terms[-1] += "*"
+    return " ".join(terms)
+
+
+class ChatStore:
+    def __init__(self, path: str = DB_PATH, on_error=None):
+        """`on_error(message)` is called from the writer thread for every
+        write that fails for good; failures are also logged to stderr."""
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self.on_error = on_error
+        self._read = _connect(path)
+        self._read.executescript(SCHEMA)
+        self._migrate()
+        self._init_fts()
+        self._read.commit()
+
+        self._writes: queue.Queue = queue.Queue()
+        self._writer = threading.Thread(target=self._write_loop, daemon=True)
+        self._writer.start()
+
+        self._saver = None
+        self._saver_lock = threading.Lock()
+        self._checkpoint_tables = False
+
+    @property
+    def checkpointer(self):
+        """LangGraph SqliteSaver on this database, created on first use."""
+        with self._saver_lock:
+            if self._saver is None:
+                # Imported here so opening the store doesn't load LangGraph
+                from langgraph.checkpoint.sqlite import SqliteSaver
+                self._saver = SqliteSaver(_connect(self.path))
+                self._saver.setup()
+                tracer.wrap_methods(self._saver, ("put", "put_writes"),
+                                    "checkpoint")
+            return self._saver
+
+    def _migrate(self):
+        have = {row[1] for row in
+                self._read.execute("PRAGMA table_info(sessions)")}
+        for name, definition in SESSION_COLUMNS.items():
+            if name not in have:
+                self._read.execute(
+                    f"ALTER TABLE sessions ADD COLUMN {name} {definition}")
+
+    def _init_fts(self):
+        exists = self._read.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = 'messages_fts'").fetchone()
+        self._read.executescript(FTS_SCHEMA)
+        if not exists:
+            # Databases from before the index: build it once from messages
+            self._read.execute(
+                "INSERT INTO messages_fts(messages_fts) VALUES ('rebuild')")
+
+    # ── Reads ───────────────────────────────────────
+    def list_sessions(self):
+        """(id, title, thread_id, titled, summary, summary_upto) for every
+        session, oldest first."""
+        return self._read.execute(
+            "SELECT id, title, thread_id, titled, summary, summary_upto "
+            "FROM sessions ORDER BY id").fetchall()
+
+    def load_messages(self, session_id):
+        return self._read.execute(
+            "SELECT role, content, ts FROM messages WHERE session_id = ? "
+            "ORDER BY id", (session_id,)).fetchall()
+
+    def search(self, text: str, limit: int = SEARCH_LIMIT):
+        """Newest messages matching `text`, across all sessions.
+
+        Newest-first lets FTS5 walk the index in rowid order and stop at
+        `limit`; ranking by relevance would score every match. Returns
+        (message_id, session_id, title, role, ts, snippet) rows; in the
+        snippet, matched terms are wrapped in HIT_START/HIT_END.
+        """
+        query = fts_query(text)
+        if not query:
+            return []
+        return self._read.execute(
+            "SELECT m.id, m.session_id, s.title, m.role, m.ts, "
+            "       snippet(messages_fts, 0, ?, ?, '…', 12) "
+            "FROM messages_fts "
+            "JOIN messages m ON m.id = messages_fts.rowid "
+            "JOIN sessions s ON s.id = m.session_id "
+            "WHERE messages_fts MATCH ? "
+            "ORDER BY messages_fts.rowid DESC LIMIT ?",
+            (HIT_START, HIT_END, query, limit)).fetchall()
+
+    def message_index(self, session_id, message_id) -> int:
+        """Position of a message within its session's history."""
+        row = self._read.execute(
+            "SELECT COUNT(*) FROM messages WHERE session_id = ? AND id < ?",
+            (session_id, message_id)).fetchone()
+        return row[0]
+
+    def get_setting(self, key, default=None):
+        row = self._read.execute("SELECT value FROM settings WHERE key = ?",
+                                 (key,)).fetchone()
+        return row[0] if row else default
+
+    def max_session_id(self) -> int:
+        row = self._read.execute("SELECT MAX(id) FROM sessions").fetchone()
+        return row[0] or 0
+
+    # ── Writes (queued) ─────────────────────────────
+    def add_session(self, session_id, title, thread_id):
+        now = time.time()
+        self._submit("INSERT INTO sessions (id, title, thread_id, created, "
+                     "updated) VALUES (?, ?, ?, ?, ?)",
+                     (session_id, title, thread_id, now, now))
+
+    def rename_session(self, session_id, title, titled=False):
+        self._submit("UPDATE sessions SET title = ?, titled = ?, updated = ? "
+                     "WHERE id = ?",
+                     (title, int(titled), time.time(), session_id))
+
+    def set_summary(self, session_id, summary, upto):
+        self._submit("UPDATE sessions SET summary = ?, summary_upto = ? "
+                     "WHERE id = ?", (summary, upto, session_id))
+
+    def add_message(self, session_id, role, content, ts):
+        self._submit("INSERT INTO messages (session_id, role, content, ts) "
+                     "VALUES (?, ?, ?, ?)", (session_id, role, content, ts))
+        self._submit("UPDATE sessions SET updated = ? WHERE id = ?",
+                     (time.time(), session_id))
+
+    def delete_last_message(self, session_id):
+        self._submit("DELETE FROM messages WHERE id = (SELECT MAX(id) "
+                     "FROM messages WHERE session_id = ?)", (session_id,))
+
+    def set_setting(self, key, value):
+        self._submit("INSERT OR REPLACE INTO settings VALUES (?, ?)",
+                     (key, str(value)))
+
+    def clear_session(self, session_id, old_thread_id, new_thread_id):
+        self._submit("DELETE FROM messages WHERE session_id = ?", (session_id,))
+        self._submit("UPDATE sessions SET thread_id = ?, updated = ?, "
+                     "titled = 0, summary = '', summary_upto = 0 "
+                     "WHERE id = ?", (new_thread_id, time.time(), session_id))
+        self.delete_thread(old_thread_id)
+
+    def delete_session(self, session_id, thread_id):
+        self._submit("DELETE FROM sessions WHERE id = ?", (session_id,))
+        self.delete_thread(thread_id)
+
+    def delete_thread(self, thread_id):
+        """Drop the LangGraph checkpoints of `thread_id`."""
+        if not self._has_checkpoints():
+            return      # no reply yet, so nothing was checkpointed
+        self._submit("DELETE FROM checkpoints WHERE thread_id = ?", (thread_id,))
+        self._submit("DELETE FROM writes WHERE thread_id = ?", (thread_id,))
+
+    def _has_checkpoints(self) -> bool:
+        # SqliteSaver creates its tables on first use; once there they stay
+        if not self._checkpoint_tables:
+            found = {name for name, in self._read.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'table' "
+                "AND name IN ('checkpoints', 'writes')")}
+            self._checkpoint_tables = len(found) == 2
+        return self._checkpoint_tables
+
+    def _submit(self, sql, params=()):
+        self._writes.put((sql, params))
+
+    def flush(self):
+        """Block until every queued write has been committed."""
+        self._writes.join()
+
+    def close(self):
+        self._writes.put(None)
+        self._writer.join()
+        self._read.close()
+        if self._saver is not None:
+            self._saver.conn.close()
+
+    def _write_loop(self):
+        conn = _connect(self.path)
+        while True:
+            batch = [self._writes.get()]
+            while len(batch) < BATCH_SIZE:
+                try:
+                    batch.append(self._writes.get_nowait())
+                except queue.Empty:
+                    break
+            stop = None in batch
+            try:
+                for op in batch:
+                    if op is not None:
+                        self._retry(conn.execute, *op)
+                try:
+                    self._retry(conn.commit)
+                except sqlite3.Error as e:
+                    conn.rollback()
+                    self._report(f"{len(batch)} escrituras", e)
+            finally:
+                for _ in batch:
+                    self._writes.task_done()
+            if stop:
+                conn.close()
+                return
+
+    def _retry(self, call, sql=None, params=()):
+        """Run `call`, retrying while the database is locked. Failed
+        statements are reported and skipped; a failed commit raises."""
+        args = () if sql is None else (sql, params)
+        for attempt in range(WRITE_RETRIES + 1):
+            try:
+                return call(*args)
+            except sqlite3.Error as e:
+                if _is_busy(e) and attempt < WRITE_RETRIES:
+                    time.sleep(RETRY_DELAY * 2 ** attempt)
+                    continue
+                if sql is None:
+                    raise
+                self._report(sql.split("(")[0].strip(), e)
+                return None
+
+    def _report(self, what, error):
+        message = f"{what}: {error}"
+        print(f"ChatStore: {message}", file=sys.stderr)
+        if self.on_error is not None:
+            try:
+                self.on_error(message)
+            except Exception:
+                pass